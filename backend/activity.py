@@ -0,0 +1,153 @@
+import numpy as np
+import pandas as pd
+
+from data_processing import format_activity_matrix
+from instrumentation import timed
+from timeline import SortedTimes, _datetime64, added_at, earliest, removed_at
+
+# Rolling windows of recent activity, in days up to and including today
+ACTIVITY_WINDOWS = (7, 30, 90)
+
+CELLS = 7 * 24
+
+
+def _cells(times):
+    # Day of the week (Monday = 0; 1970-01-01 was a Thursday) * 24 + hour
+    days = times.astype("datetime64[D]")
+    weekdays = (days.astype(np.int64) + 3) % 7
+    hours = (times - days).astype("timedelta64[h]").astype(np.int64)
+    return weekdays * 24 + hours
+
+
+class LoginIndex(SortedTimes):
+    """Members' last login times, sorted, with running day-of-week × hour counts.
+
+    For every calendar day that has logins, the index keeps the 168 counts
+    of all logins up to the end of that day, so the heatmap of a run of
+    whole days is the difference of two rows; only the logins of a window's
+    last, partial day are counted one by one. Built once per data version.
+    """
+
+    def __init__(self, logged_in):
+        super().__init__(logged_in)
+        self.cells = _cells(self.values).astype(np.int16)
+        self.days, self.day_starts, per_day = np.unique(
+            self.values.astype("datetime64[D]"),
+            return_index=True,
+            return_counts=True,
+        )
+        day_of = np.repeat(np.arange(len(self.days)), per_day)
+        counts = np.bincount(
+            day_of * CELLS + self.cells, minlength=len(self.days) * CELLS
+        ).reshape(len(self.days), CELLS)
+        self.cumulative_cells = np.zeros(
+            (len(self.days) + 1, CELLS), dtype=np.int32
+        )
+        np.cumsum(counts, axis=0, out=self.cumulative_cells[1:])
+
+    @classmethod
+    def from_arrays(cls, values, cells, days, day_starts, cumulative_cells):
+        """Wrap arrays produced by arrays(), e.g. memory-mapped ones, as-is."""
+        logins = super().from_arrays(values)
+        logins.cells = cells
+        logins.days = days
+        logins.day_starts = day_starts
+        logins.cumulative_cells = cumulative_cells
+        return logins
+
+    def arrays(self):
+        return {
+            "values": self.values,
+            "cells": self.cells,
+            "days": self.days,
+            "day_starts": self.day_starts,
+            "cumulative_cells": self.cumulative_cells,
+        }
+
+    def merged(self, added=None, removed=None):
+        """A copy with the logins of added put in and one of each removed out.
+
+        Like SortedTimes.merged, the arrays are copied rather than sorted
+        again, and the running counts are updated by the changed logins only.
+        """
+        values, cells = self.values, self.cells
+        changes = []
+        if removed is not None:
+            positions, gone = removed_at(values, removed)
+            values = np.delete(values, positions)
+            cells = np.delete(cells, positions)
+            changes.append((gone, -1))
+        if added is not None:
+            positions, new, _ = added_at(values, added)
+            values = np.insert(values, positions, new)
+            cells = np.insert(cells, positions, _cells(new).astype(np.int16))
+            changes.append((new, 1))
+
+        days = np.unique(
+            np.concatenate(
+                [self.days, *(times.astype("datetime64[D]") for times, _ in changes)]
+            )
+        )
+        per_day = np.zeros((len(days), CELLS), dtype=np.int32)
+        per_day[np.searchsorted(days, self.days)] = np.diff(
+            self.cumulative_cells, axis=0
+        )
+        for times, sign in changes:
+            day_of = np.searchsorted(days, times.astype("datetime64[D]"))
+            np.add.at(per_day, (day_of, _cells(times)), sign)
+        # Days whose only logins were removed go
+        kept = per_day.any(axis=1)
+        days, per_day = days[kept], per_day[kept]
+        cumulative_cells = np.zeros((len(days) + 1, CELLS), dtype=np.int32)
+        np.cumsum(per_day, axis=0, out=cumulative_cells[1:])
+        day_starts = np.searchsorted(values, days.astype(values.dtype), "left")
+        return LoginIndex.from_arrays(
+            values, cells, days, day_starts, cumulative_cells
+        )
+
+    def total(self):
+        return self.cumulative_cells[-1].reshape(7, 24)
+
+    def _day(self, t):
+        return _datetime64(t).astype("datetime64[D]")
+
+    def counts_between(self, start, end):
+        """7×24 logins from the start of start's day up to and including end."""
+        first = int(np.searchsorted(self.days, self._day(start)))
+        last = max(int(np.searchsorted(self.days, self._day(end))), first)
+        counts = self.cumulative_cells[last] - self.cumulative_cells[first]
+        # Days before end's are whole; end's own day only up to end
+        if last < len(self.days) and self.days[last] == self._day(end):
+            cells = self.cells[self.day_starts[last] : self._right(end)]
+            counts = counts + np.bincount(cells, minlength=CELLS)
+        return counts.astype(np.int32).reshape(7, 24)
+
+
+@timed()
+def calculate_recent_activity(logins, now):
+    """Logins by day of week and hour over each of the ACTIVITY_WINDOWS.
+
+    A window of n days runs from the start of the day n - 1 days before
+    now's up to now. Each member counts once, at their last login.
+    """
+    today = pd.Timestamp(now).normalize()
+    windows = []
+    for days in ACTIVITY_WINDOWS:
+        start = today - pd.Timedelta(days=days - 1)
+        windows.append(
+            {
+                "Days": days,
+                "From": start.strftime("%Y-%m-%d"),
+                **format_activity_matrix(logins.counts_between(start, now)),
+            }
+        )
+    return {"windows": windows}
+
+
+def recent_activity(logins, now):
+    # The windows move on at midnight, and a later login falls into them
+    # once it is in the past
+    next_day = pd.Timestamp(now).normalize() + pd.Timedelta(days=1)
+    return calculate_recent_activity(logins, now), earliest(
+        next_day, logins.next_after(now)
+    )
@@ -0,0 +1,232 @@
+"""ASGI entry point serving the same /api routes as app.py.
+
+    uvicorn asgi:app --workers 4
+    gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker asgi:app
+
+Requests are handled on the event loop; anything that may compute or encode
+an aggregate runs on a fixed pool of threads, and identical requests for the
+same data version that arrive while one is in flight share its result.
+"""
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+
+import pandas as pd
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+from werkzeug.http import parse_accept_header, parse_etags
+
+from config import (
+    ASGI_EXECUTOR_THREADS,
+    DATA_RELOAD_INTERVAL,
+    METRICS_ENABLED,
+    METRICS_TRACK_MEMORY,
+)
+from cube import CubeFilters
+from encoding import supported_encodings
+from instrumentation import metrics, server_timing
+from routes import SNAPSHOT_ROUTES
+from shared_data import open_store
+
+
+class SingleFlight:
+    """Runs blocking calls on an executor, at most one per key at a time.
+
+    A caller asking for a key that is already being computed awaits the
+    running call instead of starting another, so a burst of identical
+    requests costs one computation.
+    """
+
+    def __init__(self, executor):
+        self.executor = executor
+        self.coalesced = 0
+        self._running = {}
+
+    async def run(self, key, func):
+        future = self._running.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().run_in_executor(self.executor, func)
+            self._running[key] = future
+            future.add_done_callback(lambda _: self._running.pop(key, None))
+        else:
+            self.coalesced += 1
+        # A client going away must not cancel the call for everyone else
+        return await asyncio.shield(future)
+
+
+metrics.configure(METRICS_ENABLED, METRICS_TRACK_MEMORY)
+
+store = open_store()
+store.start_watcher(DATA_RELOAD_INTERVAL)
+
+flights = SingleFlight(
+    ThreadPoolExecutor(ASGI_EXECUTOR_THREADS, thread_name_prefix="aggregate")
+)
+
+
+def _collect(func, *args):
+    # Runs on the executor; its stages go out with every response sharing it
+    metrics.begin_request()
+    try:
+        result = func(*args)
+    finally:
+        stages = metrics.end_request()
+    return result, stages
+
+
+async def current_version():
+    # SharedDataStore.current can wait for a version to be published or
+    # mapped; requests arriving meanwhile share one call off the event loop
+    return await flights.run("current", lambda: store.current)
+
+
+async def compute(request, key, func, *args):
+    result, stages = await flights.run(key, partial(_collect, func, *args))
+    request.state.stages = stages
+    return result
+
+
+def endpoint(handler):
+    """Record the request's duration and stages like routes.py's hooks."""
+
+    @wraps(handler)
+    async def wrapper(request):
+        start = time.perf_counter()
+        request.state.stages = []
+        response = await handler(request)
+        if metrics.enabled:
+            total = time.perf_counter() - start
+            metrics.observe(f"request.{handler.__name__}", total)
+            timing = server_timing(request.state.stages)
+            response.headers["Server-Timing"] = (
+                f"{timing}, total;dur={total * 1000:.2f}"
+                if timing
+                else f"total;dur={total * 1000:.2f}"
+            )
+        return response
+
+    return wrapper
+
+
+def _variant(body, encoding):
+    return body.variant_etag(encoding), body.variant(encoding)
+
+
+def _snapshot_variant(current, name, as_of, encoding):
+    return _variant(current.snapshot.body(name, as_of=as_of), encoding)
+
+
+def _filtered_variant(current, name, filters, as_of, encoding):
+    return _variant(current.snapshot.filtered_body(name, filters, as_of), encoding)
+
+
+def send_variant(request, etag, content, encoding):
+    # The same headers and 304 handling as routes.send_body
+    if parse_etags(request.headers.get("if-none-match")).contains(etag):
+        response = Response(status_code=304)
+    else:
+        response = Response(content, media_type="application/json")
+        if encoding != "identity":
+            response.headers["Content-Encoding"] = encoding
+    response.headers["ETag"] = f'"{etag}"'
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def _encoding(request):
+    return parse_accept_header(request.headers.get("accept-encoding")).best_match(
+        supported_encodings(), default="identity"
+    )
+
+
+async def snapshot_response(request, name=None):
+    # ?as_of=YYYY-MM-DD evaluates active/expired/new-this-month at that time;
+    # region, city, status, from, to and amount slice the data (see cube.py)
+    as_of = request.query_params.get("as_of")
+    current = await current_version()
+    encoding = _encoding(request)
+    try:
+        as_of = pd.Timestamp(as_of) if as_of else None
+        filters = CubeFilters.from_args(request.query_params)
+        if filters is None:
+            key = (current.version, name, as_of, encoding)
+            etag, content = await compute(
+                request, key, _snapshot_variant, current, name, as_of, encoding
+            )
+        else:
+            key = (current.version, name, as_of, encoding, *filters.key())
+            etag, content = await compute(
+                request,
+                key,
+                _filtered_variant,
+                current,
+                name,
+                filters,
+                as_of,
+                encoding,
+            )
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    return send_variant(request, etag, content, encoding)
+
+
+def snapshot_endpoint(name):
+    async def handler(request):
+        return await snapshot_response(request, name)
+
+    handler.__name__ = name or "dashboard"
+    return endpoint(handler)
+
+
+@endpoint
+async def data_version(request):
+    current = await current_version()
+    return JSONResponse(current.describe())
+
+
+@endpoint
+async def stage_metrics(request):
+    if not metrics.enabled:
+        return Response(status_code=404)
+    current = await current_version()
+    gauges = {
+        "cita_data_load_seconds": (
+            "Time taken to load the current data version.",
+            current.load_duration,
+        ),
+        "cita_data_loaded_timestamp_seconds": (
+            "When the current data version was loaded.",
+            current.loaded_at,
+        ),
+        "cita_data_members": (
+            "Members in the current data version.",
+            current.timeline.total_members,
+        ),
+        "cita_data_payments": (
+            "Payments in the current data version.",
+            current.timeline.total_payments,
+        ),
+        "cita_coalesced_requests": (
+            "Requests served by an identical computation already in flight.",
+            flights.coalesced,
+        ),
+    }
+    return Response(
+        metrics.prometheus(gauges), media_type="text/plain; version=0.0.4"
+    )
+
+
+app = Starlette(
+    routes=[
+        Route("/api/data_version", data_version),
+        Route("/api/_metrics", stage_metrics),
+        *(Route(path, snapshot_endpoint(name)) for path, name in SNAPSHOT_ROUTES),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=["*"])],
+)
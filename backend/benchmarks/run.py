@@ -0,0 +1,421 @@
+"""Time data loading, each aggregation and each endpoint on synthetic data.
+
+Run from the backend directory:
+
+    python -m benchmarks.run --sizes 1k,100k          # compare with baselines
+    python -m benchmarks.run --sizes 1k,100k --save   # record new baselines
+
+Datasets are generated once per size under --workdir and reused. Each
+benchmark reports the best of --repeat runs; refresh/ benchmarks time
+picking up a block of appended rows on a copy of the dataset. Baselines are
+scaled by how long a fixed calibration loop takes here against where they
+were recorded, and a result slower than its scaled baseline by more than
+--tolerance and --noise-floor is reported as a regression and the command
+exits non-zero, as does a members frame larger than MEMBER_BYTES_BUDGET
+bytes per member. The SQLite storage's queries are timed too, and any
+result that differs from its pandas counterpart also fails the run.
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import shutil
+import sys
+import time
+from datetime import datetime
+from functools import partial
+
+os.environ.setdefault("CITA_DATA_RELOAD_INTERVAL", "0")
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+from benchmarks.synthetic import (  # noqa: E402
+    generate_members,
+    generate_payments,
+    parse_size,
+    write_dataset,
+    write_rolled,
+)
+from data_processing import (  # noqa: E402
+    MEMBER_BYTES_BUDGET,
+    MEMBER_DATE_FORMATS,
+    PAID_AT_FORMAT,
+    parse_dates,
+    bytes_per_member,
+    load_and_preprocess_data,
+    calculate_key_metrics,
+    process_regions,
+    calculate_membership_status,
+    calculate_payment_distribution,
+    calculate_renewal_funnel,
+    calculate_income_trend,
+    calculate_activity_heatmap,
+    calculate_nz_distribution,
+    calculate_new_members,
+)
+from activity import LoginIndex, calculate_recent_activity  # noqa: E402
+from cohorts import (  # noqa: E402
+    RenewalTimeline,
+    calculate_active_members_history,
+    calculate_cohort_retention,
+)
+from cube import build_cube  # noqa: E402
+from data_store import DataStore  # noqa: E402
+from rolled import load_rolled_exports  # noqa: E402
+from routes import create_app  # noqa: E402
+from snapshot import build_snapshot  # noqa: E402
+from sql_storage import SQLiteStorage  # noqa: E402
+from streaming import stream_aggregates  # noqa: E402
+
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+
+ENDPOINTS = [
+    "dashboard",
+    "key_metrics",
+    "region_distribution",
+    "membership_status",
+    "payment_distribution",
+    "renewal_funnel",
+    "income_trend",
+    "activity_heatmap",
+    "nz_city_distribution",
+    "new_members",
+    "cohort_retention",
+    "active_members_history",
+    "recent_activity",
+]
+
+# Sliced through the data cube
+FILTERED_ENDPOINTS = [
+    "income_trend?region=Auckland&from=2023-01",
+    "dashboard?region=Wellington&status=active",
+]
+
+# Rows appended before each timed refresh
+REFRESH_ROWS = 1_000
+
+
+
+def measure(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def calibrate(repeat):
+    """Seconds a fixed mix of NumPy, pandas and interpreter work takes."""
+    values = np.random.default_rng(0).random(1_000_000)
+    groups = (values * 100).astype(np.int64)
+
+    def work():
+        np.sort(values)
+        pd.Series(values).groupby(groups).sum()
+        sum(i * i for i in range(300_000))
+
+    return measure(work, max(repeat, 5))
+
+
+def load_benchmarks(data_dir):
+    return {
+        "load/csv": lambda: load_and_preprocess_data(data_dir, use_cache=False),
+        "load/cached": lambda: load_and_preprocess_data(data_dir),
+        "load/streaming": lambda: stream_aggregates(data_dir),
+        # Twelve monthly files, without the cache
+        "load/rolled": lambda: load_rolled_exports(os.path.join(data_dir, "rolled")),
+    }
+
+
+def date_benchmarks(data_dir):
+    """parse_dates for each date column, and the pd.to_datetime call it replaced."""
+    columns = [
+        ("members.csv", col, format) for col, format in MEMBER_DATE_FORMATS.items()
+    ]
+    columns.append(("payments.csv", "Paid at", PAID_AT_FORMAT))
+    benchmarks = {}
+    for filename, col, format in columns:
+        values = pd.read_csv(os.path.join(data_dir, filename), usecols=[col])[col]
+        benchmarks[f"dates/{col}"] = partial(parse_dates, values, format)
+        benchmarks[f"dates/{col}/to_datetime"] = partial(
+            pd.to_datetime, values, format=format, errors="coerce"
+        )
+    return benchmarks
+
+
+def aggregation_benchmarks(members, payments):
+    renewals = RenewalTimeline.from_payments(payments)
+    logins = LoginIndex(members["Last logged in"])
+    return {
+        "calculate_key_metrics": lambda: calculate_key_metrics(members),
+        "process_regions": lambda: process_regions(members, "Region"),
+        "calculate_membership_status": lambda: calculate_membership_status(members),
+        "calculate_payment_distribution": lambda: calculate_payment_distribution(
+            payments
+        ),
+        "calculate_renewal_funnel": lambda: calculate_renewal_funnel(members),
+        "calculate_income_trend": lambda: calculate_income_trend(payments),
+        "calculate_activity_heatmap": lambda: calculate_activity_heatmap(members),
+        "calculate_nz_distribution": lambda: calculate_nz_distribution(members),
+        "calculate_new_members": lambda: calculate_new_members(members),
+        "build_snapshot": lambda: build_snapshot(members, payments),
+        "build_cube": lambda: build_cube(members, payments, datetime.now()),
+        "build_renewal_timeline": lambda: RenewalTimeline.from_payments(payments),
+        "calculate_cohort_retention": lambda: calculate_cohort_retention(
+            members, renewals, datetime.now()
+        ),
+        "calculate_active_members_history": lambda: calculate_active_members_history(
+            members, renewals, datetime.now()
+        ),
+        "build_login_index": lambda: LoginIndex(members["Last logged in"]),
+        "calculate_recent_activity": lambda: calculate_recent_activity(
+            logins, datetime.now()
+        ),
+    }
+
+
+def sql_benchmarks(storage, members, payments):
+    """(pandas, SQLite) pairs computing the same result, by function name."""
+    now = datetime.now()
+    return {
+        "calculate_key_metrics": (
+            partial(calculate_key_metrics, members, now),
+            partial(storage.calculate_key_metrics, now),
+        ),
+        "process_regions": (
+            partial(process_regions, members, "Region"),
+            storage.process_regions,
+        ),
+        "calculate_membership_status": (
+            partial(calculate_membership_status, members, now),
+            partial(storage.calculate_membership_status, now),
+        ),
+        "calculate_payment_distribution": (
+            partial(calculate_payment_distribution, payments),
+            storage.calculate_payment_distribution,
+        ),
+        "calculate_renewal_funnel": (
+            partial(calculate_renewal_funnel, members),
+            storage.calculate_renewal_funnel,
+        ),
+        "calculate_income_trend": (
+            partial(calculate_income_trend, payments),
+            storage.calculate_income_trend,
+        ),
+        "calculate_activity_heatmap": (
+            partial(calculate_activity_heatmap, members),
+            storage.calculate_activity_heatmap,
+        ),
+        "calculate_nz_distribution": (
+            partial(calculate_nz_distribution, members),
+            storage.calculate_nz_distribution,
+        ),
+        "calculate_nz_distribution/filtered": (
+            partial(calculate_nz_distribution, members, "active", "2023-01"),
+            partial(storage.calculate_nz_distribution, "active", "2023-01"),
+        ),
+        "calculate_new_members": (
+            partial(calculate_new_members, members),
+            storage.calculate_new_members,
+        ),
+    }
+
+
+def same_result(a, b):
+    # Sums may differ in the last bits between pandas and SQLite
+    if isinstance(a, float) or isinstance(b, float):
+        return math.isclose(a, b, rel_tol=1e-9)
+    if isinstance(a, dict) and isinstance(b, dict):
+        return list(a) == list(b) and all(same_result(a[k], b[k]) for k in a)
+    if isinstance(a, (list, tuple)) and isinstance(b, (list, tuple)):
+        return len(a) == len(b) and all(map(same_result, a, b))
+    return a == b
+
+
+def refresh_benchmarks(data_dir, repeat):
+    """An incremental refresh after appending rows, on a copy of data_dir.
+
+    Appending members not seen before and payments should cost about the
+    same at every size; replacing members takes a copy of every member row.
+    """
+    refresh_dir = os.path.join(data_dir, "refresh")
+    os.makedirs(refresh_dir, exist_ok=True)
+    for name in ("members.csv", "payments.csv"):
+        shutil.copy(os.path.join(data_dir, name), refresh_dir)
+    store = DataStore(refresh_dir)
+    last_id = int(store.current.members["Member ID"].max())
+
+    def rows(frame):
+        return frame.to_csv(index=False, header=False, lineterminator="\r\n")
+
+    appends = {
+        "refresh/new_members": (
+            "members.csv",
+            [
+                rows(generate_members(REFRESH_ROWS, i, last_id + i * REFRESH_ROWS))
+                for i in range(repeat)
+            ],
+        ),
+        "refresh/replaced_members": (
+            "members.csv",
+            [rows(generate_members(REFRESH_ROWS, i)) for i in range(repeat)],
+        ),
+        "refresh/payments": (
+            "payments.csv",
+            [rows(generate_payments(REFRESH_ROWS, last_id, i)) for i in range(repeat)],
+        ),
+    }
+
+    def refresh(filename, pending):
+        with open(os.path.join(refresh_dir, filename), "a", newline="") as f:
+            f.write(pending.pop())
+        store.reload_if_changed()
+
+    return {
+        name: partial(refresh, filename, pending)
+        for name, (filename, pending) in appends.items()
+    }
+
+
+def endpoint_benchmarks(data_dir):
+    client = create_app(DataStore(data_dir)).test_client()
+    headers = {"Accept-Encoding": "gzip, br"}
+    return {
+        f"endpoint/{name}": (
+            lambda name=name: client.get(f"/api/{name}", headers=headers)
+        )
+        for name in ENDPOINTS + FILTERED_ENDPOINTS
+    }
+
+
+def run_size(label, workdir, repeat):
+    data_dir = os.path.join(workdir, label)
+    if not os.path.exists(os.path.join(data_dir, "payments.csv")):
+        print(f"Generating {label} dataset in {data_dir}", file=sys.stderr)
+        write_dataset(data_dir, parse_size(label))
+    if not os.path.exists(os.path.join(data_dir, "rolled")):
+        write_rolled(data_dir, os.path.join(data_dir, "rolled"))
+
+    # Populates the columnar cache, so load/cached measures a warm start
+    members, payments = load_and_preprocess_data(data_dir)
+
+    # Loading and date parsing are slow at large sizes; time them once rather
+    # than --repeat times
+    results = {}
+    load_repeat = repeat if parse_size(label) <= 100_000 else 1
+    benchmarks = load_benchmarks(data_dir)
+    benchmarks.update(date_benchmarks(data_dir))
+    for name, fn in benchmarks.items():
+        results[name] = measure(fn, load_repeat)
+
+    sqlite_path = os.path.join(data_dir, ".cache", "benchmark.sqlite3")
+    os.makedirs(os.path.dirname(sqlite_path), exist_ok=True)
+    members_csv = os.path.join(data_dir, "members.csv")
+    payments_csv = os.path.join(data_dir, "payments.csv")
+
+    def load_sqlite():
+        storage, _ = SQLiteStorage.create(sqlite_path, members_csv, payments_csv)
+        storage.close()
+
+    results["load/sqlite"] = measure(load_sqlite, load_repeat)
+
+    benchmarks = aggregation_benchmarks(members, payments)
+    benchmarks.update(endpoint_benchmarks(data_dir))
+    benchmarks.update(refresh_benchmarks(data_dir, repeat))
+    for name, fn in benchmarks.items():
+        results[name] = measure(fn, repeat)
+
+    mismatches = []
+    storage = SQLiteStorage.open(sqlite_path)
+    for name, (pandas_fn, sql_fn) in sql_benchmarks(
+        storage, members, payments
+    ).items():
+        results[f"sql/{name}"] = measure(sql_fn, repeat)
+        if not same_result(pandas_fn(), sql_fn()):
+            mismatches.append(f"{label} sql/{name}")
+    storage.close()
+    return results, bytes_per_member(members), mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1k,100k", help="e.g. 1k,100k,1m")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--workdir", default=os.path.join("/tmp", "cita-benchmarks"))
+    parser.add_argument("--baselines", default=BASELINES)
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument(
+        "--noise-floor",
+        type=float,
+        default=2.0,
+        help="milliseconds a result may exceed its baseline by whatever "
+        "--tolerance says",
+    )
+    parser.add_argument("--save", action="store_true", help="store as new baselines")
+    args = parser.parse_args()
+
+    baselines = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines) as f:
+            baselines = json.load(f)
+    calibrations = baselines.setdefault("calibration", {})
+    host = baselines.get("host", "the baselines' host")
+
+    regressions = []
+    differing = []
+    for label in args.sizes.split(","):
+        # The machine's speed can drift during a long run, so each size is
+        # calibrated before and after its benchmarks
+        calibration = calibrate(args.repeat)
+        results, member_bytes, mismatches = run_size(
+            label, args.workdir, args.repeat
+        )
+        calibration = min(calibration, calibrate(args.repeat))
+        # Baselines from a machine half as fast count for half as long here
+        scale = calibration / calibrations.get(label, calibration)
+        baseline = baselines.get(label, {})
+        print(f"\n{label} members")
+        print(f"  calibration {calibration * 1000:.2f} ms, {scale:.2f}x that on {host}")
+        line = f"  {'bytes per member':<52} {member_bytes:10.2f}"
+        if member_bytes > MEMBER_BYTES_BUDGET:
+            line += f"  OVER BUDGET ({MEMBER_BYTES_BUDGET})"
+            regressions.append(f"{label} bytes per member")
+        print(line)
+        for name, seconds in results.items():
+            line = f"  {name:<52} {seconds * 1000:10.2f} ms"
+            if name in baseline:
+                expected = baseline[name] * scale
+                ratio = seconds / expected
+                line += f"  ({ratio:5.2f}x baseline)"
+                slower = seconds - expected > args.noise_floor / 1000
+                if ratio > 1 + args.tolerance and slower:
+                    line += "  REGRESSION"
+                    regressions.append(f"{label} {name}")
+            print(line)
+        for name in mismatches:
+            print(f"  {name.split(' ', 1)[1]:<52} DIFFERS FROM PANDAS")
+        differing.extend(mismatches)
+        if args.save:
+            baselines[label] = results
+            calibrations[label] = calibration
+
+    if args.save:
+        baselines["host"] = f"{platform.node()} ({os.cpu_count()} cores)"
+        with open(args.baselines, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+    if differing:
+        print(f"\n{len(differing)} differ(s) from pandas: {', '.join(differing)}")
+    if regressions and not args.save:
+        print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+    if differing or (regressions and not args.save):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
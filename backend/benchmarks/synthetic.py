@@ -0,0 +1,243 @@
+"""Synthetic members.csv / payments.csv exports for benchmarking.
+
+The files follow the real export layout: BOM-prefixed UTF-8 with CRLF line
+endings, CITANZ member IDs, "$60.00"-style amounts, the mixed date formats
+used by each column, "\\t-" placeholders for missing payment dates and a mix
+of English and Chinese region names.
+"""
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+MONTHS = np.array(
+    ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+)
+
+# (Region, City, weight); None is written as "N/A" like the real export
+LOCATIONS = [
+    (None, None, 36.0),
+    ("Auckland", "Auckland", 23.0),
+    ("Wellington", "Wellington", 15.5),
+    ("Canterbury", "Christchurch", 8.8),
+    ("Wellington", "Lower Hutt", 5.0),
+    ("Wellington", "Porirua", 3.1),
+    ("Waikato", "Hamilton", 1.2),
+    ("Canterbury", "Lincoln", 1.0),
+    ("Wellington", "Upper Hutt", 0.6),
+    ("Canterbury", "Rolleston", 0.4),
+    ("Manawatu-Wanganui", "Palmerston North", 0.3),
+    ("Manawatū-Whanganui", "Palmerston North", 0.2),
+    ("Bei Jing Shi", None, 0.3),
+    ("北京市", None, 0.3),
+    ("浙江省", "杭州市", 0.3),
+    ("Zhe Jiang Sheng", "Hang Zhou Shi", 0.2),
+    ("Shanghai Shi", None, 0.2),
+    ("Shang Hai Shi", None, 0.2),
+    ("He Bei Sheng", "Shi Jia Zhuang Shi", 0.2),
+    ("Auckland", "Wainui", 0.3),
+    ("Auckland", "Whangaparāoa", 0.2),
+    ("Bay of Plenty", "Papamoa", 0.2),
+    ("Otago", "Queenstown", 0.2),
+    ("Otago", "Dunedin", 0.2),
+    ("Southland", "Invercargill", 0.2),
+    ("Taranaki", "New Plymouth", 0.2),
+    ("Hawke&#039;s Bay", "Napier", 0.2),
+    ("Te Whanga-nui-a-Tara", "Te Awakairangi", 0.1),
+    ("Waitaha", "Rolleston", 0.1),
+    ("NSW", "Sydney", 0.1),
+    ("IDF", "Paris", 0.1),
+]
+
+AMOUNTS = ["$60.00", "$48.00", "$30.00"]
+AMOUNT_WEIGHTS = [0.39, 0.33, 0.28]
+
+START = pd.Timestamp("2021-08-01")
+END = pd.Timestamp("2024-09-30")
+
+
+def _random_times(rng, n, start, end):
+    # Minute resolution, like the exports
+    start = np.asarray(start, dtype="datetime64[m]").astype(np.int64)
+    end = np.asarray(end, dtype="datetime64[m]").astype(np.int64)
+    minutes = start + (rng.random(n) * (end - start)).astype(np.int64)
+    return pd.DatetimeIndex(minutes.astype("datetime64[m]"))
+
+
+def _str(values):
+    return pd.Series(values).astype(str)
+
+
+def format_long(times):
+    # "Sep 4, 2021, 2:02 PM": no zero padding on the day or the hour
+    hour = times.hour.to_numpy()
+    return (
+        _str(MONTHS[times.month.to_numpy() - 1])
+        + " "
+        + _str(times.day)
+        + ", "
+        + _str(times.year)
+        + ", "
+        + _str((hour + 11) % 12 + 1)
+        + ":"
+        + _str(times.minute).str.zfill(2)
+        + " "
+        + _str(np.where(hour < 12, "AM", "PM"))
+    )
+
+
+def format_day(times):
+    # "2/10/2024"
+    return (
+        _str(times.day) + "/" + _str(times.month).str.zfill(2) + "/" + _str(times.year)
+    )
+
+
+def format_day_time(times):
+    # "30/09/2023 22:47"
+    return pd.Series(times.strftime("%d/%m/%Y %H:%M"))
+
+
+def member_ids(start, count):
+    width = max(4, len(str(start + count)))
+    return "CITANZ-" + _str(np.arange(start + 1, start + count + 1)).str.zfill(width)
+
+
+def generate_members(n, seed=0, first_id=0):
+    rng = np.random.default_rng(seed)
+    is_member = rng.random(n) < 0.66
+    ids = pd.Series("", index=range(n))
+    ids[is_member] = member_ids(first_id, int(is_member.sum())).to_numpy()
+
+    signed_up = _random_times(rng, n, START, END)
+    offsets = rng.random(n) * (END - signed_up).total_seconds()
+    last_login = signed_up + pd.to_timedelta(offsets, unit="s").floor("min")
+
+    years = rng.integers(1, 4, n)
+    expiry = signed_up.normalize() + pd.to_timedelta(years * 365, unit="D")
+    expiry_text = format_day(expiry).where(is_member, "")
+
+    paid = is_member & (rng.random(n) < 0.86)
+    last_payment = _random_times(rng, n, signed_up, END)
+    last_payment_text = format_day_time(last_payment).where(paid, "\t-")
+
+    weights = np.array([w for _, _, w in LOCATIONS])
+    location = rng.choice(len(LOCATIONS), n, p=weights / weights.sum())
+    regions = np.array([r or "N/A" for r, _, _ in LOCATIONS], dtype=object)
+    cities = np.array([c or "N/A" for _, c, _ in LOCATIONS], dtype=object)
+
+    return pd.DataFrame(
+        {
+            "Member ID": ids,
+            "Expiry date": expiry_text,
+            "Last Payment Date": last_payment_text,
+            "Region": regions[location],
+            "City": cities[location],
+            "Date Signed up": format_long(signed_up),
+            "Last logged in": format_long(last_login),
+        }
+    )
+
+
+def generate_payments(n, member_count, seed=0):
+    rng = np.random.default_rng(seed + 1)
+    paid_at = _random_times(rng, n, START, END)
+    extended_to = paid_at.normalize() + pd.Timedelta(days=365)
+    return pd.DataFrame(
+        {
+            "Order#": pd.Series(rng.integers(0, 2**32, n)).map("{:08X}".format),
+            "Member ID": "CITANZ-"
+            + _str(rng.integers(1, max(member_count, 1) + 1, n)).str.zfill(
+                max(4, len(str(member_count)))
+            ),
+            "Comment": "Membership extended to "
+            + pd.Series(extended_to.strftime("%d/%m/%Y")),
+            "Amount": rng.choice(AMOUNTS, n, p=AMOUNT_WEIGHTS),
+            "Status": "Captured",
+            "Paid at": format_long(paid_at),
+        }
+    )
+
+
+def _write(path, frames):
+    for i, frame in enumerate(frames):
+        frame.to_csv(
+            path,
+            index=False,
+            header=i == 0,
+            mode="w" if i == 0 else "a",
+            encoding="utf-8-sig" if i == 0 else "utf-8",
+            lineterminator="\r\n",
+        )
+
+
+def write_dataset(data_dir, n_members, n_payments=None, seed=0, chunk_size=1_000_000):
+    """Write members.csv and payments.csv with the given row counts.
+
+    Rows are generated and written in chunks so memory stays bounded for
+    multi-million row exports.
+    """
+    n_payments = int(n_members * 1.5) if n_payments is None else n_payments
+    os.makedirs(data_dir, exist_ok=True)
+
+    # About two thirds of member rows carry an ID; payments reference those
+    member_count = 0
+
+    def member_chunks():
+        nonlocal member_count
+        for i, start in enumerate(range(0, n_members, chunk_size)):
+            chunk = generate_members(
+                min(chunk_size, n_members - start), seed + i, member_count
+            )
+            member_count += int((chunk["Member ID"] != "").sum())
+            yield chunk
+
+    _write(os.path.join(data_dir, "members.csv"), member_chunks())
+    _write(
+        os.path.join(data_dir, "payments.csv"),
+        (
+            generate_payments(min(chunk_size, n_payments - start), member_count, seed + i)
+            for i, start in enumerate(range(0, n_payments, chunk_size))
+        ),
+    )
+
+
+def write_rolled(data_dir, rolled_dir, months=12):
+    """Split data_dir's exports into members_YYYYMM.csv / payments_YYYYMM.csv.
+
+    Rows are dealt out in order, an equal share per month, like exports
+    rolled monthly.
+    """
+    os.makedirs(rolled_dir, exist_ok=True)
+    periods = pd.period_range(START, periods=months, freq="M")
+    for name in ("members", "payments"):
+        path = os.path.join(data_dir, f"{name}.csv")
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            header, *rows = f.readlines()
+        bounds = np.linspace(0, len(rows), months + 1).astype(int)
+        for period, start, end in zip(periods, bounds[:-1], bounds[1:]):
+            month = period.strftime("%Y%m")
+            path = os.path.join(rolled_dir, f"{name}_{month}.csv")
+            with open(path, "w", encoding="utf-8-sig", newline="") as f:
+                f.write(header)
+                f.writelines(rows[start:end])
+
+
+def parse_size(text):
+    text = text.lower()
+    for suffix, factor in (("k", 1_000), ("m", 1_000_000)):
+        if text.endswith(suffix):
+            return int(float(text[:-1]) * factor)
+    return int(text)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("data_dir")
+    parser.add_argument("members", type=parse_size, help="e.g. 1k, 100k, 1m")
+    parser.add_argument("--payments", type=parse_size)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    write_dataset(args.data_dir, args.members, args.payments, args.seed)
@@ -0,0 +1,340 @@
+import numpy as np
+import pandas as pd
+
+from data_processing import format_month, month_ordinal
+from instrumentation import timed
+from timeline import next_month_start
+
+# Renewal lags are counted in buckets of this many days
+LAG_BUCKET_DAYS = 30
+
+
+def _days(times):
+    return times.astype("datetime64[D]").astype(np.int64)
+
+
+def _months(times):
+    return times.astype("datetime64[M]").astype(np.int64)
+
+
+def _firsts(ids):
+    first = np.ones(len(ids), dtype=bool)
+    first[1:] = ids[1:] != ids[:-1]
+    return first
+
+
+def _group_cummax(groups, values):
+    # Running maximum within each run of equal, ascending group numbers:
+    # offsetting every group past the previous one's values makes a single
+    # accumulate restart at each group boundary
+    base = values.min() if len(values) else 0
+    span = (values.max() - base + 1) if len(values) else 1
+    offsets = groups * span
+    return np.maximum.accumulate(values - base + offsets) - offsets + base
+
+
+def _sort_keys(member_ids, paid):
+    # Member in the high half, seconds since 1970 in the low one (good until
+    # 2106), so one int64 sort orders payments by member, then time
+    seconds = paid.astype("datetime64[s]").astype(np.int64)
+    return (member_ids.astype(np.int64) << 32) | seconds
+
+
+class RenewalTimeline:
+    """Every payment's member, time and extension date, sorted by member and time.
+
+    Built once per data version (and extended in place of a rebuild when
+    payments are appended); cohort_retention() then derives everything
+    with array operations over it, without joining payments to members per
+    member.
+    """
+
+    def __init__(self, member_ids, paid, extended):
+        self.member_ids = member_ids
+        self.paid = paid
+        self.extended = extended
+
+    @classmethod
+    def from_payments(cls, payments):
+        ids = payments["Member ID"].to_numpy(dtype=np.float64, na_value=np.nan)
+        paid = payments["Paid at"].to_numpy(dtype="datetime64[ns]")
+        known = ~np.isnan(ids) & ~np.isnat(paid)
+        ids = ids[known].astype(np.int32)
+        paid = paid[known]
+        extended = payments["Extended To"].to_numpy(dtype="datetime64[ns]")[known]
+        order = np.argsort(_sort_keys(ids, paid), kind="stable")
+        return cls(ids[order], paid[order], extended[order])
+
+    @classmethod
+    def from_arrays(cls, member_ids, paid, extended):
+        """Wrap arrays produced by arrays(), e.g. memory-mapped ones, as-is."""
+        return cls(member_ids, paid, extended)
+
+    def arrays(self):
+        return {
+            "member_ids": self.member_ids,
+            "paid": self.paid,
+            "extended": self.extended,
+        }
+
+    def __len__(self):
+        return len(self.member_ids)
+
+    def extend(self, payments):
+        """A timeline with payments added; this one is left as it was."""
+        added = RenewalTimeline.from_payments(payments)
+        # Both are sorted, so the added rows are merged in rather than the
+        # whole timeline sorted again; they go after equal keys already seen
+        positions = np.searchsorted(
+            _sort_keys(self.member_ids, self.paid),
+            _sort_keys(added.member_ids, added.paid),
+            side="right",
+        )
+        return RenewalTimeline(
+            np.insert(self.member_ids, positions, added.member_ids),
+            np.insert(self.paid, positions, added.paid),
+            np.insert(self.extended, positions, added.extended),
+        )
+
+    def _made_by(self, now):
+        # Payments made by now, each with the day the member's coverage runs
+        # to after it and whether it is the member's first
+        made = self.paid <= np.datetime64(pd.Timestamp(now), "ns")
+        ids = self.member_ids[made]
+        paid = _days(self.paid[made])
+        # A payment covers at least the day it was made on, also when its
+        # comment has no date (NaT is the smallest day number) or an earlier one
+        extended = np.maximum(_days(self.extended[made]), paid)
+
+        first = _firsts(ids)
+        covered_until = _group_cummax(np.cumsum(first) - 1, extended)
+        return ids, paid, covered_until, first
+
+    def intervals(self, now):
+        """Each member's coverage from payments made by now, as disjoint intervals.
+
+        A payment covers the days from when it was made to the date it
+        extends the membership to; overlapping or adjacent coverage is
+        merged, so the intervals of a member never share a day. The last
+        one may run into the future.
+        """
+        ids, paid, covered_until, first = self._made_by(now)
+        intervals = _runs(ids, first, paid, covered_until)
+        for column in ("From", "To"):
+            intervals[column] = intervals[column].to_numpy().astype("datetime64[D]")
+        return intervals
+
+    def renewal_lags(self, now):
+        """Days between a member's coverage running out and their next payment.
+
+        Negative when they renewed early.
+        """
+        ids, paid, covered_until, first = self._made_by(now)
+        return (paid - np.roll(covered_until, 1))[~first]
+
+
+def _runs(ids, first, starts, covered_until):
+    # Rows sorted by member and start, with each member's running end of
+    # coverage; a run starts at a member's first row or after a gap of at
+    # least one unit, and lasts to the coverage end of its last row
+    gap = np.ones(len(ids), dtype=bool)
+    gap[1:] = starts[1:] > covered_until[:-1] + 1
+    run_starts = first | gap
+    run_ends = np.ones(len(ids), dtype=bool)
+    run_ends[:-1] = run_starts[1:]
+    return pd.DataFrame(
+        {
+            "Member ID": ids[run_starts],
+            "From": starts[run_starts],
+            "To": covered_until[run_ends],
+        }
+    )
+
+
+def coverage_intervals(members, renewals, now):
+    """Coverage intervals of every member as of now, by member.
+
+    Members without payments in the export are taken as covered from their
+    signup to their expiry date.
+    """
+    intervals = renewals.intervals(now)
+    unpaid = members[
+        ~members["Member ID"].isin(intervals["Member ID"].unique()).to_numpy()
+        & members["Expiry date"].notna().to_numpy()
+        & (members["Date Signed up"] <= now).to_numpy()
+    ]
+    signed_up = unpaid["Date Signed up"].to_numpy(dtype="datetime64[ns]")
+    expiry = unpaid["Expiry date"].to_numpy(dtype="datetime64[ns]")
+    unpaid = pd.DataFrame(
+        {
+            "Member ID": unpaid["Member ID"].to_numpy(dtype=np.int32),
+            "From": signed_up.astype("datetime64[D]"),
+            "To": expiry.astype("datetime64[D]"),
+        }
+    )
+    intervals = pd.concat([intervals, unpaid[unpaid["To"] >= unpaid["From"]]])
+    return intervals.reset_index(drop=True)
+
+
+class CoverageIndex:
+    """Coverage intervals as start and end day numbers.
+
+    A member counts as active from an interval's first day to its last, and
+    a member's intervals never overlap, so the members active on a day are
+    the intervals open on it. daily() counts that for every day of a range
+    in one sweep over the starts and ends.
+    """
+
+    def __init__(self, intervals):
+        self.starts = _days(intervals["From"].to_numpy())
+        self.ends = _days(intervals["To"].to_numpy())
+
+    def __len__(self):
+        return len(self.starts)
+
+    def first_day(self):
+        return int(self.starts.min())
+
+    def daily(self, first, last):
+        """Members active on each day from first to last, as day numbers."""
+        days = last - first + 1
+        opened = np.bincount(
+            np.clip(self.starts - first, 0, days), minlength=days + 1
+        )
+        closed = np.bincount(
+            np.clip(self.ends + 1 - first, 0, days), minlength=days + 1
+        )
+        return np.cumsum(opened - closed)[:days]
+
+
+def _month_counts(first, last, size):
+    # How many [first, last] ranges cover each of 0..size-1, by differences
+    diff = np.bincount(first, minlength=size + 1) - np.bincount(
+        last + 1, minlength=size + 1
+    )
+    return np.cumsum(diff)[:size]
+
+
+def format_cohort_retention(cohorts, churn, lags):
+    return {
+        "cohorts": [
+            {"Month": format_month(month), "Members": members, "Retained": retained}
+            for month, members, retained in cohorts
+        ],
+        "churn": [
+            {
+                "Month": format_month(month),
+                "Members": members,
+                "Churned": churned,
+                "Rate": churned / members,
+            }
+            for month, members, churned in churn
+        ],
+        "renewal_lag": [
+            {"Days": int(days), "Count": int(count)} for days, count in lags
+        ],
+    }
+
+
+@timed()
+def calculate_cohort_retention(members, renewals, now):
+    """Retention by signup cohort, churn by month and renewal lags, as of now.
+
+    Retained[k] of a cohort counts its members covered in the k-th month
+    after the month they signed up in, up to the current month. A member
+    churns in the last month of a coverage run that has ended; the rate is
+    over the members covered that month.
+    """
+    now = pd.Timestamp(now)
+    current = month_ordinal(now)
+    # Coverage by calendar month: intervals less than a month apart join up
+    intervals = coverage_intervals(members, renewals, now)
+    ids = intervals["Member ID"].to_numpy()
+    runs = _runs(
+        ids,
+        _firsts(ids),
+        _months(intervals["From"].to_numpy()),
+        _months(intervals["To"].to_numpy()),
+    )
+
+    signed_up = members[(members["Date Signed up"] <= now).to_numpy()]
+    signup_months = signed_up["Sign Up Month"].to_numpy(
+        dtype=np.float64, na_value=np.nan
+    )
+    known = ~np.isnan(signup_months)
+    cohort_of = pd.Series(
+        signup_months[known].astype(np.int64),
+        index=signed_up["Member ID"].to_numpy()[known],
+    )
+    cohort_of = cohort_of[~cohort_of.index.duplicated(keep="last")]
+
+    start = int(min([current, *runs["From"].nsmallest(1), *cohort_of.nsmallest(1)]))
+    size = current - start + 1
+    run_from = runs["From"].to_numpy() - start
+    run_to = np.minimum(runs["To"].to_numpy() - start, size - 1)
+
+    # Retention: each run covers offsets From - cohort .. To - cohort of its
+    # member's cohort row, flattened so one bincount fills the whole matrix
+    cohorts = runs["Member ID"].map(cohort_of).to_numpy(dtype=np.float64)
+    in_cohort = ~np.isnan(cohorts)
+    rows = cohorts[in_cohort].astype(np.int64) - start
+    first = np.maximum(run_from[in_cohort], rows) - rows
+    last = run_to[in_cohort] - rows
+    keep = last >= first
+    cells = rows[keep] * (size + 1)
+    diff = np.bincount(cells + first[keep], minlength=size * (size + 1))
+    diff = diff - np.bincount(cells + last[keep] + 1, minlength=size * (size + 1))
+    retained = np.cumsum(diff.reshape(size, size + 1), axis=1)[:, :size]
+    cohort_sizes = np.bincount(cohort_of.to_numpy() - start, minlength=size)
+
+    covered = _month_counts(run_from, run_to, size)
+    churned = np.bincount(
+        run_to[runs["To"].to_numpy() < current], minlength=size
+    )
+
+    lags = renewals.renewal_lags(now)
+    lag_buckets, lag_counts = np.unique(
+        lags // LAG_BUCKET_DAYS * LAG_BUCKET_DAYS, return_counts=True
+    )
+    return format_cohort_retention(
+        [
+            (start + row, int(cohort_sizes[row]), retained[row, : size - row].tolist())
+            for row in range(size)
+            if cohort_sizes[row]
+        ],
+        [
+            (start + month, int(covered[month]), int(churned[month]))
+            for month in range(size - 1)
+            if covered[month]
+        ],
+        zip(lag_buckets, lag_counts),
+    )
+
+
+def cohort_retention(members, renewals, now):
+    # Everything is by calendar month, so the result holds until the next one
+    return calculate_cohort_retention(members, renewals, now), next_month_start(now)
+
+
+@timed()
+def calculate_active_members_history(members, renewals, now):
+    """Members active on each day from the first coverage to now's day."""
+    index = CoverageIndex(coverage_intervals(members, renewals, now))
+    if not len(index):
+        return []
+    today = int(_days(np.datetime64(pd.Timestamp(now), "ns")))
+    first = min(index.first_day(), today)
+    active = index.daily(first, today)
+    dates = np.datetime_as_string(
+        np.arange(first, today + 1).astype("datetime64[D]"), unit="D"
+    )
+    return [
+        {"Date": date, "Active": count}
+        for date, count in zip(dates.tolist(), active.tolist())
+    ]
+
+
+def active_members_history(members, renewals, now):
+    # Each day adds a point, so the result holds until the next one starts
+    next_day = pd.Timestamp(now).normalize() + pd.Timedelta(days=1)
+    return calculate_active_members_history(members, renewals, now), next_day
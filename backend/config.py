@@ -0,0 +1,54 @@
+import os
+
+# Directory holding members.csv / payments.csv
+DATA_DIR = os.environ.get("CITA_DATA_DIR", "./data")
+
+# CSV of places (name, latitude, longitude) city names are matched against for
+# coordinates; defaults to the regions and main cities in geocoding.py
+GAZETTEER = os.environ.get("CITA_GAZETTEER")
+
+# Seconds between checks of the data directory for new exports (0 disables)
+DATA_RELOAD_INTERVAL = float(os.environ.get("CITA_DATA_RELOAD_INTERVAL", "5"))
+
+# Parse only rows appended to the exports instead of reloading them in full
+DATA_INCREMENTAL_INGEST = os.environ.get("CITA_DATA_INCREMENTAL_INGEST", "1") == "1"
+
+# Keep only aggregates, streaming the exports in chunks instead of holding
+# row-level frames; filtered endpoints are then unavailable
+DATA_STREAMING = os.environ.get("CITA_DATA_STREAMING", "0") == "1"
+
+# Rows per chunk in streaming mode
+DATA_CHUNK_ROWS = int(os.environ.get("CITA_DATA_CHUNK_ROWS", "100000"))
+
+# Where the rows are kept: "pandas" frames in memory, or "sqlite", a database
+# file the exports are written into once and aggregates are queried from;
+# filters and reports are then unavailable, as in streaming mode
+STORAGE = os.environ.get("CITA_STORAGE", "pandas")
+
+SQLITE_PATH = os.environ.get(
+    "CITA_SQLITE_PATH", os.path.join(DATA_DIR, ".cache", "cita.sqlite3")
+)
+
+# Glob of exports rolled into one file per month (members_YYYYMM.csv,
+# payments_YYYYMM.csv), or a directory holding them, read instead of
+# DATA_DIR's members.csv and payments.csv
+DATA_FILES = os.environ.get("CITA_DATA_FILES")
+
+# Serve the versions a separate loader process publishes to
+# SHARED_DATA_DIR instead of loading the exports in every process (set by
+# gunicorn.conf.py)
+SHARED_DATA = os.environ.get("CITA_SHARED_DATA", "0") == "1"
+
+SHARED_DATA_DIR = os.environ.get(
+    "CITA_SHARED_DATA_DIR", os.path.join(DATA_DIR, ".cache", "shared")
+)
+
+# Threads running aggregations for the ASGI app (asgi.py); requests beyond
+# this wait for a free thread
+ASGI_EXECUTOR_THREADS = int(os.environ.get("CITA_ASGI_EXECUTOR_THREADS", "4"))
+
+# Per-stage timings at /api/_metrics and in Server-Timing headers
+METRICS_ENABLED = os.environ.get("CITA_METRICS", "0") == "1"
+
+# Also track peak allocation per stage (tracemalloc; slows everything down)
+METRICS_TRACK_MEMORY = os.environ.get("CITA_METRICS_MEMORY", "0") == "1"
@@ -0,0 +1,303 @@
+import numpy as np
+import pandas as pd
+
+from data_processing import (
+    format_regions,
+    format_nz_distribution,
+    format_new_members,
+    format_renewal_funnel,
+    format_activity_heatmap,
+    format_payment_distribution,
+    format_income_trend,
+    month_ordinal,
+    region_names,
+)
+from instrumentation import timed
+
+# Membership status of a cube cell as of the time the cube was built
+ACTIVE = 1
+EXPIRED = 0
+NO_EXPIRY = -1
+
+# Member attributes every cube is broken down by; payments by their payer's
+MEMBER_DIMENSIONS = ["Region", "City", "Sign Up Month", "Status"]
+
+# The payments columns the cube reads, e.g. for sharing between processes
+PAYMENT_COLUMNS = ["Member ID", "Amount", "Month"]
+
+FILTER_PARAMS = ("region", "city", "status", "from", "to", "amount")
+
+
+def _month_start(value, param):
+    if not value:
+        return None
+    try:
+        return pd.Timestamp(value)
+    except ValueError as e:
+        raise ValueError(f"Invalid {param!r} date: {value}") from e
+
+
+class CubeFilters:
+    """The slice of members (and their payments) a request asks for.
+
+    region, city and status select members, from/to their signup months
+    (to exclusive) and amount the payments; payment charts filter on the
+    paying member's attributes. None leaves a dimension unrestricted.
+    """
+
+    def __init__(
+        self,
+        region=None,
+        city=None,
+        status=None,
+        signed_up_from=None,
+        signed_up_to=None,
+        amount=None,
+    ):
+        if status not in (None, "active", "expired"):
+            raise ValueError(f"Unknown membership status: {status}")
+        self.region = region
+        self.city = city
+        self.status = status
+        self.signed_up_from = signed_up_from
+        self.signed_up_to = signed_up_to
+        self.amount = amount
+
+    @classmethod
+    def from_args(cls, args):
+        """Filters from request query arguments, or None when there are none."""
+        if not any(args.get(param) for param in FILTER_PARAMS):
+            return None
+        amount = args.get("amount") or None
+        if amount is not None:
+            try:
+                amount = float(amount.lstrip("$"))
+            except ValueError as e:
+                raise ValueError(f"Invalid amount: {amount}") from e
+        return cls(
+            region=args.get("region") or None,
+            city=args.get("city") or None,
+            status=args.get("status") or None,
+            signed_up_from=_month_start(args.get("from"), "from"),
+            signed_up_to=_month_start(args.get("to"), "to"),
+            amount=amount,
+        )
+
+    def key(self):
+        return (
+            self.region,
+            self.city,
+            self.status,
+            self.signed_up_from,
+            self.signed_up_to,
+            self.amount,
+        )
+
+    def by_month(self):
+        """Whether the signup bounds fall on month starts, as the cube needs."""
+        return all(
+            bound is None or bound == bound.to_period("M").start_time
+            for bound in (self.signed_up_from, self.signed_up_to)
+        )
+
+
+def _payers(members, payments):
+    # Row of each payment's member in members, -1 when it isn't there; the
+    # latest row wins if a member appears twice
+    ids = members["Member ID"]
+    rows = np.flatnonzero(~ids.duplicated(keep="last").to_numpy())
+    found = pd.Index(ids.to_numpy()[rows]).get_indexer(payments["Member ID"])
+    return np.where(found >= 0, rows[found], -1)
+
+
+class DataCube:
+    """Counts and sums of members and payments for every filter combination.
+
+    Built from the frames once per data version (and again whenever a
+    membership expires, since the status dimension is as of build time).
+    Members are counted by region, city, signup month, status and renewal,
+    logins by the same dimensions plus day and hour, and payments by month
+    and amount plus their payer's dimensions. A filtered chart is then a
+    sum over the matching cells, at a cost that follows the number of cells
+    rather than the number of members. Cells are kept in order of first
+    appearance, so ties in the results break as in the unfiltered ones.
+    """
+
+    def __init__(self, now, members, activity, payments):
+        self.now = now
+        self.members = members
+        self.activity = activity
+        self.payments = payments
+
+    def _mask(self, cells, filters):
+        mask = np.ones(len(cells), dtype=bool)
+        if filters.region is not None:
+            names = list(cells["Region"].cat.categories)
+            wanted = region_names.key(filters.region)
+            matching = [
+                name for name, key in zip(names, region_names(names)) if key == wanted
+            ]
+            mask &= cells["Region"].isin(matching).to_numpy()
+        if filters.city is not None:
+            mask &= (cells["City"] == filters.city).to_numpy()
+        if filters.status is not None:
+            status = ACTIVE if filters.status == "active" else EXPIRED
+            mask &= cells["Status"].to_numpy() == status
+        months = cells["Sign Up Month"]
+        if filters.signed_up_from is not None:
+            first = month_ordinal(filters.signed_up_from)
+            mask &= (months >= first).to_numpy(dtype=bool, na_value=False)
+        if filters.signed_up_to is not None:
+            end = month_ordinal(filters.signed_up_to)
+            mask &= (months < end).to_numpy(dtype=bool, na_value=False)
+        return cells[mask]
+
+    def _member_cells(self, filters, cells=None):
+        if filters.amount is not None:
+            raise ValueError("The amount filter only applies to payment charts")
+        return self._mask(self.members if cells is None else cells, filters)
+
+    def _payment_cells(self, filters):
+        cells = self._mask(self.payments, filters)
+        if filters.amount is not None:
+            cells = cells[cells["Amount"].to_numpy() == filters.amount]
+        return cells
+
+    def key_metrics(self, filters, now):
+        cells = self._member_cells(filters)
+        counts = cells["Count"].to_numpy()
+        new = (cells["Sign Up Month"] == month_ordinal(now)).to_numpy(
+            dtype=bool, na_value=False
+        )
+        return {
+            "total_members": int(counts.sum()),
+            "active_members": int(counts[cells["Status"].to_numpy() == ACTIVE].sum()),
+            "new_members_this_month": int(counts[new].sum()),
+        }
+
+    def membership_status(self, filters, now):
+        cells = self._member_cells(filters)
+        counts = cells["Count"].to_numpy()
+        status = cells["Status"].to_numpy()
+        active = int(counts[status == ACTIVE].sum())
+        expired = int(counts[status == EXPIRED].sum())
+        # Same shape as calculate_membership_status
+        expiry_status = sorted(
+            [("Active", active), ("Expired", expired)], key=lambda item: -item[1]
+        )
+        return {name: count for name, count in expiry_status if count}
+
+    def region_distribution(self, filters, now):
+        cells = self._member_cells(filters)
+        counts = cells.groupby("Region", observed=True, sort=False)["Count"].sum()
+        main_regions, other_regions = format_regions(
+            {str(region): int(count) for region, count in counts.items()}
+        )
+        return {"main_regions": main_regions, "other_regions": other_regions}
+
+    def nz_city_distribution(self, filters, now):
+        cells = self._member_cells(filters)
+        counts = cells.groupby(["Region", "City"], observed=True, sort=False)[
+            "Count"
+        ].sum()
+        return format_nz_distribution(
+            {key: int(count) for key, count in counts.items()}
+        )
+
+    def new_members(self, filters, now):
+        cells = self._member_cells(filters)
+        counts = cells.groupby("Sign Up Month")["Count"].sum()
+        return format_new_members({month: int(n) for month, n in counts.items()})
+
+    def renewal_funnel(self, filters, now):
+        cells = self._member_cells(filters)
+        counts = cells["Count"].to_numpy()
+        renewed = int(counts[cells["Renewed"].to_numpy()].sum())
+        return format_renewal_funnel(renewed, int(counts.sum()))
+
+    def activity_heatmap(self, filters, now):
+        cells = self._member_cells(filters, self.activity)
+        counts = cells.groupby(["DayOfWeek", "Hour"])["Count"].sum()
+        return format_activity_heatmap({key: int(n) for key, n in counts.items()})
+
+    def payment_distribution(self, filters, now):
+        cells = self._payment_cells(filters)
+        counts = cells.groupby("Amount", sort=False)["Count"].sum()
+        return format_payment_distribution(
+            {amount: int(count) for amount, count in counts.items()}
+        )
+
+    def income_trend(self, filters, now):
+        cells = self._payment_cells(filters)
+        totals = cells.groupby("Month")["Total"].sum()
+        return format_income_trend(
+            {month: float(total) for month, total in totals.items()}
+        )
+
+    def result(self, name, filters, now=None):
+        """The named chart's data for the members and payments filters selects."""
+        return getattr(self, name)(filters, self.now if now is None else now)
+
+
+CUBE_RESULTS = [
+    "key_metrics",
+    "region_distribution",
+    "membership_status",
+    "payment_distribution",
+    "renewal_funnel",
+    "income_trend",
+    "activity_heatmap",
+    "nz_city_distribution",
+    "new_members",
+]
+
+
+@timed()
+def build_cube(members, payments, now):
+    expiry = members["Expiry date"]
+    status = np.where(
+        expiry.isna(), NO_EXPIRY, np.where(expiry > now, ACTIVE, EXPIRED)
+    ).astype(np.int8)
+    frame = pd.DataFrame(
+        {
+            "Region": members["Region"].array,
+            "City": members["City"].array,
+            "Sign Up Month": members["Sign Up Month"].array,
+            "Status": status,
+            "Renewed": members["Last Payment Date"].notna().to_numpy(),
+            "DayOfWeek": members["DayOfWeek"].array,
+            "Hour": members["Hour"].array,
+        }
+    )
+    groupby = {"observed": True, "sort": False, "dropna": False}
+    member_cells = (
+        frame.groupby([*MEMBER_DIMENSIONS, "Renewed"], **groupby)
+        .size()
+        .rename("Count")
+        .reset_index()
+    )
+    activity_cells = (
+        frame.groupby([*MEMBER_DIMENSIONS, "DayOfWeek", "Hour"], **groupby)
+        .size()
+        .rename("Count")
+        .reset_index()
+    )
+
+    payers = _payers(members, payments)
+    paid = pd.DataFrame(
+        {
+            "Month": payments["Month"].array,
+            "Amount": payments["Amount"].to_numpy(),
+            **{
+                column: frame[column].array.take(payers, allow_fill=True)
+                for column in ["Region", "City", "Sign Up Month"]
+            },
+            "Status": np.where(payers >= 0, status[payers], NO_EXPIRY).astype(np.int8),
+        }
+    )
+    payment_cells = (
+        paid.groupby(["Month", "Amount", *MEMBER_DIMENSIONS], **groupby)["Amount"]
+        .agg(Count="size", Total="sum")
+        .reset_index()
+    )
+    return DataCube(now, member_cells, activity_cells, payment_cells)
@@ -1,8 +1,32 @@
+import functools
+import glob
+import hashlib
+import json
+import os
 import pandas as pd
+from pandas.api.types import union_categoricals
 from pypinyin import lazy_pinyin
 import numpy as np
 from datetime import datetime
 
+from geocoding import nz_places
+from instrumentation import stage, timed
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:  # the columnar cache is optional
+    feather = None
+
+# Bump when preprocessing changes so stale caches are not loaded
+CACHE_FORMAT = 5
+
+MEMBER_ID_PREFIX = "CITANZ-"
+
+# Resident bytes per row of the preprocessed members frame, excluding the
+# category tables shared by all rows (see preprocess_members)
+MEMBER_BYTES_BUDGET = 48
+
 
 def to_pinyin(text):
     return "".join(lazy_pinyin(text))
@@ -12,76 +36,562 @@ def normalize_name(pinyin):
     return pinyin.lower().replace(" ", "")
 
 
-def load_and_preprocess_data():
-    members = pd.read_csv("./data/members.csv")
-    members = members[
-        members["Member ID"].notna()
-        & members["Member ID"].str.startswith("CITANZ-", na=False)
-    ]
+class NameNormalizer:
+    """Memoized mapping from raw region names to normalized pinyin keys.
+
+    The mapping only depends on the raw string, so it is kept across data
+    versions and, when a path is given, persisted as JSON to skip the pinyin
+    warm-up on the next start.
+    """
+
+    def __init__(self, path=None):
+        self.names = {}
+        self.path = None
+        self._dirty = False
+        if path is not None:
+            self.persist_to(path)
+
+    def persist_to(self, path):
+        self.path = path
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.names.update(json.load(f))
+
+    def __call__(self, values):
+        keys = []
+        for value in values:
+            key = self.names.get(value)
+            if key is None:
+                key = self.names[value] = normalize_name(to_pinyin(value))
+                self._dirty = True
+            keys.append(key)
+        return keys
+
+    def key(self, value):
+        """The key of one name, without remembering it (e.g. request input)."""
+        key = self.names.get(value)
+        return normalize_name(to_pinyin(value)) if key is None else key
+
+    def save(self):
+        if self.path is None or not self._dirty:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            # A copy, as loads on other threads may be adding names
+            json.dump(dict(self.names), f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+
+
+region_names = NameNormalizer()
+
+MAIN_REGIONS = ["Auckland", "Wellington", "Canterbury"]
+
+
+def month_ordinal(t):
+    # Months since 1970-01, the same numbering as pd.Period("M") ordinals
+    return (t.year - 1970) * 12 + t.month - 1
+
+
+def month_ordinals(dates):
+    # Int16 month ordinals, <NA> for missing dates
+    return month_ordinal(dates.dt).astype("Int16")
+
+
+def format_month(ordinal):
+    year, month = divmod(int(ordinal), 12)
+    return f"{1970 + year:04d}-{month + 1:02d}"
+
+
+MEMBER_DATE_FORMATS = {
+    "Expiry date": "%d/%m/%Y",
+    "Last Payment Date": "%d/%m/%Y %H:%M",
+    "Date Signed up": "%b %d, %Y, %I:%M %p",
+    "Last logged in": "%b %d, %Y, %I:%M %p",
+}
+PAID_AT_FORMAT = "%b %d, %Y, %I:%M %p"
+
+# Payment comments read "Membership extended to DD/MM/YYYY"
+EXTENDED_TO = r"extended to (\d{1,2}/\d{1,2}/\d{4})"
+EXTENDED_TO_FORMAT = "%d/%m/%Y"
+
+# Values the exports use for a missing date ("Last Payment Date" of members
+# who never paid); they are nulled without being parsed
+DATE_PLACEHOLDERS = ["\t-", "-", ""]
+
+_MONTH_NAMES = "jan feb mar apr may jun jul aug sep oct nov dec".split()
+_MONTH_KEYS = np.array(
+    [(ord(a) << 16) | (ord(b) << 8) | ord(c) for a, b, c in _MONTH_NAMES]
+)
+_MONTH_ORDER = np.argsort(_MONTH_KEYS)
+
+# Width of each strptime directive the fast path handles, zero-padded. The
+# numeric ones that strptime also accepts as a single digit are padded first.
+_FIELD_WIDTHS = {"d": 2, "m": 2, "Y": 4, "H": 2, "I": 2, "M": 2, "b": 3, "p": 2}
+_UNPADDED_FIELDS = "dmHIM"
+_NS_PER_MINUTE = 60 * 10**9
+
+
+@functools.lru_cache()
+def _date_layout(format):
+    """Fixed positions of the fields and literals of format, zero-padded.
+
+    None when format uses anything the fast path doesn't handle.
+    """
+    fields, literals, position = {}, [], 0
+    parts = iter(format)
+    for char in parts:
+        if char != "%":
+            literals.append((position, ord(char)))
+            position += 1
+            continue
+        directive = next(parts, None)
+        if directive not in _FIELD_WIDTHS or directive in fields:
+            return None
+        fields[directive] = position
+        position += _FIELD_WIDTHS[directive]
+    has_month = "m" in fields or "b" in fields
+    has_hour = "H" in fields or ("I" in fields and "p" in fields)
+    if not ("Y" in fields and "d" in fields and has_month):
+        return None
+    if ("M" in fields or "I" in fields or "p" in fields) and not has_hour:
+        return None
+    return fields, literals, position
+
+
+def _is_digit(chars):
+    return (chars >= ord("0")) & (chars <= ord("9"))
+
+
+def _number(chars, start, width):
+    """Integer in each row's columns start:start + width, and which rows had one."""
+    digits = chars[:, start : start + width].astype(np.int64) - ord("0")
+    ok = ((digits >= 0) & (digits <= 9)).all(axis=1)
+    return digits @ (10 ** np.arange(width - 1, -1, -1)), ok
+
+
+def _parse_layout(strings, layout):
+    """Parse strings laid out as _date_layout describes, with array operations.
+
+    Returns datetime64[ns] values and a mask of the strings that matched.
+    """
+    fields, literals, length = layout
+    # One row of code points per string, zero-padded; longer strings are cut
+    # off but then fail the end-of-string check
+    chars = (
+        strings.astype(f"U{length + 1}")
+        .view(np.uint32)
+        .reshape(len(strings), length + 1)
+        .copy()
+    )
+    for directive, start in sorted(fields.items(), key=lambda item: item[1]):
+        if directive in _UNPADDED_FIELDS:
+            short = ~_is_digit(chars[:, start + 1])
+            chars[short, start + 1 :] = chars[short, start:-1]
+            chars[short, start] = ord("0")
+
+    ok = chars[:, length] == 0
+    for position, char in literals:
+        ok &= chars[:, position] == char
+
+    year, year_ok = _number(chars, fields["Y"], 4)
+    day, day_ok = _number(chars, fields["d"], 2)
+    ok &= year_ok & day_ok & (year >= 1678) & (year <= 2261)
+    if "m" in fields:
+        month, month_ok = _number(chars, fields["m"], 2)
+        ok &= month_ok & (month >= 1) & (month <= 12)
+    else:
+        # Month names match case-insensitively, as with strptime
+        letters = chars[:, fields["b"] : fields["b"] + 3]
+        ok &= (letters < 128).all(axis=1)
+        letters = letters.astype(np.int64) | 0x20
+        key = letters[:, 0] << 16 | letters[:, 1] << 8 | letters[:, 2]
+        slot = _MONTH_ORDER[
+            np.searchsorted(_MONTH_KEYS[_MONTH_ORDER], key).clip(max=11)
+        ]
+        ok &= _MONTH_KEYS[slot] == key
+        month = slot + 1
+
+    minutes = np.zeros(len(strings), dtype=np.int64)
+    if "H" in fields:
+        hour, hour_ok = _number(chars, fields["H"], 2)
+        ok &= hour_ok & (hour <= 23)
+        minutes += hour * 60
+    elif "I" in fields:
+        hour, hour_ok = _number(chars, fields["I"], 2)
+        meridiem = chars[:, fields["p"] : fields["p"] + 2] | 0x20
+        pm = meridiem[:, 0] == ord("p")
+        ok &= hour_ok & (hour >= 1) & (hour <= 12)
+        ok &= (pm | (meridiem[:, 0] == ord("a"))) & (meridiem[:, 1] == ord("m"))
+        minutes += (hour % 12 + np.where(pm, 12, 0)) * 60
+    if "M" in fields:
+        minute, minute_ok = _number(chars, fields["M"], 2)
+        ok &= minute_ok & (minute <= 59)
+        minutes += minute
+
+    months = np.where(ok, (year - 1970) * 12 + month - 1, 0)
+    first = months.astype("datetime64[M]").astype("datetime64[D]")
+    days_in_month = ((months + 1).astype("datetime64[M]") - first).astype(np.int64)
+    ok &= (day >= 1) & (day <= days_in_month)
+    ns = first.astype("datetime64[ns]").view(np.int64) + (
+        (day - 1) * 1440 + minutes
+    ) * _NS_PER_MINUTE
+    return np.where(ok, ns, np.iinfo(np.int64).min).view("datetime64[ns]"), ok
+
+
+def map_unique(values, func):
+    """func applied to each distinct value once and broadcast back to the rows.
+
+    Export columns repeat the same strings heavily (timestamps to the minute,
+    a handful of amounts, members paying many times), so parsing only the
+    distinct values saves most of the work. func takes a Series of distinct
+    non-missing values and returns an array of results; missing values stay
+    missing.
+    """
+    codes, uniques = pd.factorize(values)
+    results = pd.array(func(pd.Series(uniques, dtype=object)))
+    return pd.Series(
+        results.take(codes, allow_fill=True), index=values.index, name=values.name
+    )
 
-    payments = pd.read_csv("./data/payments.csv")
 
-    # Process date columns
-    date_columns = {
-        "Expiry date": "%d/%m/%Y",
-        "Last Payment Date": "%d/%m/%Y %H:%M",
-        "Date Signed up": "%b %d, %Y, %I:%M %p",
-        "Last logged in": "%b %d, %Y, %I:%M %p",
-    }
+def _parse_distinct_dates(strings, format):
+    strings = strings.to_numpy()
+    placeholder = pd.Series(strings).isin(DATE_PLACEHOLDERS).to_numpy()
+    layout = _date_layout(format)
+    if layout is not None and len(strings):
+        parsed, ok = _parse_layout(strings, layout)
+    else:
+        parsed = np.full(len(strings), np.datetime64("NaT"), dtype="datetime64[ns]")
+        ok = np.zeros(len(strings), dtype=bool)
+    rest = ~ok & ~placeholder
+    if rest.any():
+        parsed[rest] = pd.to_datetime(
+            strings[rest], format=format, errors="coerce"
+        ).to_numpy(dtype="datetime64[ns]")
+    return parsed
+
+
+def parse_dates(values, format):
+    """pd.to_datetime(values, format=format, errors="coerce"), only faster.
+
+    Placeholders are nulled up front and each distinct string is parsed once.
+    Formats made of the fixed-width fields in _FIELD_WIDTHS are parsed with
+    array operations on the characters; strings that don't match, and other
+    formats, go through pd.to_datetime.
+    """
+    return map_unique(values, functools.partial(_parse_distinct_dates, format=format))
+
+
+def parse_amounts(values):
+    """"$1,234.50" strings as floats."""
+    return map_unique(
+        values,
+        lambda amounts: amounts.replace(r"[$,]", "", regex=True).astype(float),
+    )
 
-    for col, format in date_columns.items():
-        members[col] = pd.to_datetime(members[col], format=format, errors="coerce")
 
-    payments["Paid at"] = pd.to_datetime(
-        payments["Paid at"], format="%b %d, %Y, %I:%M %p", errors="coerce"
+def parse_extension_dates(comments):
+    """The dates payment comments extend memberships to, NaT for other comments."""
+    return map_unique(
+        comments,
+        lambda distinct: _parse_distinct_dates(
+            distinct.str.extract(EXTENDED_TO, expand=False).fillna(""),
+            EXTENDED_TO_FORMAT,
+        ),
     )
-    payments["Amount"] = (
-        payments["Amount"].replace(r"[$,]", "", regex=True).astype(float)
+
+
+def member_numbers(ids):
+    """Numeric part of CITANZ-nnnn member IDs, <NA> for any other value."""
+    digits = ids.str.extract(rf"^{MEMBER_ID_PREFIX}(\d+)$", expand=False)
+    return pd.to_numeric(digits).astype("Int32")
+
+
+def to_category(series, fill="Unknown"):
+    # Keep the fill value as a category so later fillna() calls stay valid
+    if isinstance(series.dtype, pd.CategoricalDtype) and (
+        fill not in series.cat.categories
+    ):
+        series = series.cat.add_categories(fill)
+    series = series.fillna(fill).astype("category")
+    if fill not in series.cat.categories:
+        series = series.cat.add_categories(fill)
+    return series
+
+
+# Columns parsed from text, read as strings even when a file (a small
+# monthly export, an appended tail) leaves them all empty
+TEXT_COLUMNS = {
+    "Member ID": str,
+    **{col: str for col in MEMBER_DATE_FORMATS},
+    "Paid at": str,
+    "Amount": str,
+    "Comment": str,
+}
+
+
+def read_csv(source):
+    with stage("read_csv") as record:
+        frame = pd.read_csv(source, dtype=TEXT_COLUMNS)
+        record.rows = len(frame)
+    return frame
+
+
+@timed()
+def preprocess_members(members):
+    """Parse a members export into the compact resident frame.
+
+    Column layout and bytes per member:
+
+        Member ID                 int32 (number from CITANZ-nnnn)      4
+        Expiry date, Last Payment Date,
+        Date Signed up, Last logged in
+                                  datetime64[ns] (int64 epoch)        32
+        Region, City              category (int8 codes below 128)      2
+        DayOfWeek, Hour           Int8 (value + mask byte)             4
+        Sign Up Month             Int16 month ordinal (+ mask byte)    3
+        index                     RangeIndex                           0
+
+    45 bytes in all, against MEMBER_BYTES_BUDGET; the category tables are
+    shared by every row. Groupbys then run on integer keys, and months are
+    only formatted as "YYYY-MM" strings in the results.
+    """
+    numbers = member_numbers(members["Member ID"])
+    present = numbers.notna()
+    members = members[present].reset_index(drop=True)
+    members["Member ID"] = numbers[present].to_numpy(dtype="int32")
+
+    for col, format in MEMBER_DATE_FORMATS.items():
+        with stage(f"to_datetime.{col}", len(members)):
+            members[col] = parse_dates(members[col], format)
+
+    for col in ["Region", "City"]:
+        members[col] = to_category(members[col])
+
+    # Derived columns used by the aggregations, computed once at load so the
+    # request handlers never write into the shared frame
+    members["DayOfWeek"] = members["Last logged in"].dt.dayofweek.astype("Int8")
+    members["Hour"] = members["Last logged in"].dt.hour.astype("Int8")
+    members["Sign Up Month"] = month_ordinals(members["Date Signed up"])
+
+    return members
+
+
+@timed()
+def preprocess_payments(payments):
+    with stage("to_datetime.Paid at", len(payments)):
+        payments["Paid at"] = parse_dates(payments["Paid at"], PAID_AT_FORMAT)
+    payments["Amount"] = parse_amounts(payments["Amount"])
+    if "Comment" in payments:
+        with stage("to_datetime.Extended To", len(payments)):
+            payments["Extended To"] = parse_extension_dates(payments["Comment"])
+    if "Member ID" in payments:
+        payments["Member ID"] = map_unique(payments["Member ID"], member_numbers)
+    payments["Month"] = month_ordinals(payments["Paid at"])
+    return payments
+
+
+def bytes_per_member(members):
+    """Resident bytes per row, leaving out the shared category tables."""
+    shared = sum(
+        members[col].cat.categories.memory_usage(deep=True)
+        for col, dtype in members.dtypes.items()
+        if isinstance(dtype, pd.CategoricalDtype)
     )
+    total = members.memory_usage(deep=True).sum() - shared
+    return total / len(members) if len(members) else 0.0
 
-    return members, payments
+
+def concat_frames(frames):
+    """Concatenate preprocessed frames, keeping categorical columns categorical."""
+    categorical = [
+        col
+        for col, dtype in frames[0].dtypes.items()
+        if isinstance(dtype, pd.CategoricalDtype)
+        and all(isinstance(frame[col].dtype, pd.CategoricalDtype) for frame in frames)
+    ]
+    if categorical:
+        # Recode every frame to the union of the categories, so concat keeps
+        # the codes instead of going through the values of all rows
+        dtypes = {
+            col: pd.CategoricalDtype(
+                union_categoricals([frame[col] for frame in frames]).categories
+            )
+            for col in categorical
+        }
+        frames = [frame.astype(dtypes) for frame in frames]
+    combined = pd.concat(frames, ignore_index=True)
+    for col, dtype in frames[0].dtypes.items():
+        if isinstance(dtype, pd.CategoricalDtype) and col not in categorical:
+            combined[col] = to_category(combined[col])
+    return combined
+
+
+def latest_members(members):
+    """The last row of each member, at the position the member was first seen.
+
+    Every load path keeps members this way, so an export listing a member
+    twice counts them once.
+    """
+    if members["Member ID"].is_unique:
+        return members
+    order = members.groupby("Member ID", sort=False).ngroup()
+    latest = ~members["Member ID"].duplicated(keep="last")
+    return (
+        members[latest]
+        .iloc[order[latest].to_numpy().argsort(kind="stable")]
+        .reset_index(drop=True)
+    )
 
 
-def calculate_key_metrics(members):
-    total_members = len(members)
-    active_members = len(members[members["Expiry date"] > datetime.now()])
-    current_month = datetime.now().strftime("%Y-%m")
-    new_members_this_month = len(
-        members[members["Date Signed up"].dt.to_period("M") == current_month]
+def add_counts(totals, counts):
+    """Add counts or sums keyed like totals into it."""
+    for key, value in counts.items():
+        totals[key] = totals.get(key, 0) + value
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cached_frame(cache_dir, name, source_hash, build):
+    """Load a preprocessed frame from the Feather cache, building it on a miss.
+
+    Cache files are keyed by the hash of the source CSV, so a changed export
+    always goes back through build(). Files are read memory-mapped and
+    written uncompressed so Arrow can hand buffers to pandas without
+    decoding.
+    """
+    if feather is None or cache_dir is None:
+        return build()
+
+    path = os.path.join(cache_dir, f"{name}-v{CACHE_FORMAT}-{source_hash}.feather")
+    if os.path.exists(path):
+        with stage(f"cache_read.{name}") as record:
+            frame = feather.read_table(path, memory_map=True).to_pandas()
+            record.rows = len(frame)
+        return frame
+
+    frame = build()
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with stage(f"cache_write.{name}", len(frame)):
+        feather.write_feather(
+            pa.Table.from_pandas(frame), tmp_path, compression="uncompressed"
+        )
+    os.replace(tmp_path, path)
+
+    for stale in glob.glob(os.path.join(cache_dir, f"{name}-*.feather")):
+        if stale != path:
+            os.remove(stale)
+    return frame
+
+
+@timed()
+def load_and_preprocess_data(data_dir="./data", cache_dir=None, use_cache=True):
+    members_path = os.path.join(data_dir, "members.csv")
+    payments_path = os.path.join(data_dir, "payments.csv")
+    if not use_cache:
+        cache_dir = None
+    elif cache_dir is None:
+        cache_dir = os.path.join(data_dir, ".cache")
+
+    members = cached_frame(
+        cache_dir,
+        "members",
+        file_hash(members_path),
+        lambda: latest_members(preprocess_members(read_csv(members_path))),
+    )
+    payments = cached_frame(
+        cache_dir,
+        "payments",
+        file_hash(payments_path),
+        lambda: preprocess_payments(read_csv(payments_path)),
     )
+    return members, payments
+
+
+def signed_up_by(members, now):
+    # Members without a signup date count as signed up all along
+    signed_up = members["Date Signed up"]
+    return (signed_up.isna() | (signed_up <= now)).to_numpy()
+
+
+@timed()
+def calculate_key_metrics(members, now=None, timeline=None):
+    # members may be None when a timeline is given
+    now = datetime.now() if now is None else now
+    if timeline is not None:
+        total_members = timeline.members_as_of(now)
+        active_members = timeline.active_as_of(now)
+        new_members_this_month = timeline.signed_up_in_month(now)
+    else:
+        joined = signed_up_by(members, now)
+        total_members = int(joined.sum())
+        active_members = int((joined & (members["Expiry date"] > now)).sum())
+        current_month = month_ordinal(now)
+        new_members_this_month = int((members["Sign Up Month"] == current_month).sum())
     return total_members, active_members, new_members_this_month
 
 
-def process_regions(df, region_column):
-    processed_df = df.copy()
+def region_counts(regions):
+    """Members per raw region name, in order of first appearance."""
+    codes, uniques = pd.factorize(regions, use_na_sentinel=False)
+    counts = {}
+    for value, count in zip(uniques, np.bincount(codes, minlength=len(uniques))):
+        name = "Unknown" if pd.isna(value) else str(value)
+        counts[name] = counts.get(name, 0) + int(count)
+    return counts
 
-    processed_df[region_column] = (
-        processed_df[region_column].fillna("Unknown").astype(str)
-    )
 
-    processed_df["pinyin"] = processed_df[region_column].apply(to_pinyin)
-    processed_df["normalized_name"] = processed_df["pinyin"].apply(normalize_name)
+@timed()
+def process_regions(df, region_column, normalizer=None):
+    return format_regions(region_counts(df[region_column]), normalizer)
+
+
+def format_regions(counts, normalizer=None):
+    normalizer = region_names if normalizer is None else normalizer
+
+    # Work on the distinct region values only; pinyin and normalization then
+    # cost O(unique regions) instead of O(members)
+    names = list(counts)
+    with stage("normalize_names", len(names)):
+        normalized = normalizer(names)
+    unique_regions = pd.DataFrame(
+        {
+            "normalized_name": normalized,
+            "Region": names,
+            "Member ID": np.array(list(counts.values()), dtype=np.int64),
+        }
+    )
+    # Each region is shown under its most common spelling; neither that nor
+    # the order of ties depends on the order rows were loaded in
+    unique_regions = unique_regions.sort_values(
+        ["Member ID", "Region"], ascending=[False, True]
+    )
 
     grouped = (
-        processed_df.groupby("normalized_name")
+        unique_regions.groupby("normalized_name")
         .agg(
             {
-                region_column: "first",
-                "Member ID": "count",
+                "Region": "first",
+                "Member ID": "sum",
             }
         )
         .reset_index()
     )
 
-    grouped = grouped.sort_values("Member ID", ascending=False)
+    grouped = grouped.sort_values("Member ID", ascending=False, kind="stable")
 
     grouped = grouped.rename(columns={"Member ID": "Number of Members"})
 
-    main_regions = ["Auckland", "Wellington", "Canterbury"]
-
-    main_regions_normalized = [
-        normalize_name(to_pinyin(region)) for region in main_regions
-    ]
+    main_regions_normalized = normalizer(MAIN_REGIONS)
 
     main_region_data = grouped[
         grouped["normalized_name"].isin(main_regions_normalized)
@@ -90,89 +600,181 @@ def process_regions(df, region_column):
         ~grouped["normalized_name"].isin(main_regions_normalized)
     ].to_dict("records")
 
-    for data in main_region_data + other_region_data:
-        data["Region"] = data.pop(region_column)
-
     return main_region_data, other_region_data
 
 
-def calculate_membership_status(members):
-    expiry_status = (
-        members["Expiry date"]
-        .dropna()
-        .apply(lambda x: "Active" if x > datetime.now() else "Expired")
-        .value_counts()
+@timed()
+def calculate_membership_status(members, now=None, timeline=None):
+    # members may be None when a timeline is given
+    now = datetime.now() if now is None else now
+    if timeline is not None:
+        active = timeline.active_as_of(now)
+        expired = timeline.expired_as_of(now)
+    else:
+        joined = signed_up_by(members, now)
+        active = int((joined & (members["Expiry date"] > now)).sum())
+        expired = int((joined & members["Expiry date"].notna()).sum()) - active
+    # Same shape as value_counts(): most common first, empty statuses left out
+    expiry_status = sorted(
+        [("Active", active), ("Expired", expired)], key=lambda item: -item[1]
     )
-    return expiry_status.to_dict()
+    return {status: count for status, count in expiry_status if count}
+
+
+def payment_amount_counts(payments):
+    return payments["Amount"].value_counts().to_dict()
+
 
+def format_payment_distribution(amount_counts):
+    # Most common amount first, like value_counts()
+    ordered = sorted(amount_counts.items(), key=lambda item: -item[1])
+    return [{"Amount": amount, "Count": count} for amount, count in ordered]
 
+
+@timed()
 def calculate_payment_distribution(payments):
-    amount_dist = payments["Amount"].value_counts().reset_index()
-    amount_dist.columns = ["Amount", "Count"]
-    return amount_dist.to_dict("records")
+    return format_payment_distribution(payment_amount_counts(payments))
+
 
+def format_renewal_funnel(renewed, total):
+    return {"Renewed": renewed, "Not Renewed": total - renewed}
 
+
+@timed()
 def calculate_renewal_funnel(members):
-    renewal_status = members["Last Payment Date"].notna().value_counts()
-    return {
-        "Renewed": int(renewal_status[True]),
-        "Not Renewed": int(renewal_status[False]),
-    }
+    renewed = int(members["Last Payment Date"].notna().sum())
+    return format_renewal_funnel(renewed, len(members))
+
 
+def monthly_income_totals(payments):
+    return payments.groupby("Month")["Amount"].sum().to_dict()
 
+
+def format_income_trend(monthly_income):
+    return [
+        {"Month": format_month(month), "Amount": amount}
+        for month, amount in sorted(monthly_income.items())
+    ]
+
+
+@timed()
 def calculate_income_trend(payments):
-    payments["Month"] = payments["Paid at"].dt.to_period("M").astype(str)
-    monthly_income = payments.groupby("Month")["Amount"].sum().reset_index()
-    return monthly_income.to_dict("records")
+    return format_income_trend(monthly_income_totals(payments))
+
+
+def activity_counts(members):
+    return members.groupby(["DayOfWeek", "Hour"]).size().to_dict()
+
+
+def activity_matrix(counts):
+    """Counts keyed by (day of week, hour) as a dense 7×24 int32 array."""
+    matrix = np.zeros((7, 24), dtype=np.int32)
+    for (day, hour), count in counts.items():
+        matrix[int(day), int(hour)] = count
+    return matrix
 
 
+def format_activity_matrix(matrix):
+    # One row per day of the week, Monday first, and one column per hour;
+    # a fixed 168 numbers however many members there are
+    return {"counts": matrix.tolist()}
+
+
+def format_activity_heatmap(counts):
+    return format_activity_matrix(activity_matrix(counts))
+
+
+@timed()
 def calculate_activity_heatmap(members):
-    members["DayOfWeek"] = members["Last logged in"].dt.dayofweek
-    members["Hour"] = members["Last logged in"].dt.hour
-    activity_counts = (
-        members.groupby(["DayOfWeek", "Hour"]).size().reset_index(name="Count")
+    days = members["DayOfWeek"].to_numpy(dtype=np.float64, na_value=np.nan)
+    hours = members["Hour"].to_numpy(dtype=np.float64, na_value=np.nan)
+    known = ~np.isnan(days)
+    cells = days[known].astype(np.int64) * 24 + hours[known].astype(np.int64)
+    matrix = np.bincount(cells, minlength=7 * 24).astype(np.int32)
+    return format_activity_matrix(matrix.reshape(7, 24))
+
+
+def filter_members(
+    members, status=None, signed_up_from=None, signed_up_to=None, now=None
+):
+    mask = pd.Series(True, index=members.index)
+    if status is not None:
+        now = datetime.now() if now is None else now
+        if status == "active":
+            mask &= members["Expiry date"] > now
+        elif status == "expired":
+            mask &= members["Expiry date"] <= now
+        else:
+            raise ValueError(f"Unknown membership status: {status}")
+    if signed_up_from is not None:
+        mask &= members["Date Signed up"] >= pd.Timestamp(signed_up_from)
+    if signed_up_to is not None:
+        mask &= members["Date Signed up"] < pd.Timestamp(signed_up_to)
+    return members if mask.all() else members[mask]
+
+
+def city_counts(members):
+    """Members per (region, city), in order of first appearance."""
+    counts = (
+        pd.DataFrame(
+            {
+                "Region": members["Region"].fillna("Unknown"),
+                "City": members["City"].fillna("Unknown"),
+            }
+        )
+        .groupby(["Region", "City"], observed=True, sort=False)
+        .size()
     )
-    return activity_counts.to_dict("records")
+    return {key: int(count) for key, count in counts.items()}
+
 
+def _by_count(item):
+    # Ties are ordered by name, so every load path gives the same order
+    return -item[1], item[0]
 
-def calculate_nz_distribution(members):
-    # Fill NA values
-    members["Region"] = members["Region"].fillna("Unknown")
-    members["City"] = members["City"].fillna("Unknown")
 
-    # Calculate region counts
-    region_counts = members["Region"].value_counts().reset_index()
-    region_counts.columns = ["name", "value"]
+def format_nz_distribution(city_counts):
+    totals = {}
+    for (region, _), count in city_counts.items():
+        totals[region] = totals.get(region, 0) + count
 
-    # Calculate city counts within each region
-    result = []
-    for _, region in region_counts.iterrows():
-        region_data = {
-            "name": region["name"],
-            "value": int(region["value"]),
-            "children": [],
+    children = {}
+    for (region, city), count in sorted(city_counts.items(), key=_by_count):
+        children.setdefault(region, []).append(
+            {"name": city, "value": count, "location": nz_places.location(city)}
+        )
+
+    return [
+        {
+            "name": region,
+            "value": count,
+            "children": children[region] if region != "Unknown" else [],
         }
+        for region, count in sorted(totals.items(), key=_by_count)
+    ]
 
-        if region["name"] != "Unknown":
-            city_counts = (
-                members[members["Region"] == region["name"]]["City"]
-                .value_counts()
-                .reset_index()
-            )
-            city_counts.columns = ["name", "value"]
 
-            for _, city in city_counts.iterrows():
-                region_data["children"].append(
-                    {"name": city["name"], "value": int(city["value"])}
-                )
+@timed()
+def calculate_nz_distribution(
+    members, status=None, signed_up_from=None, signed_up_to=None, now=None
+):
+    members = filter_members(members, status, signed_up_from, signed_up_to, now)
+    return format_nz_distribution(city_counts(members))
 
-        result.append(region_data)
 
-    return result
+def signup_month_counts(members):
+    return (
+        members.groupby("Sign Up Month")["Member ID"].count().to_dict()
+    )
+
+
+def format_new_members(month_counts):
+    return [
+        {"Month": format_month(month), "Count": count}
+        for month, count in sorted(month_counts.items())
+    ]
 
 
+@timed()
 def calculate_new_members(members):
-    members["Sign Up Month"] = members["Date Signed up"].dt.to_period("M").astype(str)
-    new_members = members.groupby("Sign Up Month")["Member ID"].count().reset_index()
-    new_members.columns = ["Month", "Count"]
-    return new_members.to_dict("records")
+    return format_new_members(signup_month_counts(members))
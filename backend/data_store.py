@@ -0,0 +1,193 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from data_processing import region_names
+from ingest import IncrementalIngestor
+from instrumentation import stage
+from rolled import RolledExportsLoader
+from sql_storage import SQLiteLoader
+from snapshot import build_snapshot
+from streaming import CHUNK_ROWS, StreamingLoader
+
+logger = logging.getLogger(__name__)
+
+
+class DataVersion:
+    """Members/payments frames plus the indexes and snapshot built from them.
+
+    The frames and snapshot are never modified after construction; reloads
+    build a new version and swap it into the store, so a request that grabbed
+    the current version keeps a consistent view until it finishes.
+    """
+
+    def __init__(
+        self,
+        version,
+        members,
+        payments,
+        timeline,
+        renewals,
+        logins,
+        snapshot,
+        load_duration,
+        files,
+    ):
+        self.version = version
+        self.members = members
+        self.payments = payments
+        self.timeline = timeline
+        self.renewals = renewals
+        self.logins = logins
+        self.snapshot = snapshot
+        self.load_duration = load_duration
+        self.loaded_at = time.time()
+        self.files = files
+
+    def describe(self):
+        return {
+            "version": self.version,
+            "loaded_at": self.loaded_at,
+            "load_duration": self.load_duration,
+            "files": {
+                os.path.basename(path): info for path, info in self.files.items()
+            },
+        }
+
+
+class DataStore:
+    def __init__(
+        self,
+        data_dir,
+        incremental=True,
+        streaming=False,
+        chunk_rows=None,
+        files=None,
+        storage="pandas",
+        sqlite_path=None,
+    ):
+        self.data_dir = data_dir
+        self.incremental = incremental
+        self.streaming = streaming
+        self._lock = threading.Lock()
+        self._watcher = None
+        self._stop = threading.Event()
+        # Streaming mode and SQLite storage keep no rows in memory; versions
+        # then have no frames. files is a glob or directory of rolled
+        # exports, read in place of data_dir's members.csv and payments.csv
+        if storage not in ("pandas", "sqlite"):
+            raise ValueError(f"Unknown storage: {storage}")
+        if storage == "sqlite":
+            if streaming or files:
+                raise ValueError("SQLite storage reads members.csv and payments.csv")
+            self._ingestor = SQLiteLoader(
+                data_dir,
+                sqlite_path or os.path.join(data_dir, ".cache", "cita.sqlite3"),
+                chunk_rows or CHUNK_ROWS,
+            )
+        elif streaming:
+            if files:
+                raise ValueError("Streaming mode does not read rolled exports")
+            self._ingestor = StreamingLoader(data_dir, chunk_rows or CHUNK_ROWS)
+        elif files:
+            self._ingestor = RolledExportsLoader(
+                files, os.path.join(data_dir, ".cache")
+            )
+        else:
+            self._ingestor = IncrementalIngestor(data_dir)
+        region_names.persist_to(
+            os.path.join(self._ingestor.cache_dir, "region_names.json")
+        )
+
+        start = time.perf_counter()
+        self._ingestor.load()
+        self._needs_full_load = False
+        self._current = self._publish(start)
+
+    @property
+    def current(self):
+        return self._current
+
+    def _publish(self, start):
+        files = self._ingestor.files
+        version = hashlib.sha256(
+            "".join(info["sha256"] for info in files.values()).encode()
+        ).hexdigest()[:12]
+
+        members, payments = self._ingestor.members, self._ingestor.payments
+        renewals = self._ingestor.renewals
+        with stage("build_timeline"):
+            timeline = self._ingestor.timeline()
+        with stage("build_login_index"):
+            logins = self._ingestor.logins()
+        snapshot = build_snapshot(
+            members,
+            payments,
+            version,
+            self._ingestor.aggregates(),
+            timeline,
+            renewals,
+            logins,
+            self._ingestor.storage,
+        )
+        load_duration = time.perf_counter() - start
+        region_names.save()
+
+        logger.info("Loaded data version %s in %.3fs", version, load_duration)
+        return DataVersion(
+            version,
+            members,
+            payments,
+            timeline,
+            renewals,
+            logins,
+            snapshot,
+            load_duration,
+            files,
+        )
+
+    def _refresh(self):
+        if self.incremental and not self._needs_full_load:
+            return self._ingestor.refresh()
+        previous = self._ingestor.files
+        self._ingestor.load()
+        self._needs_full_load = False
+        return self._ingestor.files != previous
+
+    def reload_if_changed(self):
+        with self._lock:
+            if not (self._needs_full_load or self._ingestor.changed()):
+                return False
+
+            start = time.perf_counter()
+            try:
+                if not self._refresh():
+                    return False
+                self._current = self._publish(start)
+            except Exception:
+                # The ingestor may have consumed part of a file it then failed
+                # to parse or publish; start over from a clean read next time
+                self._needs_full_load = True
+                raise
+            return True
+
+    def _watch(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.reload_if_changed()
+            except Exception:
+                # A half-written export fails to parse; keep serving the
+                # previous version and retry on the next tick
+                logger.exception("Reloading data from %s failed", self.data_dir)
+
+    def start_watcher(self, interval):
+        if self._watcher is None and interval > 0:
+            self._watcher = threading.Thread(
+                target=self._watch, args=(interval,), name="data-watcher", daemon=True
+            )
+            self._watcher.start()
+
+    def stop_watcher(self):
+        self._stop.set()
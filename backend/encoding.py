@@ -0,0 +1,76 @@
+import gzip
+import hashlib
+import json
+
+import numpy as np
+
+from instrumentation import stage, timed
+
+try:
+    import orjson
+except ImportError:  # fall back to the standard library encoder
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # responses are then only gzip-compressed
+    brotli = None
+
+
+def _json_default(value):
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return float(value)
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def supported_encodings():
+    return ["br", "gzip"] if brotli is not None else ["gzip"]
+
+
+@timed()
+def encode_json(data):
+    if orjson is not None:
+        return orjson.dumps(
+            data,
+            default=_json_default,
+            option=orjson.OPT_SORT_KEYS
+            | orjson.OPT_SERIALIZE_NUMPY
+            | orjson.OPT_NON_STR_KEYS,
+        )
+    return json.dumps(data, sort_keys=True, default=_json_default).encode("utf-8")
+
+
+class EncodedBody:
+    """A JSON response body encoded once, with its compressed variants.
+
+    The ETag is derived from the uncompressed bytes; each content encoding
+    gets its own suffix so the validators stay strong.
+    """
+
+    def __init__(self, data):
+        self.raw = encode_json(data)
+        self.etag = hashlib.sha1(self.raw).hexdigest()
+        self._encoded = {"identity": self.raw}
+
+    def variant(self, encoding):
+        if encoding not in self._encoded:
+            if encoding not in ("br", "gzip"):
+                raise ValueError(f"Unsupported content encoding: {encoding}")
+            with stage(f"compress.{encoding}"):
+                if encoding == "br":
+                    self._encoded[encoding] = brotli.compress(self.raw)
+                else:
+                    self._encoded[encoding] = gzip.compress(self.raw, mtime=0)
+        return self._encoded[encoding]
+
+    def variant_etag(self, encoding):
+        if encoding == "identity":
+            return self.etag
+        return f"{self.etag}-{encoding}"
+
+    def supported_encodings(self):
+        return supported_encodings()
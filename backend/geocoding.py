@@ -0,0 +1,97 @@
+import pandas as pd
+
+from config import GAZETTEER
+
+# Regions and main cities, (latitude, longitude)
+NZ_PLACES = {
+    "Northland": (-35.7317, 174.3242),
+    "Auckland": (-36.8485, 174.7633),
+    "Waikato": (-37.7870, 175.2793),
+    "Bay of Plenty": (-37.6878, 176.1651),
+    "Gisborne": (-38.6623, 178.0176),
+    "Hawke's Bay": (-39.4928, 176.9120),
+    "Taranaki": (-39.0556, 174.0752),
+    "Manawatu-Whanganui": (-40.3523, 175.6082),
+    "Wellington": (-41.2865, 174.7762),
+    "Tasman": (-41.2706, 173.2840),
+    "Nelson": (-41.2706, 173.2840),
+    "Marlborough": (-41.5134, 173.9611),
+    "West Coast": (-42.4504, 171.2108),
+    "Canterbury": (-43.5321, 172.6362),
+    "Otago": (-45.8788, 170.5028),
+    "Southland": (-46.4132, 168.3538),
+    "Hamilton": (-37.7870, 175.2793),
+    "Tauranga": (-37.6878, 176.1651),
+    "Napier-Hastings": (-39.4928, 176.9120),
+    "Palmerston North": (-40.3523, 175.6082),
+    "Christchurch": (-43.5321, 172.6362),
+    "Dunedin": (-45.8788, 170.5028),
+    "Invercargill": (-46.4132, 168.3538),
+    "Queenstown": (-45.0312, 168.6626),
+}
+
+
+def _match_key(text):
+    return text.lower().replace(" ", "")
+
+
+def _aliases(name):
+    return {_match_key(name), _match_key(name.replace("-", " "))}
+
+
+class PlaceMatcher:
+    """Finds the known place a free-text city name refers to.
+
+    Every place is indexed under its name in lower case without spaces (and
+    without hyphens); a city matches the longest indexed name it contains,
+    the place listed first on ties. Lookups probe the index with each
+    substring of an indexed length, so they cost the same however many
+    places there are, and each distinct city string is only matched once.
+    """
+
+    def __init__(self, places):
+        self.places = dict(places)
+        self._index = {}
+        for order, name in enumerate(self.places):
+            for alias in _aliases(name):
+                self._index.setdefault(alias, (order, name))
+        self._lengths = sorted({len(alias) for alias in self._index}, reverse=True)
+        self._matches = {}
+
+    @classmethod
+    def from_csv(cls, path):
+        """Places from a gazetteer CSV with name, latitude and longitude columns."""
+        places = pd.read_csv(path, usecols=["name", "latitude", "longitude"])
+        return cls(
+            (name, (latitude, longitude))
+            for name, latitude, longitude in places.itertuples(index=False)
+        )
+
+    def _match(self, text):
+        key = _match_key(text)
+        for length in self._lengths:
+            found = [
+                self._index[key[start : start + length]]
+                for start in range(len(key) - length + 1)
+                if key[start : start + length] in self._index
+            ]
+            if found:
+                return min(found)[1]
+        return None
+
+    def match(self, text):
+        """Name of the place text refers to, or None."""
+        if text not in self._matches:
+            self._matches[text] = self._match(text)
+        return self._matches[text]
+
+    def location(self, text):
+        """The matched place and its coordinates, or None."""
+        name = self.match(text)
+        if name is None:
+            return None
+        latitude, longitude = self.places[name]
+        return {"name": name, "latitude": latitude, "longitude": longitude}
+
+
+nz_places = PlaceMatcher.from_csv(GAZETTEER) if GAZETTEER else PlaceMatcher(NZ_PLACES)
@@ -0,0 +1,40 @@
+"""gunicorn settings for serving with several worker processes.
+
+    gunicorn -c gunicorn.conf.py app:app
+
+A publisher process (shared_data.py) loads the exports once and publishes
+every version as memory-mapped files; workers map those instead of each
+loading its own copy, so adding workers adds little memory.
+"""
+
+import os
+import subprocess
+import sys
+
+# Must be set before config is imported; workers inherit it when forked
+os.environ.setdefault("CITA_SHARED_DATA", "1")
+
+from config import SHARED_DATA, SHARED_DATA_DIR  # noqa: E402
+from shared_data import published_counter, wait_for_publication  # noqa: E402
+
+bind = os.environ.get("CITA_BIND", "127.0.0.1:5000")
+workers = int(os.environ.get("WEB_CONCURRENCY", "4"))
+threads = int(os.environ.get("CITA_THREADS", "4"))
+
+
+def on_starting(server):
+    server.publisher = None
+    if not SHARED_DATA:
+        return
+    previous = published_counter(SHARED_DATA_DIR)
+    server.publisher = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(__file__), "shared_data.py")]
+    )
+    # Workers start once this run's first version is there to map
+    wait_for_publication(SHARED_DATA_DIR, previous)
+
+
+def on_exit(server):
+    if server.publisher is not None:
+        server.publisher.terminate()
+        server.publisher.wait()
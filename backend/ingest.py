@@ -0,0 +1,444 @@
+import hashlib
+import io
+import os
+
+import numpy as np
+import pandas as pd
+
+from activity import LoginIndex
+from data_processing import (
+    add_counts,
+    cached_frame,
+    latest_members,
+    preprocess_members,
+    preprocess_payments,
+    read_csv,
+    region_counts,
+    format_regions,
+    city_counts,
+    format_nz_distribution,
+    signup_month_counts,
+    format_new_members,
+    activity_counts,
+    format_activity_heatmap,
+    format_renewal_funnel,
+    monthly_income_totals,
+    payment_amount_counts,
+    format_income_trend,
+    format_payment_distribution,
+)
+from cohorts import RenewalTimeline
+from timeline import Timeline
+
+
+# Bytes just before the end of what was consumed that are read again and
+# compared before an append is taken
+CHECK_BYTES = 1 << 16
+
+
+class AppendOnlyCSV:
+    """Remembers how much of a CSV has been consumed.
+
+    Appends only consume complete lines, so a row that is still being written
+    is picked up on the next read. An append is only taken if the file is
+    the same one (inode), no shorter than what was consumed, and its first
+    line and the last CHECK_BYTES consumed are unchanged; anything else
+    counts as a rewrite. The bytes consumed are not read again otherwise, so
+    an edit in the middle of them goes unnoticed until the next full read.
+    sha256 is kept running over the bytes the frames were parsed from, as a
+    full read of the file would give it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.header = b""
+        self.offset = 0
+        self.rows = 0
+        self.mtime_ns = None
+        self.size = None
+        self._inode = None
+        self._digest = hashlib.sha256()
+        self._last = b""
+        self._ends_line = False
+
+    @property
+    def sha256(self):
+        return self._digest.hexdigest()
+
+    def changed(self):
+        stat = os.stat(self.path)
+        return (stat.st_mtime_ns, stat.st_size) != (self.mtime_ns, self.size)
+
+    def _consume(self, data):
+        self._digest.update(data)
+        self._last = (self._last + data[-CHECK_BYTES:])[-CHECK_BYTES:]
+        self.offset += len(data)
+        self.rows += data.count(b"\n")
+        if data:
+            self._ends_line = data.endswith(b"\n")
+        return data
+
+    def read_all(self):
+        stat = os.stat(self.path)
+        with open(self.path, "rb") as f:
+            data = f.read()
+        self.mtime_ns, self.size = stat.st_mtime_ns, stat.st_size
+        self._inode = stat.st_ino
+        self.header = data[: data.find(b"\n") + 1]
+        self.offset, self.rows, self._ends_line = 0, 0, False
+        self._digest, self._last = hashlib.sha256(), b""
+        data = self._consume(data)
+        self.rows -= 1
+        return data[len(self.header) :]
+
+    def read_appended(self):
+        """Return newly appended complete lines, or None if the file was rewritten."""
+        stat = os.stat(self.path)
+        if (
+            stat.st_ino != self._inode
+            or stat.st_size < self.offset
+            or not self._ends_line
+        ):
+            return None
+        with open(self.path, "rb") as f:
+            if f.read(len(self.header)) != self.header:
+                return None
+            f.seek(self.offset - len(self._last))
+            if f.read(len(self._last)) != self._last:
+                return None
+            tail = f.read()
+        tail = tail[: tail.rfind(b"\n") + 1]
+        self.mtime_ns, self.size = stat.st_mtime_ns, stat.st_size
+        return self._consume(tail)
+
+    def parse(self, data):
+        return read_csv(io.BytesIO(self.header + data))
+
+
+def _resized(array, capacity):
+    resized = np.empty(capacity, dtype=array.dtype)
+    resized[: len(array)] = array
+    return resized
+
+
+def _codes_dtype(dtype):
+    # The integer type pandas keeps codes for dtype's categories in
+    return pd.Categorical.from_codes([], dtype=dtype).codes.dtype
+
+
+MASKED_ARRAYS = (
+    pd.arrays.IntegerArray,
+    pd.arrays.FloatingArray,
+    pd.arrays.BooleanArray,
+)
+
+
+class FrameBuffer:
+    """The columns of a preprocessed frame in arrays with room to grow.
+
+    frame() wraps the first len(self) rows without copying them, so appended
+    rows cost time in proportion to their number (the arrays grow by half
+    when full), and frames handed out before keep seeing only their own
+    rows, which are read-only. Overwriting rows therefore needs a copy()
+    first, a copy of every row.
+    """
+
+    def __init__(self, frame):
+        self._length = len(frame)
+        self._dtypes = dict(frame.dtypes)
+        self._arrays = {
+            name: [_resized(part, len(frame)) for part in self._parts(name, column)]
+            for name, column in frame.items()
+        }
+
+    def __len__(self):
+        return self._length
+
+    def _parts(self, name, column):
+        # Codes for categorical columns, values and mask for nullable ones
+        dtype = self._dtypes[name]
+        if not isinstance(dtype, pd.CategoricalDtype):
+            array = column.astype(dtype).array
+            if isinstance(array, MASKED_ARRAYS):
+                values = array.to_numpy(dtype=dtype.numpy_dtype, na_value=0)
+                return [values, np.asarray(array.isna())]
+            return [np.asarray(array)]
+
+        new = column.cat.categories.difference(dtype.categories, sort=False)
+        if len(new):
+            # Added categories go at the end, so codes already kept stay valid
+            dtype = pd.CategoricalDtype(dtype.categories.append(new))
+            self._dtypes[name] = dtype
+            codes = _codes_dtype(dtype)
+            self._arrays[name] = [array.astype(codes) for array in self._arrays[name]]
+        recode = dtype.categories.get_indexer(column.cat.categories)
+        codes = column.cat.codes.to_numpy()
+        codes = np.where(codes < 0, -1, recode[codes])
+        return [codes.astype(_codes_dtype(dtype))]
+
+    def frame(self):
+        columns = {}
+        for name, dtype in self._dtypes.items():
+            parts = [array[: self._length] for array in self._arrays[name]]
+            for part in parts:
+                part.flags.writeable = False
+            if isinstance(dtype, pd.CategoricalDtype):
+                columns[name] = pd.Categorical.from_codes(
+                    parts[0], dtype=dtype, validate=False
+                )
+            elif len(parts) == 2:
+                columns[name] = dtype.construct_array_type()(*parts)
+            else:
+                columns[name] = parts[0]
+        return pd.DataFrame(columns, copy=False)
+
+    def append(self, frame):
+        end = self._length + len(frame)
+        for name in self._dtypes:
+            parts = self._parts(name, frame[name])
+            arrays = self._arrays[name]
+            if end > len(arrays[0]):
+                capacity = max(end, len(arrays[0]) * 3 // 2)
+                arrays = self._arrays[name] = [
+                    _resized(array[: self._length], capacity) for array in arrays
+                ]
+            for array, part in zip(arrays, parts):
+                array[self._length : end] = part
+        self._length = end
+
+    def assign(self, rows, frame):
+        """Overwrite the given rows with those of frame."""
+        for name in self._dtypes:
+            parts = self._parts(name, frame[name])
+            for array, part in zip(self._arrays[name], parts):
+                array[rows] = part
+
+    def copy(self):
+        buffer = FrameBuffer.__new__(FrameBuffer)
+        buffer._length = self._length
+        buffer._dtypes = dict(self._dtypes)
+        buffer._arrays = {
+            name: [array.copy() for array in arrays]
+            for name, arrays in self._arrays.items()
+        }
+        return buffer
+
+
+def member_counts(members):
+    """Partial aggregates of members that can be added and taken back out."""
+    renewed = int(members["Last Payment Date"].notna().sum())
+    return {
+        "regions": region_counts(members["Region"]),
+        "cities": city_counts(members),
+        "signup_months": signup_month_counts(members),
+        "activity": activity_counts(members),
+        "renewals": {True: renewed, False: len(members) - renewed},
+    }
+
+
+def format_aggregates(counts, monthly_income, amount_counts):
+    """Dashboard aggregates from member_counts and the payment totals."""
+    main_regions, other_regions = format_regions(counts["regions"])
+    renewals = counts["renewals"]
+    return {
+        "region_distribution": {
+            "main_regions": main_regions,
+            "other_regions": other_regions,
+        },
+        "renewal_funnel": format_renewal_funnel(
+            renewals.get(True, 0), renewals.get(True, 0) + renewals.get(False, 0)
+        ),
+        "activity_heatmap": format_activity_heatmap(counts["activity"]),
+        "nz_city_distribution": format_nz_distribution(counts["cities"]),
+        "new_members": format_new_members(counts["signup_months"]),
+        "income_trend": format_income_trend(monthly_income),
+        "payment_distribution": format_payment_distribution(amount_counts),
+    }
+
+
+def _update_counts(totals, added, removed):
+    for key, counts in added.items():
+        add_counts(totals.setdefault(key, {}), counts)
+    for key, counts in removed.items():
+        add_counts(totals[key], {name: -count for name, count in counts.items()})
+        # Drop what only the removed rows had
+        totals[key] = {name: count for name, count in totals[key].items() if count}
+
+
+class IncrementalIngestor:
+    """Keeps the preprocessed frames, aggregates and timelines up to date.
+
+    Rows appended to payments.csv are parsed on their own and folded into the
+    monthly income and amount count totals and the renewal timeline; rows
+    appended to members.csv are upserted by Member ID, their counts added to
+    the member aggregates and those of the rows they replace taken out. The
+    sorted Timeline and LoginIndex are merged into rather than rebuilt.
+    Anything other than a pure append falls back to a full reload of that
+    file.
+
+    Nothing read before is parsed, hashed or sorted again. What still takes
+    time in proportion to all rows are plain array copies: inserting into
+    the sorted timelines, and copying the members' FrameBuffer when an
+    append replaces rows of members already seen.
+    """
+
+    def __init__(self, data_dir, cache_dir=None):
+        self.cache_dir = (
+            os.path.join(data_dir, ".cache") if cache_dir is None else cache_dir
+        )
+        self.members_csv = AppendOnlyCSV(os.path.join(data_dir, "members.csv"))
+        self.payments_csv = AppendOnlyCSV(os.path.join(data_dir, "payments.csv"))
+        self.members = None
+        self.payments = None
+        self.member_counts = {}
+        self.monthly_income = {}
+        self.amount_counts = {}
+        self.renewals = None
+        self.storage = None
+        self._member_rows = None
+        self._payment_rows = None
+        # Member IDs, sorted, and the row of each
+        self._sorted_ids = None
+        self._id_rows = None
+        self._timeline = None
+        self._logins = None
+
+    @property
+    def files(self):
+        return {
+            csv.path: {"sha256": csv.sha256, "size": csv.offset, "rows": csv.rows}
+            for csv in (self.members_csv, self.payments_csv)
+        }
+
+    def changed(self):
+        return self.members_csv.changed() or self.payments_csv.changed()
+
+    def load(self):
+        self._load_members()
+        self._load_payments()
+
+    def _load(self, name, csv, preprocess):
+        data = csv.read_all()
+        return cached_frame(
+            self.cache_dir, name, csv.sha256, lambda: preprocess(csv.parse(data))
+        )
+
+    def _load_members(self):
+        self._member_rows = FrameBuffer(
+            self._load(
+                "members",
+                self.members_csv,
+                lambda members: latest_members(preprocess_members(members)),
+            )
+        )
+        self.members = self._member_rows.frame()
+        self.member_counts = member_counts(self.members)
+        ids = self.members["Member ID"].to_numpy()
+        self._id_rows = np.argsort(ids, kind="stable")
+        self._sorted_ids = ids[self._id_rows]
+        self._timeline = None
+        self._logins = None
+
+    def _load_payments(self):
+        self._payment_rows = FrameBuffer(
+            self._load("payments", self.payments_csv, preprocess_payments)
+        )
+        self.payments = self._payment_rows.frame()
+        self.monthly_income = monthly_income_totals(self.payments)
+        self.amount_counts = payment_amount_counts(self.payments)
+        self.renewals = RenewalTimeline.from_payments(self.payments)
+        self._timeline = None
+
+    def refresh(self):
+        """Pick up changes on disk; returns True if anything new was read."""
+        updated = False
+
+        if self.members_csv.changed():
+            previous = self.members_csv.sha256
+            tail = self.members_csv.read_appended()
+            if tail is None:
+                self._load_members()
+            elif tail:
+                self._upsert_members(
+                    preprocess_members(self.members_csv.parse(tail))
+                )
+            updated |= self.members_csv.sha256 != previous
+
+        if self.payments_csv.changed():
+            previous = self.payments_csv.sha256
+            tail = self.payments_csv.read_appended()
+            if tail is None:
+                self._load_payments()
+            elif tail:
+                self._append_payments(
+                    preprocess_payments(self.payments_csv.parse(tail))
+                )
+            updated |= self.payments_csv.sha256 != previous
+
+        return updated
+
+    def _upsert_members(self, updates):
+        # Like latest_members over old and new rows together, but only the
+        # rows of the members in updates are looked at: each takes the place
+        # of its member's current row, or is added at the end
+        updates = latest_members(updates)
+        ids = updates["Member ID"].to_numpy()
+        at = np.searchsorted(self._sorted_ids, ids)
+        found = np.zeros(len(ids), dtype=bool)
+        inside = at < len(self._sorted_ids)
+        found[inside] = self._sorted_ids[at[inside]] == ids[inside]
+        replaced = self._id_rows[at[found]]
+        superseded = self.members.iloc[replaced]
+
+        if len(replaced):
+            # Frames already handed out must not change under their readers
+            self._member_rows = self._member_rows.copy()
+            self._member_rows.assign(replaced, updates[found])
+        start = len(self._member_rows)
+        self._member_rows.append(updates[~found])
+        self.members = self._member_rows.frame()
+
+        added = ids[~found]
+        order = np.argsort(added, kind="stable")
+        positions = np.searchsorted(self._sorted_ids, added[order])
+        self._sorted_ids = np.insert(self._sorted_ids, positions, added[order])
+        self._id_rows = np.insert(self._id_rows, positions, start + order)
+
+        _update_counts(
+            self.member_counts, member_counts(updates), member_counts(superseded)
+        )
+        if self._timeline is not None:
+            self._timeline = self._timeline.updated(
+                members=updates, superseded=superseded
+            )
+        if self._logins is not None:
+            self._logins = self._logins.merged(
+                updates["Last logged in"], superseded["Last logged in"]
+            )
+
+    def _append_payments(self, new_payments):
+        self._payment_rows.append(new_payments)
+        self.payments = self._payment_rows.frame()
+        for month, amount in monthly_income_totals(new_payments).items():
+            self.monthly_income[month] = self.monthly_income.get(month, 0.0) + amount
+        for amount, count in payment_amount_counts(new_payments).items():
+            self.amount_counts[amount] = self.amount_counts.get(amount, 0) + count
+        self.renewals = self.renewals.extend(new_payments)
+        if self._timeline is not None:
+            self._timeline = self._timeline.updated(payments=new_payments)
+
+    def timeline(self):
+        # Built after a full load; appends then merge into it
+        if self._timeline is None:
+            self._timeline = Timeline(self.members, self.payments)
+        return self._timeline
+
+    def logins(self):
+        if self._logins is None:
+            self._logins = LoginIndex(self.members["Last logged in"])
+        return self._logins
+
+    def aggregates(self):
+        return format_aggregates(
+            self.member_counts, self.monthly_income, self.amount_counts
+        )
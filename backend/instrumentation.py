@@ -0,0 +1,185 @@
+import functools
+import re
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+class StageRecord:
+    """Wall time, rows and peak allocation of one run of a stage."""
+
+    __slots__ = ("name", "rows", "seconds", "peak_bytes", "_start", "_peak")
+
+    def __init__(self, name, rows=None):
+        self.name = name
+        self.rows = rows
+        self.seconds = 0.0
+        self.peak_bytes = None
+        self._start = 0
+        self._peak = 0
+
+
+class StageMetrics:
+    """Opt-in per-stage timing for loading, preprocessing and aggregations.
+
+    Totals are kept per stage name for the metrics endpoint; stages that run
+    while a request is being handled are also collected for that request's
+    Server-Timing header. Peak allocation uses tracemalloc, which slows
+    everything down noticeably, so it is enabled separately. tracemalloc
+    counts allocations from every thread, so peaks of stages that overlap
+    with other work are an upper bound.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.track_memory = False
+        self._lock = threading.Lock()
+        self._totals = {}
+        self._local = threading.local()
+
+    def configure(self, enabled, track_memory=False):
+        self.enabled = enabled
+        self.track_memory = enabled and track_memory
+        if self.track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        """Time the enclosed block; rows may also be set on the yielded record."""
+        if not self.enabled:
+            yield StageRecord(name, rows)
+            return
+
+        record = StageRecord(name, rows)
+        stack = self._stack()
+        if self.track_memory:
+            # tracemalloc has a single peak; fold it into the enclosing stage
+            # before resetting it for this one
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1]._peak = max(stack[-1]._peak, peak)
+            tracemalloc.reset_peak()
+            record._start = record._peak = current
+        stack.append(record)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record.seconds = time.perf_counter() - start
+            stack.pop()
+            if self.track_memory:
+                record._peak = max(record._peak, tracemalloc.get_traced_memory()[1])
+                record.peak_bytes = record._peak - record._start
+                if stack:
+                    stack[-1]._peak = max(stack[-1]._peak, record._peak)
+            self._record(record)
+
+    def observe(self, name, seconds, rows=None):
+        """Record a stage that was timed elsewhere."""
+        if self.enabled:
+            record = StageRecord(name, rows)
+            record.seconds = seconds
+            self._record(record)
+
+    def _record(self, record):
+        with self._lock:
+            totals = self._totals.setdefault(
+                record.name,
+                {"calls": 0, "seconds": 0.0, "rows": 0, "last": 0.0, "peak": 0},
+            )
+            totals["calls"] += 1
+            totals["seconds"] += record.seconds
+            totals["rows"] += record.rows or 0
+            totals["last"] = record.seconds
+            totals["peak"] = max(totals["peak"], record.peak_bytes or 0)
+        collected = getattr(self._local, "request", None)
+        if collected is not None:
+            collected.append(record)
+
+    def timed(self, name=None):
+        """Decorator timing a function as a stage.
+
+        When the first argument is a frame or array its length is recorded as
+        the rows processed.
+        """
+
+        def decorator(func):
+            stage_name = name or func.__name__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                shape = getattr(args[0], "shape", None) if args else None
+                rows = shape[0] if shape else None
+                with self.stage(stage_name, rows):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def begin_request(self):
+        self._local.request = [] if self.enabled else None
+
+    def end_request(self):
+        collected = getattr(self._local, "request", None)
+        self._local.request = None
+        return collected or []
+
+    def snapshot(self):
+        with self._lock:
+            return {name: dict(totals) for name, totals in self._totals.items()}
+
+    def prometheus(self, gauges=None):
+        """Totals in the Prometheus text exposition format."""
+        totals = self.snapshot()
+        families = [
+            ("calls_total", "counter", "Times each stage ran.", "calls"),
+            ("seconds_total", "counter", "Wall time spent in each stage.", "seconds"),
+            ("rows_total", "counter", "Rows processed by each stage.", "rows"),
+            ("last_seconds", "gauge", "Wall time of the latest run.", "last"),
+        ]
+        if self.track_memory:
+            families.append(
+                ("peak_bytes", "gauge", "Largest peak allocation of a run.", "peak")
+            )
+
+        lines = []
+        for suffix, kind, help_text, key in families:
+            lines.append(f"# HELP cita_stage_{suffix} {help_text}")
+            lines.append(f"# TYPE cita_stage_{suffix} {kind}")
+            for name in sorted(totals):
+                lines.append(
+                    f'cita_stage_{suffix}{{stage="{_label(name)}"}} {totals[name][key]}'
+                )
+        for name, (help_text, value) in (gauges or {}).items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def server_timing(records):
+    """Server-Timing header value, in milliseconds, for the given stage records."""
+    entries = []
+    for record in records:
+        token = re.sub(r"[^A-Za-z0-9_.-]", "_", record.name)
+        entries.append(f"{token};dur={record.seconds * 1000:.2f}")
+    return ", ".join(entries)
+
+
+metrics = StageMetrics()
+stage = metrics.stage
+timed = metrics.timed
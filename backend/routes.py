@@ -0,0 +1,130 @@
+"""The /api routes as a Flask app over a given store.
+
+app.py serves them from the store configured for the process; benchmarks
+build one over a store of their own.
+"""
+
+import time
+
+from flask import Flask, Response, abort, g, jsonify, request
+from flask_cors import CORS
+import pandas as pd
+from cube import CubeFilters
+from instrumentation import metrics, server_timing
+
+SNAPSHOT_ROUTES = [
+    ("/api/dashboard", None),
+    ("/api/key_metrics", "key_metrics"),
+    ("/api/region_distribution", "region_distribution"),
+    ("/api/membership_status", "membership_status"),
+    ("/api/payment_distribution", "payment_distribution"),
+    ("/api/renewal_funnel", "renewal_funnel"),
+    ("/api/income_trend", "income_trend"),
+    ("/api/activity_heatmap", "activity_heatmap"),
+    ("/api/nz_city_distribution", "nz_city_distribution"),
+    ("/api/new_members", "new_members"),
+    ("/api/cohort_retention", "cohort_retention"),
+    ("/api/active_members_history", "active_members_history"),
+    ("/api/recent_activity", "recent_activity"),
+]
+
+
+def start_timing():
+    g.request_start = time.perf_counter()
+    metrics.begin_request()
+
+
+def add_server_timing(response):
+    stages = metrics.end_request()
+    if metrics.enabled and request.endpoint is not None:
+        total = time.perf_counter() - g.request_start
+        metrics.observe(f"request.{request.endpoint}", total)
+        timing = server_timing(stages)
+        response.headers["Server-Timing"] = (
+            f"{timing}, total;dur={total * 1000:.2f}"
+            if timing
+            else f"total;dur={total * 1000:.2f}"
+        )
+    return response
+
+
+def snapshot_response(store, name=None):
+    # ?as_of=YYYY-MM-DD evaluates active/expired/new-this-month at that time;
+    # region, city, status, from, to and amount slice the data (see cube.py)
+    as_of = request.args.get("as_of")
+    snapshot = store.current.snapshot
+    try:
+        as_of = pd.Timestamp(as_of) if as_of else None
+        filters = CubeFilters.from_args(request.args)
+        if filters is not None:
+            body = snapshot.filtered_body(name, filters, as_of)
+        else:
+            body = snapshot.body(name, as_of=as_of)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return send_body(body)
+
+
+def send_body(body):
+    # Serve the pre-encoded (and pre-compressed) body, or 304 if the client
+    # already holds this version
+    encoding = request.accept_encodings.best_match(
+        body.supported_encodings(), default="identity"
+    )
+    etag = body.variant_etag(encoding)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body.variant(encoding), mimetype="application/json")
+        if encoding != "identity":
+            response.headers["Content-Encoding"] = encoding
+    response.set_etag(etag)
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def data_version(store):
+    return jsonify(store.current.describe())
+
+
+def stage_metrics(store):
+    if not metrics.enabled:
+        abort(404)
+    current = store.current
+    gauges = {
+        "cita_data_load_seconds": (
+            "Time taken to load the current data version.",
+            current.load_duration,
+        ),
+        "cita_data_loaded_timestamp_seconds": (
+            "When the current data version was loaded.",
+            current.loaded_at,
+        ),
+        "cita_data_members": (
+            "Members in the current data version.",
+            current.timeline.total_members,
+        ),
+        "cita_data_payments": (
+            "Payments in the current data version.",
+            current.timeline.total_payments,
+        ),
+    }
+    return Response(metrics.prometheus(gauges), mimetype="text/plain; version=0.0.4")
+
+
+def create_app(store):
+    """A Flask app serving /api from store, a DataStore or SharedDataStore."""
+    app = Flask(__name__)
+    CORS(app)
+    app.before_request(start_timing)
+    app.after_request(add_server_timing)
+    app.add_url_rule("/api/data_version", "data_version", lambda: data_version(store))
+    app.add_url_rule("/api/_metrics", "stage_metrics", lambda: stage_metrics(store))
+    for path, name in SNAPSHOT_ROUTES:
+        app.add_url_rule(
+            path,
+            name or "dashboard",
+            lambda name=name: snapshot_response(store, name),
+        )
+    return app
@@ -0,0 +1,377 @@
+import json
+import logging
+import mmap
+import os
+import shutil
+import struct
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from config import (
+    DATA_DIR,
+    DATA_RELOAD_INTERVAL,
+    DATA_INCREMENTAL_INGEST,
+    DATA_STREAMING,
+    DATA_CHUNK_ROWS,
+    DATA_FILES,
+    SQLITE_PATH,
+    STORAGE,
+    SHARED_DATA,
+    SHARED_DATA_DIR,
+)
+from activity import LoginIndex
+from cohorts import RenewalTimeline
+from cube import PAYMENT_COLUMNS
+from data_store import DataStore
+from encoding import encode_json
+from snapshot import build_snapshot
+from timeline import CountedTimes, SortedTimes, Timeline
+
+logger = logging.getLogger(__name__)
+
+# 8-byte little-endian counter of the latest complete version; workers map
+# this file and compare it on every request
+COUNTER_FILE = "VERSION"
+_COUNTER = struct.Struct("<Q")
+
+
+def _write_array(directory, name, array):
+    np.save(os.path.join(directory, f"{name}.npy"), np.ascontiguousarray(array))
+
+
+def _read_array(directory, name):
+    return np.load(
+        os.path.join(directory, f"{name}.npy"), mmap_mode="r", allow_pickle=False
+    )
+
+
+def _write_frame(directory, prefix, frame):
+    """Write each column as fixed-width arrays; returns the column layout."""
+    columns = []
+    for position, (name, series) in enumerate(frame.items()):
+        key = f"{prefix}.{position}"
+        dtype = series.dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            _write_array(directory, key, series.cat.codes.to_numpy())
+            columns.append(
+                {
+                    "name": name,
+                    "kind": "category",
+                    "categories": series.cat.categories.tolist(),
+                }
+            )
+        elif isinstance(dtype, pd.api.extensions.ExtensionDtype):
+            # Nullable integers: values plus a missing-value mask
+            _write_array(
+                directory, key, series.to_numpy(dtype=dtype.numpy_dtype, na_value=0)
+            )
+            _write_array(directory, f"{key}.mask", series.isna().to_numpy())
+            columns.append({"name": name, "kind": "masked"})
+        elif dtype == object:
+            raise TypeError(f"Column {name!r} is not fixed-width and can't be shared")
+        else:
+            _write_array(directory, key, series.to_numpy())
+            columns.append({"name": name, "kind": "array"})
+    return columns
+
+
+def _attach_frame(directory, prefix, columns):
+    # copy=False keeps every column a view of its memory-mapped file
+    data = {}
+    for position, column in enumerate(columns):
+        key = f"{prefix}.{position}"
+        values = _read_array(directory, key)
+        if column["kind"] == "category":
+            data[column["name"]] = pd.Categorical.from_codes(
+                values, categories=column["categories"]
+            )
+        elif column["kind"] == "masked":
+            data[column["name"]] = pd.arrays.IntegerArray(
+                values, _read_array(directory, f"{key}.mask")
+            )
+        else:
+            data[column["name"]] = values
+    return pd.DataFrame(data, copy=False)
+
+
+def _attach_timeline(directory, layout):
+    parts = {}
+    for part, names in layout["parts"].items():
+        arrays = {
+            name: _read_array(directory, f"timeline.{part}.{name}") for name in names
+        }
+        kind = CountedTimes if "counts" in arrays else SortedTimes
+        parts[part] = kind.from_arrays(**arrays)
+    return Timeline.from_parts(
+        layout["total_members"], layout["total_payments"], **parts
+    )
+
+
+class Publisher:
+    """Writes data versions where SharedDataStore workers can map them.
+
+    Each version gets its own directory holding the members columns, the
+    payments columns the filter cube reads, the timeline, renewal timeline
+    and login index arrays as .npy files, plus the precomputed aggregate
+    results. The counter is only bumped once the directory is complete, so a
+    worker never sees a partial version.
+    """
+
+    def __init__(self, shared_dir):
+        self.shared_dir = shared_dir
+        os.makedirs(shared_dir, exist_ok=True)
+        path = os.path.join(shared_dir, COUNTER_FILE)
+        if not os.path.exists(path):
+            with open(path, "wb") as f:
+                f.write(_COUNTER.pack(0))
+        with open(path, "r+b") as f:
+            self._counter = mmap.mmap(f.fileno(), _COUNTER.size)
+
+    @property
+    def counter(self):
+        return _COUNTER.unpack_from(self._counter)[0]
+
+    def publish(self, version):
+        counter = self.counter + 1
+        directory = os.path.join(self.shared_dir, f"v{counter}")
+        tmp_dir = f"{directory}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        manifest = {
+            "describe": version.describe(),
+            "members": None,
+            "payments": None,
+            "renewals": None,
+            "logins": None,
+        }
+        if version.members is not None:
+            manifest["members"] = _write_frame(tmp_dir, "members", version.members)
+        if version.payments is not None:
+            # Only what the filter cube needs; the other columns aren't fixed-width
+            manifest["payments"] = _write_frame(
+                tmp_dir, "payments", version.payments[PAYMENT_COLUMNS]
+            )
+        timeline = version.timeline
+        manifest["timeline"] = {
+            "total_members": timeline.total_members,
+            "total_payments": timeline.total_payments,
+            "parts": {},
+        }
+        for part, times in timeline.parts().items():
+            arrays = times.arrays()
+            for name, array in arrays.items():
+                _write_array(tmp_dir, f"timeline.{part}.{name}", array)
+            manifest["timeline"]["parts"][part] = sorted(arrays)
+        if version.renewals is not None:
+            arrays = version.renewals.arrays()
+            for name, array in arrays.items():
+                _write_array(tmp_dir, f"renewals.{name}", array)
+            manifest["renewals"] = sorted(arrays)
+        if version.logins is not None:
+            arrays = version.logins.arrays()
+            for name, array in arrays.items():
+                _write_array(tmp_dir, f"logins.{name}", array)
+            manifest["logins"] = sorted(arrays)
+
+        with open(os.path.join(tmp_dir, "results.json"), "wb") as f:
+            f.write(encode_json(dict(version.snapshot.results)))
+        with open(os.path.join(tmp_dir, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp_dir, directory)
+
+        _COUNTER.pack_into(self._counter, 0, counter)
+        self._counter.flush()
+        logger.info("Published data version %s as v%d", version.version, counter)
+        self._remove_before(counter - 1)
+        return counter
+
+    def _remove_before(self, counter):
+        # The previous version stays for workers still attaching to it; older
+        # ones can go, as files that are already mapped outlive their unlink
+        for name in os.listdir(self.shared_dir):
+            if name.startswith("v") and name[1:].isdigit() and int(name[1:]) < counter:
+                shutil.rmtree(os.path.join(self.shared_dir, name), ignore_errors=True)
+
+
+class SharedVersion:
+    """A published version, mapped read-only; the same surface as DataVersion."""
+
+    def __init__(self, counter, directory):
+        with open(os.path.join(directory, "manifest.json"), encoding="utf-8") as f:
+            manifest = json.load(f)
+        with open(os.path.join(directory, "results.json"), "rb") as f:
+            results = json.load(f)
+
+        self.counter = counter
+        self._description = manifest["describe"]
+        self.version = self._description["version"]
+        self.loaded_at = self._description["loaded_at"]
+        self.load_duration = self._description["load_duration"]
+        self.members = (
+            _attach_frame(directory, "members", manifest["members"])
+            if manifest["members"] is not None
+            else None
+        )
+        self.payments = (
+            _attach_frame(directory, "payments", manifest["payments"])
+            if manifest["payments"] is not None
+            else None
+        )
+        self.timeline = _attach_timeline(directory, manifest["timeline"])
+        self.renewals = (
+            RenewalTimeline.from_arrays(
+                **{
+                    name: _read_array(directory, f"renewals.{name}")
+                    for name in manifest["renewals"]
+                }
+            )
+            if manifest["renewals"] is not None
+            else None
+        )
+        self.logins = (
+            LoginIndex.from_arrays(
+                **{
+                    name: _read_array(directory, f"logins.{name}")
+                    for name in manifest["logins"]
+                }
+            )
+            if manifest["logins"] is not None
+            else None
+        )
+        self.snapshot = build_snapshot(
+            self.members,
+            self.payments,
+            self.version,
+            results,
+            self.timeline,
+            self.renewals,
+            self.logins,
+        )
+
+    def describe(self):
+        return {**self._description, "published": self.counter}
+
+
+class SharedDataStore:
+    """Serves the versions a Publisher writes, for one worker process.
+
+    Nothing is loaded until the first request. Each access to current reads
+    the shared counter and remaps when it has moved on.
+    """
+
+    def __init__(self, shared_dir, timeout=300):
+        self.shared_dir = shared_dir
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._counter = None
+        self._current = None
+
+    def _read_counter(self):
+        if self._counter is None:
+            path = os.path.join(self.shared_dir, COUNTER_FILE)
+            if not os.path.exists(path):
+                return 0
+            with open(path, "rb") as f:
+                self._counter = mmap.mmap(
+                    f.fileno(), _COUNTER.size, access=mmap.ACCESS_READ
+                )
+        return _COUNTER.unpack_from(self._counter)[0]
+
+    @property
+    def current(self):
+        counter = self._read_counter()
+        current = self._current
+        if current is None or current.counter != counter:
+            with self._lock:
+                if self._current is None or self._current.counter != counter:
+                    self._current = self._attach(counter)
+                current = self._current
+        return current
+
+    def _attach(self, counter):
+        deadline = time.monotonic() + self.timeout
+        while counter == 0:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"No data has been published to {self.shared_dir}")
+            time.sleep(0.1)
+            counter = self._read_counter()
+        while True:
+            try:
+                return SharedVersion(
+                    counter, os.path.join(self.shared_dir, f"v{counter}")
+                )
+            except FileNotFoundError:
+                # Removed by a newer publication while we were attaching
+                latest = self._read_counter()
+                if latest == counter:
+                    raise
+                counter = latest
+
+    def start_watcher(self, interval):
+        # The publisher process watches the exports
+        pass
+
+
+def run_publisher(shared_dir, data_dir, interval, **store_options):
+    """Load the exports once and publish every new version until stopped."""
+    store = DataStore(data_dir, **store_options)
+    publisher = Publisher(shared_dir)
+    publisher.publish(store.current)
+    while interval > 0:
+        time.sleep(interval)
+        try:
+            if store.reload_if_changed():
+                publisher.publish(store.current)
+        except Exception:
+            logger.exception("Publishing data from %s failed", data_dir)
+
+
+def published_counter(shared_dir):
+    return SharedDataStore(shared_dir)._read_counter()
+
+
+def wait_for_publication(shared_dir, after=0, timeout=300):
+    """Block until a version newer than counter `after` has been published."""
+    deadline = time.monotonic() + timeout
+    while published_counter(shared_dir) <= after:
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"No data was published to {shared_dir}")
+        time.sleep(0.1)
+
+
+def open_store():
+    """The store a server process should serve from, as configured.
+
+    Under gunicorn.conf.py the loading happens in one publisher process and
+    workers map its output; otherwise each process loads the exports itself.
+    """
+    if SHARED_DATA:
+        return SharedDataStore(SHARED_DATA_DIR)
+    return DataStore(
+        DATA_DIR,
+        incremental=DATA_INCREMENTAL_INGEST,
+        streaming=DATA_STREAMING,
+        chunk_rows=DATA_CHUNK_ROWS,
+        files=DATA_FILES,
+        storage=STORAGE,
+        sqlite_path=SQLITE_PATH,
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    run_publisher(
+        SHARED_DATA_DIR,
+        DATA_DIR,
+        DATA_RELOAD_INTERVAL,
+        incremental=DATA_INCREMENTAL_INGEST,
+        streaming=DATA_STREAMING,
+        chunk_rows=DATA_CHUNK_ROWS,
+        files=DATA_FILES,
+        storage=STORAGE,
+        sqlite_path=SQLITE_PATH,
+    )
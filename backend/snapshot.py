@@ -0,0 +1,304 @@
+from datetime import datetime
+from functools import partial
+from types import MappingProxyType
+
+from data_processing import (
+    calculate_key_metrics,
+    process_regions,
+    calculate_membership_status,
+    calculate_payment_distribution,
+    calculate_renewal_funnel,
+    calculate_income_trend,
+    calculate_activity_heatmap,
+    calculate_nz_distribution,
+    calculate_new_members,
+)
+from activity import LoginIndex, recent_activity
+from cohorts import RenewalTimeline, active_members_history, cohort_retention
+from cube import CUBE_RESULTS, build_cube
+from encoding import EncodedBody
+from instrumentation import timed
+from timeline import (
+    AsOfCache,
+    Timeline,
+    TimeAwareCache,
+    earliest,
+    next_month_start,
+)
+
+
+def _region_distribution(members, payments):
+    main_regions, other_regions = process_regions(members, "Region")
+    return {"main_regions": main_regions, "other_regions": other_regions}
+
+
+AGGREGATES = {
+    "region_distribution": _region_distribution,
+    "payment_distribution": lambda members, payments: calculate_payment_distribution(
+        payments
+    ),
+    "renewal_funnel": lambda members, payments: calculate_renewal_funnel(members),
+    "income_trend": lambda members, payments: calculate_income_trend(payments),
+    "activity_heatmap": lambda members, payments: calculate_activity_heatmap(members),
+    "nz_city_distribution": lambda members, payments: calculate_nz_distribution(
+        members
+    ),
+    "new_members": lambda members, payments: calculate_new_members(members),
+}
+
+
+def _format_key_metrics(counts, timeline, now):
+    total_members, active_members, new_members_this_month = counts
+    result = {
+        "total_members": total_members,
+        "active_members": active_members,
+        "new_members_this_month": new_members_this_month,
+    }
+    return result, earliest(timeline.next_change_after(now), next_month_start(now))
+
+
+def _key_metrics(members, timeline, now):
+    counts = calculate_key_metrics(members, now, timeline)
+    return _format_key_metrics(counts, timeline, now)
+
+
+def _membership_status(members, timeline, now):
+    status = calculate_membership_status(members, now, timeline)
+    return status, timeline.next_change_after(now)
+
+
+def _sql_key_metrics(storage, timeline, now):
+    counts = storage.calculate_key_metrics(now)
+    return _format_key_metrics(counts, timeline, now)
+
+
+def _sql_membership_status(storage, timeline, now):
+    status = storage.calculate_membership_status(now)
+    return status, timeline.next_change_after(now)
+
+
+def _cube(members, payments, timeline, now):
+    # The status dimension is as of now, so the cube holds until the next expiry
+    return build_cube(members, payments, now), timeline.next_expiry_after(now)
+
+
+# Why results that need row-level data are missing
+WITHOUT_ROWS = "not available in streaming mode or with SQLite storage"
+
+
+def _cohort_retention(members, renewals, now):
+    if renewals is None:
+        raise ValueError(f"Cohort retention is {WITHOUT_ROWS}")
+    return cohort_retention(members, renewals, now)
+
+
+def _active_members_history(members, renewals, now):
+    if renewals is None:
+        raise ValueError(f"Active members history is {WITHOUT_ROWS}")
+    return active_members_history(members, renewals, now)
+
+
+def _recent_activity(logins, now):
+    if logins is None:
+        raise ValueError(f"Recent activity is {WITHOUT_ROWS}")
+    return recent_activity(logins, now)
+
+
+# Aggregates that compare against the current time. Each returns its result
+# and the moment it may next change: the next membership expiry or signup, or
+# the start of next month for "new this month".
+TIME_DEPENDENT_AGGREGATES = {
+    "key_metrics": _key_metrics,
+    "membership_status": _membership_status,
+}
+
+# The same, queried from SQLite storage; the timeline still says until when
+SQL_TIME_DEPENDENT_AGGREGATES = {
+    "key_metrics": _sql_key_metrics,
+    "membership_status": _sql_membership_status,
+}
+
+# Time-dependent results served on their own endpoints rather than as part of
+# the dashboard, from the members frame and the payments' RenewalTimeline
+REPORTS = {
+    "cohort_retention": _cohort_retention,
+    "active_members_history": _active_members_history,
+}
+
+# Reports from the members' LoginIndex
+LOGIN_REPORTS = {
+    "recent_activity": _recent_activity,
+}
+
+
+# DataCubes kept for filtered as_of requests, besides the one for now
+AS_OF_CUBES = 4
+
+
+class DashboardSnapshot:
+    """All dashboard aggregates for one data version.
+
+    Most results are computed once when the snapshot is built. Results that
+    depend on the current time are kept in a TimeAwareCache until the next
+    expiry or month boundary that could change them, so they stay exact
+    without being recomputed on every request. Encoded JSON bodies are
+    cached the same way, as is the DataCube filtered results come from; the
+    cubes of the last few as_of times are kept too.
+    """
+
+    def __init__(
+        self,
+        version,
+        results,
+        live=None,
+        cube=None,
+        city_distribution=None,
+        reports=None,
+    ):
+        self.version = version
+        self.results = MappingProxyType(results)
+        self._live = live or {}
+        self._reports = reports or {}
+        self._cube = cube
+        self._city_distribution = city_distribution
+        self._cache = TimeAwareCache()
+        self._as_of_cubes = AsOfCache(AS_OF_CUBES)
+
+    def names(self):
+        return list(self.results) + list(self._live)
+
+    def _result(self, name, now, cached=True):
+        compute = self._live.get(name) or self._reports.get(name)
+        if compute is None:
+            return self.results[name], None
+        if not cached:
+            return compute(now)
+        return self._cache.get(name, compute, now)
+
+    def result(self, name, as_of=None):
+        if as_of is not None:
+            return self._result(name, as_of, cached=False)[0]
+        return self._result(name, datetime.now())[0]
+
+    def __getitem__(self, name):
+        return self.result(name)
+
+    def _encode(self, name, now, cached):
+        if name is not None:
+            data, valid_until = self._result(name, now, cached)
+            return EncodedBody(data), valid_until
+        parts = {part: self._result(part, now, cached) for part in self.names()}
+        data = {part: value for part, (value, _) in parts.items()}
+        valid_until = earliest(*(until for _, until in parts.values()))
+        return EncodedBody(data), valid_until
+
+    def body(self, name=None, as_of=None):
+        """Encoded JSON body for one aggregate, or all of them when name is None.
+
+        Bodies for the current time are cached; as-of bodies are recomputed
+        from the timeline each time so they don't evict the live entries.
+        """
+        if as_of is not None and (
+            name is None or name in self._live or name in self._reports
+        ):
+            return self._encode(name, as_of, cached=False)[0]
+        encode = partial(self._encode, name, cached=True)
+        return self._cache.get(("body", name), encode, datetime.now())[0]
+
+    def cube(self, as_of=None):
+        """The DataCube for now, or for as_of; None without row-level data."""
+        if self._cube is None:
+            return None
+        if as_of is not None:
+            return self._as_of_cubes.get(self._cube, as_of)[0]
+        return self._cache.get("cube", self._cube, datetime.now())[0]
+
+    def filtered(self, name, filters, as_of=None):
+        """Result for one aggregate, or all of them, restricted to filters."""
+        if name is not None and name not in CUBE_RESULTS:
+            raise ValueError(f"Filters are not available for {name}")
+        if not filters.by_month() or self._cube is None:
+            return self._filtered_rows(name, filters, as_of)
+        cube = self.cube(as_of)
+        now = datetime.now() if as_of is None else as_of
+        if name is None:
+            return {part: cube.result(part, filters, now) for part in CUBE_RESULTS}
+        return cube.result(name, filters, now)
+
+    def _filtered_rows(self, name, filters, as_of=None):
+        # The city distribution took status and signup dates before there was
+        # a cube; those still filter the members frame, or SQLite's table
+        if (
+            name == "nz_city_distribution"
+            and self._city_distribution is not None
+            and filters.region is None
+            and filters.city is None
+            and filters.amount is None
+        ):
+            return self._city_distribution(
+                filters.status, filters.signed_up_from, filters.signed_up_to, as_of
+            )
+        if self._cube is None:
+            raise ValueError(f"Filters are {WITHOUT_ROWS}")
+        raise ValueError("from and to must be the start of a month, e.g. 2023-01")
+
+    def filtered_body(self, name, filters, as_of=None):
+        return EncodedBody(self.filtered(name, filters, as_of))
+
+
+@timed()
+def build_snapshot(
+    members,
+    payments,
+    version=0,
+    precomputed=None,
+    timeline=None,
+    renewals=None,
+    logins=None,
+    storage=None,
+):
+    # Aggregates maintained elsewhere (e.g. by incremental ingestion) are taken
+    # as-is instead of being recomputed from the frames
+    precomputed = precomputed or {}
+    results = {
+        name: precomputed[name]
+        if name in precomputed
+        else aggregate(members, payments)
+        for name, aggregate in AGGREGATES.items()
+    }
+    timeline = Timeline(members, payments) if timeline is None else timeline
+    if storage is not None:
+        live = {
+            name: partial(aggregate, storage, timeline)
+            for name, aggregate in SQL_TIME_DEPENDENT_AGGREGATES.items()
+        }
+        city_distribution = storage.calculate_nz_distribution
+    else:
+        live = {
+            name: partial(aggregate, members, timeline)
+            for name, aggregate in TIME_DEPENDENT_AGGREGATES.items()
+        }
+        city_distribution = (
+            partial(calculate_nz_distribution, members)
+            if members is not None
+            else None
+        )
+    cube = (
+        partial(_cube, members, payments, timeline)
+        if members is not None and payments is not None
+        else None
+    )
+    if renewals is None and payments is not None and "Extended To" in payments:
+        renewals = RenewalTimeline.from_payments(payments)
+    reports = {
+        name: partial(report, members, renewals)
+        for name, report in REPORTS.items()
+    }
+    if logins is None and members is not None:
+        logins = LoginIndex(members["Last logged in"])
+    reports.update(
+        {name: partial(report, logins) for name, report in LOGIN_REPORTS.items()}
+    )
+    return DashboardSnapshot(
+        version, results, live, cube, city_distribution, reports
+    )
@@ -0,0 +1,473 @@
+"""Members and payments kept in an SQLite database instead of in memory.
+
+    CITA_STORAGE=sqlite python app.py
+
+The exports are parsed in chunks, as in streaming mode, and written once
+into typed, indexed tables; the database is reused for as long as the
+exports' hashes match. Every aggregate is then a query pushed down to
+SQLite, so neither loading nor aggregating holds the rows in memory; the
+connection stays open to answer the time-dependent and filtered ones.
+"""
+
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from data_processing import (
+    file_hash,
+    month_ordinal,
+    preprocess_members,
+    preprocess_payments,
+    format_regions,
+    format_payment_distribution,
+    format_renewal_funnel,
+    format_income_trend,
+    format_activity_heatmap,
+    format_nz_distribution,
+    format_new_members,
+)
+from instrumentation import stage, timed
+from streaming import CHUNK_ROWS, MEMBER_DTYPES, read_chunks
+from timeline import Timeline
+
+PAYMENT_DTYPES = {"Member ID": str, "Comment": str, "Amount": str, "Paid at": str}
+
+# Times are stored as nanoseconds since 1970, like datetime64[ns]
+NS_PER_DAY = 86_400 * 10**9
+
+# (table, column, frame column) for every stored column
+MEMBER_COLUMNS = [
+    ("member_id", "INTEGER NOT NULL", "Member ID"),
+    ("expiry", "INTEGER", "Expiry date"),
+    ("last_payment", "INTEGER", "Last Payment Date"),
+    ("signed_up", "INTEGER", "Date Signed up"),
+    ("last_login", "INTEGER", "Last logged in"),
+    ("region", "TEXT NOT NULL", "Region"),
+    ("city", "TEXT NOT NULL", "City"),
+    ("day_of_week", "INTEGER", "DayOfWeek"),
+    ("hour", "INTEGER", "Hour"),
+    ("signup_month", "INTEGER", "Sign Up Month"),
+]
+PAYMENT_COLUMNS = [
+    ("member_id", "INTEGER", "Member ID"),
+    ("paid_at", "INTEGER", "Paid at"),
+    ("amount", "REAL", "Amount"),
+    ("month", "INTEGER", "Month"),
+    ("extended_to", "INTEGER", "Extended To"),
+]
+
+# Members signed up by a time, like data_processing.signed_up_by
+SIGNED_UP_BY = "(signed_up IS NULL OR signed_up <= ?)"
+
+# Each covers the queries below that filter or group by its columns
+INDEXES = [
+    "CREATE INDEX members_expiry ON members (expiry)",
+    "CREATE INDEX members_signup_month ON members (signup_month)",
+    "CREATE INDEX members_activity ON members (day_of_week, hour)",
+    "CREATE INDEX payments_month ON payments (month, amount)",
+    "CREATE INDEX payments_amount ON payments (amount)",
+    "CREATE INDEX payments_member ON payments (member_id, paid_at)",
+]
+
+
+def _ns(t):
+    return int(np.datetime64(pd.Timestamp(t), "ns").astype(np.int64))
+
+
+def _values(series):
+    # Plain Python values for sqlite3, None where missing
+    missing = series.isna().to_numpy()
+    if pd.api.types.is_datetime64_dtype(series):
+        values = series.to_numpy().view(np.int64).astype(object)
+    elif isinstance(series.dtype, pd.CategoricalDtype):
+        values = series.astype(object).to_numpy()
+    else:
+        values = series.to_numpy(dtype=object, na_value=None)
+    values[missing] = None
+    return values.tolist()
+
+
+def _insert(connection, table, columns, frame):
+    names = ", ".join(name for name, _, _ in columns)
+    placeholders = ", ".join("?" for _ in columns)
+    rows = zip(
+        *(
+            _values(frame[source])
+            if source in frame
+            else [None] * len(frame)
+            for _, _, source in columns
+        )
+    )
+    connection.executemany(
+        f"INSERT INTO {table} ({names}) VALUES ({placeholders})", rows
+    )
+
+
+class SQLiteStorage:
+    """Pushed-down equivalents of the calculate_* functions over the tables.
+
+    Each method takes the arguments of its data_processing namesake other
+    than the frames and returns the same result.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(cls, path):
+        # Requests query from several threads, one at a time under _lock
+        return cls(sqlite3.connect(path, check_same_thread=False))
+
+    def close(self):
+        self.connection.close()
+
+    @classmethod
+    @timed("sql.ingest")
+    def create(cls, path, members_path, payments_path, chunk_rows=CHUNK_ROWS):
+        """Write the exports into a new database at path, replacing any there.
+
+        Returns the open storage and the rows read from each export.
+        """
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        connection = sqlite3.connect(tmp_path)
+        # A half-written database is thrown away, so it needs no journal
+        connection.execute("PRAGMA journal_mode = OFF")
+        connection.execute("PRAGMA synchronous = OFF")
+        for table, columns in (
+            ("member_rows", MEMBER_COLUMNS),
+            ("members", MEMBER_COLUMNS),
+            ("payments", PAYMENT_COLUMNS),
+        ):
+            definitions = ", ".join(f"{name} {type}" for name, type, _ in columns)
+            connection.execute(f"CREATE TABLE {table} ({definitions})")
+        connection.execute(
+            "CREATE TABLE sources (path TEXT, sha256 TEXT, size INTEGER, rows INTEGER)"
+        )
+
+        rows = {"members": 0, "payments": 0}
+        for chunk in read_chunks(members_path, MEMBER_DTYPES, chunk_rows):
+            rows["members"] += len(chunk)
+            with stage("sql.insert.members", len(chunk)):
+                _insert(
+                    connection,
+                    "member_rows",
+                    MEMBER_COLUMNS,
+                    preprocess_members(chunk),
+                )
+        with stage("sql.latest_members"):
+            # Like latest_members: each member's last row, in the place the
+            # member was first seen
+            connection.execute(
+                "INSERT INTO members SELECT m.* FROM member_rows AS m JOIN"
+                " (SELECT member_id, MIN(rowid) AS first, MAX(rowid) AS last"
+                " FROM member_rows GROUP BY member_id) AS g ON m.rowid = g.last"
+                " ORDER BY g.first"
+            )
+            connection.execute("DROP TABLE member_rows")
+        for chunk in read_chunks(payments_path, PAYMENT_DTYPES, chunk_rows):
+            rows["payments"] += len(chunk)
+            with stage("sql.insert.payments", len(chunk)):
+                _insert(
+                    connection, "payments", PAYMENT_COLUMNS, preprocess_payments(chunk)
+                )
+        with stage("sql.index"):
+            for statement in INDEXES:
+                connection.execute(statement)
+            connection.execute("ANALYZE")
+        connection.commit()
+        connection.close()
+        os.replace(tmp_path, path)
+        return cls.open(path), rows
+
+    def sources(self):
+        return {
+            path: {"sha256": sha256, "size": size, "rows": rows}
+            for path, sha256, size, rows in self.connection.execute(
+                "SELECT path, sha256, size, rows FROM sources"
+            )
+        }
+
+    def record_sources(self, files):
+        with self.connection:
+            self.connection.execute("DELETE FROM sources")
+            self.connection.executemany(
+                "INSERT INTO sources VALUES (?, ?, ?, ?)",
+                [
+                    (path, info["sha256"], info["size"], info["rows"])
+                    for path, info in files.items()
+                ],
+            )
+
+    def _one(self, query, *params):
+        with self._lock:
+            return self.connection.execute(query, params).fetchone()
+
+    def _all(self, query, *params):
+        with self._lock:
+            return self.connection.execute(query, params).fetchall()
+
+    @timed("sql.calculate_key_metrics")
+    def calculate_key_metrics(self, now=None):
+        now = datetime.now() if now is None else now
+        return self._one(
+            f"SELECT (SELECT COUNT(*) FROM members WHERE {SIGNED_UP_BY}),"
+            f" (SELECT COUNT(*) FROM members WHERE expiry > ? AND {SIGNED_UP_BY}),"
+            " (SELECT COUNT(*) FROM members WHERE signup_month = ?)",
+            _ns(now),
+            _ns(now),
+            _ns(now),
+            month_ordinal(now),
+        )
+
+    @timed("sql.calculate_membership_status")
+    def calculate_membership_status(self, now=None):
+        now = datetime.now() if now is None else now
+        active, with_expiry = self._one(
+            "SELECT (SELECT COUNT(*) FROM members"
+            f" WHERE expiry > ? AND {SIGNED_UP_BY}),"
+            f" (SELECT COUNT(expiry) FROM members WHERE {SIGNED_UP_BY})",
+            _ns(now),
+            _ns(now),
+            _ns(now),
+        )
+        expiry_status = sorted(
+            [("Active", active), ("Expired", with_expiry - active)],
+            key=lambda item: -item[1],
+        )
+        return {status: count for status, count in expiry_status if count}
+
+    @timed("sql.process_regions")
+    def process_regions(self, normalizer=None):
+        # Grouped in order of first appearance, like region_counts
+        counts = self._all(
+            "SELECT region, COUNT(*) FROM members GROUP BY region ORDER BY MIN(rowid)"
+        )
+        return format_regions(dict(counts), normalizer)
+
+    @timed("sql.calculate_payment_distribution")
+    def calculate_payment_distribution(self):
+        counts = self._all(
+            "SELECT amount, COUNT(*) FROM payments WHERE amount IS NOT NULL"
+            " GROUP BY amount ORDER BY COUNT(*) DESC, MIN(rowid)"
+        )
+        return format_payment_distribution(dict(counts))
+
+    @timed("sql.calculate_renewal_funnel")
+    def calculate_renewal_funnel(self):
+        renewed, total = self._one("SELECT COUNT(last_payment), COUNT(*) FROM members")
+        return format_renewal_funnel(renewed, total)
+
+    @timed("sql.calculate_income_trend")
+    def calculate_income_trend(self):
+        totals = self._all(
+            "SELECT month, TOTAL(amount) FROM payments WHERE month IS NOT NULL"
+            " GROUP BY month"
+        )
+        return format_income_trend(dict(totals))
+
+    @timed("sql.calculate_activity_heatmap")
+    def calculate_activity_heatmap(self):
+        counts = self._all(
+            "SELECT day_of_week, hour, COUNT(*) FROM members"
+            " WHERE day_of_week IS NOT NULL AND hour IS NOT NULL"
+            " GROUP BY day_of_week, hour"
+        )
+        return format_activity_heatmap(
+            {(day, hour): count for day, hour, count in counts}
+        )
+
+    @timed("sql.calculate_nz_distribution")
+    def calculate_nz_distribution(
+        self, status=None, signed_up_from=None, signed_up_to=None, now=None
+    ):
+        # The filters of data_processing.filter_members, as a WHERE clause
+        conditions, params = [], []
+        if status is not None:
+            if status == "active":
+                conditions.append("expiry > ?")
+            elif status == "expired":
+                conditions.append("expiry <= ?")
+            else:
+                raise ValueError(f"Unknown membership status: {status}")
+            params.append(_ns(datetime.now() if now is None else now))
+        if signed_up_from is not None:
+            conditions.append("signed_up >= ?")
+            params.append(_ns(signed_up_from))
+        if signed_up_to is not None:
+            conditions.append("signed_up < ?")
+            params.append(_ns(signed_up_to))
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        counts = self._all(
+            f"SELECT region, city, COUNT(*) FROM members{where}"
+            " GROUP BY region, city ORDER BY MIN(rowid)",
+            *params,
+        )
+        return format_nz_distribution(
+            {(region, city): count for region, city, count in counts}
+        )
+
+    @timed("sql.calculate_new_members")
+    def calculate_new_members(self):
+        counts = self._all(
+            "SELECT signup_month, COUNT(*) FROM members"
+            " WHERE signup_month IS NOT NULL GROUP BY signup_month"
+        )
+        return format_new_members(dict(counts))
+
+    def results(self):
+        """Results for every static aggregate, keyed like snapshot.AGGREGATES."""
+        main_regions, other_regions = self.process_regions()
+        return {
+            "region_distribution": {
+                "main_regions": main_regions,
+                "other_regions": other_regions,
+            },
+            "payment_distribution": self.calculate_payment_distribution(),
+            "renewal_funnel": self.calculate_renewal_funnel(),
+            "income_trend": self.calculate_income_trend(),
+            "activity_heatmap": self.calculate_activity_heatmap(),
+            "nz_city_distribution": self.calculate_nz_distribution(),
+            "new_members": self.calculate_new_members(),
+        }
+
+    @timed("sql.timeline")
+    def timeline(self):
+        """A Timeline from counts, at the resolution streaming mode keeps."""
+        (total_members,) = self._one("SELECT COUNT(*) FROM members")
+        (total_payments,) = self._one("SELECT COUNT(*) FROM payments")
+        expiry = self._all(
+            "SELECT expiry, COUNT(*) FROM members WHERE expiry IS NOT NULL"
+            " GROUP BY expiry"
+        )
+        # Times are after 1970, so integer division floors them to the day
+        signups, earlier, later = (
+            self._all(
+                f"SELECT {time} / {NS_PER_DAY} AS day, COUNT(*) FROM members"
+                " WHERE day IS NOT NULL GROUP BY day"
+            )
+            # As timeline.earlier_times and later_times
+            for time in (
+                "signed_up",
+                "MIN(signed_up, expiry)",
+                "MAX(COALESCE(signed_up, expiry), expiry)",
+            )
+        )
+        paid = self._all(
+            f"SELECT paid_at / {NS_PER_DAY} AS day, COUNT(*), TOTAL(amount)"
+            " FROM payments WHERE paid_at IS NOT NULL GROUP BY day"
+        )
+        return Timeline.from_counts(
+            total_members,
+            total_payments,
+            {pd.Timestamp(ns): count for ns, count in expiry},
+            {pd.Timestamp(day * NS_PER_DAY): count for day, count in signups},
+            {pd.Timestamp(day * NS_PER_DAY): count for day, count, _ in paid},
+            {pd.Timestamp(day * NS_PER_DAY): total for day, _, total in paid},
+            {pd.Timestamp(day * NS_PER_DAY): count for day, count in earlier},
+            {pd.Timestamp(day * NS_PER_DAY): count for day, count in later},
+        )
+
+
+class SQLiteLoader:
+    """Loads the exports for a DataStore through an SQLite database.
+
+    Offers the same interface as IncrementalIngestor, but members and
+    payments stay None, as in streaming mode: results and the timeline come
+    from queries, and storage stays open for the snapshot's live ones. The
+    exports are only parsed when their hashes differ from those the
+    database was built from; any change rebuilds it.
+    """
+
+    def __init__(self, data_dir, path, chunk_rows=CHUNK_ROWS):
+        self.data_dir = data_dir
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self.cache_dir = os.path.join(data_dir, ".cache")
+        self.paths = [
+            os.path.join(data_dir, "members.csv"),
+            os.path.join(data_dir, "payments.csv"),
+        ]
+        self.members = None
+        self.payments = None
+        self.renewals = None
+        self.storage = None
+        self._results = {}
+        self._timeline = None
+        self._stats = None
+        self._files = {}
+
+    @property
+    def files(self):
+        return self._files
+
+    def _stat(self):
+        return [
+            (stat.st_mtime_ns, stat.st_size)
+            for stat in (os.stat(path) for path in self.paths)
+        ]
+
+    def changed(self):
+        return self._stat() != self._stats
+
+    def _built_from(self, hashes):
+        if not os.path.exists(self.path):
+            return None
+        storage = SQLiteStorage.open(self.path)
+        try:
+            files = storage.sources()
+        except sqlite3.DatabaseError:
+            files = {}
+        if [files.get(path, {}).get("sha256") for path in self.paths] == hashes:
+            return storage
+        storage.close()
+        return None
+
+    def load(self):
+        stats = self._stat()
+        hashes = [file_hash(path) for path in self.paths]
+        storage = self._built_from(hashes)
+        if storage is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            storage, rows = SQLiteStorage.create(
+                self.path, *self.paths, chunk_rows=self.chunk_rows
+            )
+            storage.record_sources(
+                {
+                    path: {"sha256": digest, "size": size, "rows": count}
+                    for path, digest, (_, size), count in zip(
+                        self.paths, hashes, stats, rows.values()
+                    )
+                }
+            )
+        try:
+            self._files = storage.sources()
+            self._results = storage.results()
+            self._timeline = storage.timeline()
+        except BaseException:
+            storage.close()
+            raise
+        # The previous connection is closed once the last version using it
+        # is dropped; a rebuilt database replaced its file, not its contents
+        self.storage = storage
+        self._stats = stats
+
+    def refresh(self):
+        previous = self._files
+        self.load()
+        return self._files != previous
+
+    def aggregates(self):
+        return self._results
+
+    def timeline(self):
+        return self._timeline
+
+    def logins(self):
+        return None
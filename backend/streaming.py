@@ -0,0 +1,238 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from data_processing import (
+    add_counts,
+    file_hash,
+    preprocess_members,
+    preprocess_payments,
+    region_counts,
+    format_regions,
+    payment_amount_counts,
+    format_payment_distribution,
+    format_renewal_funnel,
+    monthly_income_totals,
+    format_income_trend,
+    activity_counts,
+    format_activity_heatmap,
+    city_counts,
+    format_nz_distribution,
+    signup_month_counts,
+    format_new_members,
+    member_numbers,
+)
+from instrumentation import stage, timed
+from timeline import Timeline, earlier_times, later_times
+
+# Rows parsed at a time; peak memory follows this rather than the export size
+CHUNK_ROWS = 100_000
+
+# Only the columns the aggregates use are read. Dates and amounts are read as
+# strings and parsed per chunk, as in the row-level load.
+MEMBER_DTYPES = {
+    "Member ID": str,
+    "Expiry date": str,
+    "Last Payment Date": str,
+    "Region": "category",
+    "City": "category",
+    "Date Signed up": str,
+    "Last logged in": str,
+}
+PAYMENT_DTYPES = {"Amount": str, "Paid at": str}
+
+
+def read_chunks(path, dtypes, chunk_rows=CHUNK_ROWS):
+    with pd.read_csv(
+        path, usecols=list(dtypes), dtype=dtypes, chunksize=chunk_rows
+    ) as reader:
+        while True:
+            with stage("read_csv") as record:
+                chunk = next(reader, None)
+                record.rows = 0 if chunk is None else len(chunk)
+            if chunk is None:
+                return
+            yield chunk
+
+
+class StreamingAggregates:
+    """Dashboard aggregates folded in one chunk of rows at a time.
+
+    Every field is a count or sum keyed by something with few distinct
+    values (region, city, day, month, amount), so memory does not grow with
+    the number of rows. Expiry dates only carry a day, so the day counts
+    answer active/expired queries exactly, except as of a time before some
+    signup on the same day; signups and payments are kept per day.
+    """
+
+    def __init__(self):
+        self.rows = {"members": 0, "payments": 0}
+        self.total_members = 0
+        self.total_payments = 0
+        self.renewed = 0
+        self.regions = {}
+        self.cities = {}
+        self.activity = {}
+        self.signup_months = {}
+        self.amount_counts = {}
+        self.monthly_income = {}
+        self.expiry_days = {}
+        self.signup_days = {}
+        self.earlier_days = {}
+        self.later_days = {}
+        self.paid_days = {}
+        self.revenue_days = {}
+
+    def add_members(self, members):
+        self.total_members += len(members)
+        self.renewed += int(members["Last Payment Date"].notna().sum())
+        add_counts(self.regions, region_counts(members["Region"]))
+        add_counts(self.cities, city_counts(members))
+        add_counts(self.activity, activity_counts(members))
+        add_counts(self.signup_months, signup_month_counts(members))
+        add_counts(self.expiry_days, members["Expiry date"].value_counts(sort=False))
+        for counts, times in (
+            (self.signup_days, members["Date Signed up"]),
+            (self.earlier_days, earlier_times(members)),
+            (self.later_days, later_times(members)),
+        ):
+            add_counts(counts, times.dt.floor("D").value_counts(sort=False))
+
+    def add_payments(self, payments):
+        self.total_payments += len(payments)
+        add_counts(self.amount_counts, payment_amount_counts(payments))
+        add_counts(self.monthly_income, monthly_income_totals(payments))
+        days = payments["Paid at"].dt.floor("D")
+        add_counts(self.paid_days, days.value_counts(sort=False))
+        add_counts(self.revenue_days, payments["Amount"].groupby(days).sum())
+
+    def results(self):
+        """Results for every static aggregate, keyed like snapshot.AGGREGATES."""
+        main_regions, other_regions = format_regions(self.regions)
+        return {
+            "region_distribution": {
+                "main_regions": main_regions,
+                "other_regions": other_regions,
+            },
+            "payment_distribution": format_payment_distribution(self.amount_counts),
+            "renewal_funnel": format_renewal_funnel(self.renewed, self.total_members),
+            "income_trend": format_income_trend(self.monthly_income),
+            "activity_heatmap": format_activity_heatmap(self.activity),
+            "nz_city_distribution": format_nz_distribution(self.cities),
+            "new_members": format_new_members(self.signup_months),
+        }
+
+    def timeline(self):
+        return Timeline.from_counts(
+            self.total_members,
+            self.total_payments,
+            self.expiry_days,
+            self.signup_days,
+            self.paid_days,
+            self.revenue_days,
+            self.earlier_days,
+            self.later_days,
+        )
+
+
+def latest_rows(path, chunk_rows=CHUNK_ROWS):
+    """Whether each row of a members export is the last one of its member.
+
+    Only the Member ID column is read. Unlike the aggregates, this takes a
+    few bytes per row while it runs.
+    """
+    numbers = [
+        member_numbers(chunk["Member ID"])
+        for chunk in read_chunks(path, {"Member ID": str}, chunk_rows)
+    ]
+    if not numbers:
+        return np.ones(0, dtype=bool)
+    numbers = pd.concat(numbers, ignore_index=True)
+    return ~numbers.duplicated(keep="last").to_numpy()
+
+
+@timed()
+def stream_aggregates(data_dir="./data", chunk_rows=CHUNK_ROWS):
+    """Aggregate members.csv and payments.csv without keeping any rows.
+
+    Members are counted once, by their last row, like latest_members.
+    """
+    aggregates = StreamingAggregates()
+    members_path = os.path.join(data_dir, "members.csv")
+    latest = latest_rows(members_path, chunk_rows)
+    for chunk in read_chunks(members_path, MEMBER_DTYPES, chunk_rows):
+        start = aggregates.rows["members"]
+        aggregates.rows["members"] += len(chunk)
+        keep = latest[start : start + len(chunk)]
+        aggregates.add_members(preprocess_members(chunk[keep]))
+    for chunk in read_chunks(
+        os.path.join(data_dir, "payments.csv"), PAYMENT_DTYPES, chunk_rows
+    ):
+        aggregates.rows["payments"] += len(chunk)
+        aggregates.add_payments(preprocess_payments(chunk))
+    return aggregates
+
+
+class StreamingLoader:
+    """Loads the exports for a DataStore in streaming mode.
+
+    Offers the same interface as IncrementalIngestor, but members and
+    payments stay None: only the aggregates and a count-based timeline are
+    kept. Any change to either file re-streams both.
+    """
+
+    def __init__(self, data_dir, chunk_rows=CHUNK_ROWS):
+        self.data_dir = data_dir
+        self.chunk_rows = chunk_rows
+        self.cache_dir = os.path.join(data_dir, ".cache")
+        self.paths = [
+            os.path.join(data_dir, "members.csv"),
+            os.path.join(data_dir, "payments.csv"),
+        ]
+        self.members = None
+        self.payments = None
+        self.renewals = None
+        self.storage = None
+        self._aggregates = StreamingAggregates()
+        self._stats = None
+        self._files = {}
+
+    @property
+    def files(self):
+        return self._files
+
+    def _stat(self):
+        return [
+            (stat.st_mtime_ns, stat.st_size)
+            for stat in (os.stat(path) for path in self.paths)
+        ]
+
+    def changed(self):
+        return self._stat() != self._stats
+
+    def load(self):
+        stats = self._stat()
+        hashes = [file_hash(path) for path in self.paths]
+        self._aggregates = stream_aggregates(self.data_dir, self.chunk_rows)
+        rows = [self._aggregates.rows["members"], self._aggregates.rows["payments"]]
+        self._files = {
+            path: {"sha256": digest, "size": size, "rows": count}
+            for path, digest, (_, size), count in zip(self.paths, hashes, stats, rows)
+        }
+        self._stats = stats
+
+    def refresh(self):
+        previous = self._files
+        self.load()
+        return self._files != previous
+
+    def aggregates(self):
+        return self._aggregates.results()
+
+    def timeline(self):
+        return self._aggregates.timeline()
+
+    def logins(self):
+        # Logins are only counted per day of the week and hour
+        return None
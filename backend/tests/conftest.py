@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+# The backend's modules import each other by name, as when run from there
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import write_dataset  # noqa: E402
+from data_processing import load_and_preprocess_data  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def data_dir(tmp_path_factory):
+    data_dir = tmp_path_factory.mktemp("data")
+    write_dataset(str(data_dir), 2_000, seed=1)
+    return str(data_dir)
+
+
+@pytest.fixture(scope="session")
+def frames(data_dir):
+    return load_and_preprocess_data(data_dir, use_cache=False)
@@ -0,0 +1,33 @@
+import pandas as pd
+import pytest
+
+from data_store import DataStore
+
+EMPTY = {"cohorts": [], "churn": [], "renewal_lag": []}
+
+
+@pytest.fixture(scope="module")
+def store(data_dir):
+    return DataStore(data_dir)
+
+
+def test_cohort_retention_before_any_signup(store):
+    snapshot = store.current.snapshot
+    as_of = pd.Timestamp("2010-01-01")
+    assert snapshot.result("cohort_retention", as_of=as_of) == EMPTY
+    assert snapshot.result("active_members_history", as_of=as_of) == []
+
+
+@pytest.mark.parametrize("empty", [("payments",), ("members", "payments")])
+def test_reports_on_empty_exports(data_dir, tmp_path, empty):
+    for kind in ("members", "payments"):
+        with open(f"{data_dir}/{kind}.csv") as f:
+            lines = f.readlines()
+        with open(tmp_path / f"{kind}.csv", "w") as f:
+            f.writelines(lines[:1] if kind in empty else lines)
+    snapshot = DataStore(str(tmp_path)).current.snapshot
+    retention = snapshot.result("cohort_retention")
+    assert retention["renewal_lag"] == []
+    if empty == ("members", "payments"):
+        assert retention == EMPTY
+        assert snapshot.result("active_members_history") == []
@@ -0,0 +1,80 @@
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import generate_members, generate_payments
+from data_store import DataStore
+from ingest import AppendOnlyCSV
+
+# End of a day: streaming keeps signups per day, so it is exact from here
+AS_OF = [pd.Timestamp("2022-03-01 23:59:59"), pd.Timestamp("2024-06-30 23:59:59")]
+
+
+def append(path, frame):
+    frame.to_csv(path, mode="a", header=False, index=False, lineterminator="\r\n")
+
+
+def bodies(store):
+    snapshot = store.current.snapshot
+    return {
+        (name, as_of): snapshot.body(name, as_of=as_of).raw
+        for name in snapshot.names()
+        for as_of in AS_OF
+    }
+
+
+@pytest.fixture
+def exports(data_dir, tmp_path):
+    """A copy of data_dir whose members.csv lists some members twice."""
+    for name in ("members.csv", "payments.csv"):
+        shutil.copy(f"{data_dir}/{name}", tmp_path / name)
+    append(tmp_path / "members.csv", generate_members(40, seed=2, first_id=1_280))
+    return tmp_path
+
+
+def test_restart_after_appends_gives_the_same_snapshot(exports):
+    store = DataStore(str(exports))
+    first = store.current.members
+    kept = first.copy()
+    for seed, first_id in ((3, 1_300), (4, 1_250)):
+        # Re-exported members with new details, and members not seen before
+        members = generate_members(60, seed, first_id)
+        members.loc[0, "Region"] = f"Region {seed}"
+        append(exports / "members.csv", members)
+        append(exports / "payments.csv", generate_payments(30, 1_300, seed))
+        assert store.reload_if_changed()
+
+    restarted = DataStore(str(exports))
+    assert first.equals(kept)
+    assert store.current.members["Member ID"].is_unique
+    assert store.current.members.equals(restarted.current.members)
+    for name, array in restarted.current.logins.arrays().items():
+        assert np.array_equal(store.current.logins.arrays()[name], array)
+    assert bodies(store) == bodies(restarted)
+
+
+def test_edits_to_rows_read_are_a_rewrite(tmp_path):
+    path = tmp_path / "members.csv"
+    path.write_bytes(b"Member ID\r\nCITANZ-0001\r\nCITANZ-0002\r\n")
+    csv = AppendOnlyCSV(str(path))
+    csv.read_all()
+    with open(path, "ab") as f:
+        f.write(b"CITANZ-0003\r\n")
+    assert csv.read_appended() == b"CITANZ-0003\r\n"
+
+    path.write_bytes(b"Member ID\r\nCITANZ-0001\r\nCITANZ-0009\r\nCITANZ-0004\r\n")
+    assert csv.read_appended() is None
+
+
+@pytest.mark.parametrize("mode", ["streaming", "sqlite"])
+def test_every_load_path_counts_members_once(exports, tmp_path, mode):
+    options = (
+        {"streaming": True, "chunk_rows": 300}
+        if mode == "streaming"
+        else {"storage": "sqlite", "sqlite_path": str(tmp_path / "cita.sqlite3")}
+    )
+    assert bodies(DataStore(str(exports), **options)) == bodies(
+        DataStore(str(exports))
+    )
@@ -0,0 +1,10 @@
+from benchmarks.synthetic import write_rolled
+from data_store import DataStore
+from snapshot import build_snapshot
+
+
+def test_rolled_exports_match_one_export(data_dir, frames, tmp_path):
+    write_rolled(data_dir, str(tmp_path), months=4)
+    store = DataStore(str(tmp_path), files=str(tmp_path))
+    members, payments = frames
+    assert store.current.snapshot.results == build_snapshot(members, payments).results
@@ -0,0 +1,118 @@
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from benchmarks.run import same_result, sql_benchmarks
+from cube import CubeFilters
+from data_processing import (
+    calculate_key_metrics,
+    calculate_membership_status,
+    calculate_nz_distribution,
+)
+from data_store import DataStore
+from sql_storage import SQLiteStorage
+
+
+@pytest.fixture(scope="module")
+def storage(data_dir, tmp_path_factory):
+    path = tmp_path_factory.mktemp("sqlite") / "cita.sqlite3"
+    storage, _ = SQLiteStorage.create(
+        str(path),
+        f"{data_dir}/members.csv",
+        f"{data_dir}/payments.csv",
+        chunk_rows=300,
+    )
+    yield storage
+    storage.close()
+
+
+@pytest.fixture(scope="module")
+def store(data_dir, tmp_path_factory):
+    path = tmp_path_factory.mktemp("served") / "cita.sqlite3"
+    return DataStore(data_dir, storage="sqlite", sqlite_path=str(path))
+
+
+def test_queries_match_pandas(storage, frames):
+    members, payments = frames
+    pairs = sql_benchmarks(storage, members, payments)
+    differ = [name for name, (a, b) in pairs.items() if not same_result(a(), b())]
+    assert differ == []
+
+
+@pytest.mark.parametrize("status", [None, "active", "expired"])
+def test_nz_distribution_as_of(storage, frames, status):
+    members, _ = frames
+    now = datetime(2023, 6, 1)
+    assert storage.calculate_nz_distribution(
+        status, "2022-01", None, now
+    ) == calculate_nz_distribution(members, status, "2022-01", None, now)
+
+
+def test_live_results_come_from_queries(store, frames):
+    members, _ = frames
+    snapshot = store.current.snapshot
+    now = datetime(2023, 6, 1)
+    total, active, new = calculate_key_metrics(members, now)
+    assert snapshot.result("key_metrics", as_of=now) == {
+        "total_members": total,
+        "active_members": active,
+        "new_members_this_month": new,
+    }
+    assert snapshot.result(
+        "membership_status", as_of=now
+    ) == calculate_membership_status(members, now)
+
+
+def test_nz_distribution_filters(store, frames):
+    members, _ = frames
+    snapshot = store.current.snapshot
+    now = datetime(2023, 6, 1)
+    filters = CubeFilters(
+        status="active",
+        signed_up_from=pd.Timestamp("2022-01-01"),
+        signed_up_to=pd.Timestamp("2023-03-15"),
+    )
+    assert snapshot.filtered("nz_city_distribution", filters, now) == (
+        calculate_nz_distribution(
+            members, "active", "2022-01-01", "2023-03-15", now
+        )
+    )
+
+
+@pytest.mark.parametrize(
+    "name, filters",
+    [
+        ("nz_city_distribution", CubeFilters(region="Auckland")),
+        ("income_trend", CubeFilters(status="active")),
+        (None, CubeFilters(status="active")),
+    ],
+)
+def test_other_filters_are_unavailable(store, name, filters):
+    with pytest.raises(ValueError):
+        store.current.snapshot.filtered(name, filters)
+
+
+@pytest.mark.parametrize("now", [datetime(2019, 1, 1), datetime(2023, 6, 1)])
+def test_counts_as_of_skip_later_signups(storage, frames, now):
+    members, _ = frames
+    assert tuple(storage.calculate_key_metrics(now)) == calculate_key_metrics(
+        members, now
+    )
+    assert storage.calculate_membership_status(
+        now
+    ) == calculate_membership_status(members, now)
+
+
+@pytest.mark.parametrize("now", [datetime(2019, 1, 1), datetime(2023, 6, 1)])
+def test_timeline_counts_as_of_end_of_day(storage, frames, now):
+    # Kept by day, like streaming mode's
+    members, _ = frames
+    end_of_day = now + pd.Timedelta(days=1) - pd.Timedelta(seconds=1)
+    timeline = storage.timeline()
+    total, active, _ = calculate_key_metrics(members, end_of_day)
+    assert timeline.members_as_of(end_of_day) == total
+    assert timeline.active_as_of(end_of_day) == active
+    assert calculate_membership_status(
+        None, end_of_day, timeline
+    ) == calculate_membership_status(members, end_of_day)
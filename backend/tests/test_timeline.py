@@ -0,0 +1,131 @@
+import pandas as pd
+import pytest
+
+from data_processing import calculate_key_metrics, calculate_membership_status
+from streaming import StreamingAggregates
+from timeline import Timeline
+
+AS_OF = [
+    pd.Timestamp("2018-01-01"),
+    pd.Timestamp("2021-03-15 12:30"),
+    pd.Timestamp("2023-06-01"),
+    pd.Timestamp("2024-06-30"),
+    pd.Timestamp("2030-01-01"),
+]
+
+
+def _members(rows):
+    return pd.DataFrame(
+        {
+            "Date Signed up": pd.to_datetime([signed_up for signed_up, _ in rows]),
+            "Expiry date": pd.to_datetime([expiry for _, expiry in rows]),
+        }
+    )
+
+
+# Signed up before, on and after the as-of times, without a signup or expiry
+# date, and with an expiry before signup
+EDGE_MEMBERS = _members(
+    [
+        ("2020-01-01", "2021-01-01"),
+        ("2020-06-01", "2024-06-30"),
+        ("2023-06-01", "2024-06-01"),
+        ("2024-07-01", "2025-07-01"),
+        (None, "2023-01-01"),
+        (None, "2025-01-01"),
+        ("2022-02-02", None),
+        ("2023-05-01", "2022-05-01"),
+        ("2024-08-01", "2024-07-01"),
+    ]
+)
+NO_PAYMENTS = pd.DataFrame(
+    {"Paid at": pd.to_datetime([]), "Amount": pd.Series([], dtype=float)}
+)
+
+
+def _brute_force_counts(members, t):
+    signed_up, expiry = members["Date Signed up"], members["Expiry date"]
+    joined = signed_up.isna() | (signed_up <= t)
+    active = int((joined & (expiry > t)).sum())
+    expired = int((joined & (expiry <= t)).sum())
+    return int(joined.sum()), active, expired
+
+
+@pytest.mark.parametrize("t", AS_OF)
+def test_counts_as_of_only_include_signed_up_members(t):
+    timeline = Timeline(EDGE_MEMBERS, NO_PAYMENTS)
+    total, active, expired = _brute_force_counts(EDGE_MEMBERS, t)
+    assert timeline.members_as_of(t) == total
+    assert timeline.active_as_of(t) == active
+    assert timeline.expired_as_of(t) == expired
+
+
+@pytest.mark.parametrize("t", AS_OF)
+def test_updated_timeline_counts_as_of(t):
+    first, later = EDGE_MEMBERS.iloc[:4], EDGE_MEMBERS.iloc[4:]
+    superseded = first.iloc[1:2]
+    timeline = Timeline(first, NO_PAYMENTS).updated(later, superseded)
+    members = pd.concat([first.drop(index=superseded.index), later])
+    total, active, expired = _brute_force_counts(members, t)
+    assert timeline.members_as_of(t) == total
+    assert timeline.active_as_of(t) == active
+    assert timeline.expired_as_of(t) == expired
+
+
+@pytest.mark.parametrize("t", AS_OF)
+def test_key_metrics_as_of_skip_later_signups(frames, t):
+    members, payments = frames
+    timeline = Timeline(members, payments)
+    total, active, _ = _brute_force_counts(members, t)
+    assert timeline.members_as_of(t) == total
+    assert calculate_key_metrics(members, t, timeline) == calculate_key_metrics(
+        members, t
+    )
+    assert calculate_key_metrics(members, t)[:2] == (total, active)
+    assert calculate_membership_status(
+        members, t, timeline
+    ) == calculate_membership_status(members, t)
+
+
+@pytest.mark.parametrize("t", AS_OF)
+def test_streaming_counts_as_of_end_of_day(frames, t):
+    # Streaming mode keeps signups by day, which is exact once the day's
+    # signups are all past
+    t = t.normalize() + pd.Timedelta(days=1) - pd.Timedelta(seconds=1)
+    members, payments = frames
+    aggregates = StreamingAggregates()
+    aggregates.add_members(members)
+    aggregates.add_payments(payments)
+    timeline = aggregates.timeline()
+    total, active, expired = _brute_force_counts(members, t)
+    assert timeline.members_as_of(t) == total
+    assert timeline.active_as_of(t) == active
+    assert timeline.expired_as_of(t) == expired
+
+
+@pytest.mark.parametrize("t", AS_OF)
+@pytest.mark.parametrize("days", [0, 30, 365])
+def test_expiring_within(frames, t, days):
+    members, payments = frames
+    expiry = members["Expiry date"]
+    end = t + pd.Timedelta(days=days)
+    expected = int(((expiry > t) & (expiry <= end)).sum())
+    assert Timeline(members, payments).expiring_within(t, days) == expected
+
+
+@pytest.mark.parametrize(
+    "start, end",
+    [
+        ("2018-01-01", "2030-01-01"),
+        ("2022-03-01", "2022-04-01"),
+        ("2023-06-15 08:00", "2023-06-15 20:00"),
+        ("2024-01-01", "2023-01-01"),
+    ],
+)
+def test_revenue_between(frames, start, end):
+    members, payments = frames
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    paid = payments["Paid at"]
+    expected = payments["Amount"][(paid >= start) & (paid < end)].sum()
+    timeline = Timeline(members, payments)
+    assert timeline.revenue_between(start, end) == pytest.approx(expected)
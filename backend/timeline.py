@@ -0,0 +1,357 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+
+def month_start(now):
+    return pd.Timestamp(now).to_period("M").to_timestamp()
+
+
+def next_month_start(now):
+    return (pd.Timestamp(now).to_period("M") + 1).to_timestamp()
+
+
+def earliest(*times):
+    times = [t for t in times if t is not None]
+    return min(times) if times else None
+
+
+def _datetime64(t):
+    return np.datetime64(pd.Timestamp(t), "ns")
+
+
+def removed_at(values, removed):
+    """Positions in sorted values of one of each of removed's times, sorted.
+
+    Equal times are taken from consecutive positions. Returns the positions
+    and the times.
+    """
+    gone = removed.to_numpy(dtype="datetime64[ns]")
+    gone = np.sort(gone[~np.isnat(gone)])
+    repeat = np.arange(len(gone)) - np.searchsorted(gone, gone, "left")
+    return np.searchsorted(values, gone, "left") + repeat, gone
+
+
+def added_at(values, added):
+    """Where added's times go in sorted values, after equal ones.
+
+    Returns the positions for np.insert, the sorted times and which rows of
+    added they came from.
+    """
+    new = added.to_numpy(dtype="datetime64[ns]")
+    rows = np.flatnonzero(~np.isnat(new))
+    rows = rows[np.argsort(new[rows], kind="stable")]
+    new = new[rows]
+    return np.searchsorted(values, new, "right"), new, rows
+
+
+class SortedTimes:
+    """Sorted, NaT-free copy of a datetime column for binary-search queries.
+
+    With weights, prefix sums are kept alongside so the total weight of any
+    time range is two lookups and a subtraction.
+    """
+
+    def __init__(self, values, weights=None):
+        times = values.to_numpy(dtype="datetime64[ns]")
+        present = ~np.isnat(times)
+        order = np.argsort(times[present], kind="stable")
+        self.values = times[present][order]
+        self.cumulative = None
+        if weights is not None:
+            weights = np.nan_to_num(np.asarray(weights, dtype=float)[present][order])
+            self.cumulative = np.concatenate([[0.0], np.cumsum(weights)])
+
+    @classmethod
+    def from_arrays(cls, values, cumulative=None):
+        """Wrap arrays produced by arrays(), e.g. memory-mapped ones, as-is."""
+        times = cls.__new__(cls)
+        times.values = values
+        times.cumulative = cumulative
+        return times
+
+    def arrays(self):
+        arrays = {"values": self.values}
+        if self.cumulative is not None:
+            arrays["cumulative"] = self.cumulative
+        return arrays
+
+    def __len__(self):
+        return len(self.values)
+
+    def merged(self, added=None, removed=None, added_weights=None):
+        """A copy with the times of added put in and one of each removed taken out.
+
+        Both are placed by binary search, so the cost is a copy of the arrays
+        rather than another sort. Removed times must be present.
+        """
+        values = self.values
+        weights = None if self.cumulative is None else np.diff(self.cumulative)
+        if removed is not None:
+            positions, _ = removed_at(values, removed)
+            values = np.delete(values, positions)
+            if weights is not None:
+                weights = np.delete(weights, positions)
+        if added is not None:
+            positions, new, rows = added_at(values, added)
+            values = np.insert(values, positions, new)
+            if weights is not None:
+                new_weights = np.asarray(added_weights, dtype=float)[rows]
+                weights = np.insert(weights, positions, np.nan_to_num(new_weights))
+        cumulative = None
+        if weights is not None:
+            cumulative = np.concatenate([[0.0], np.cumsum(weights)])
+        return SortedTimes.from_arrays(values, cumulative)
+
+    def _left(self, t):
+        return int(np.searchsorted(self.values, _datetime64(t), "left"))
+
+    def _right(self, t):
+        return int(np.searchsorted(self.values, _datetime64(t), "right"))
+
+    def count_after(self, t):
+        return len(self.values) - self._right(t)
+
+    def count_between(self, start, end):
+        # Half-open [start, end)
+        return max(self._left(end) - self._left(start), 0)
+
+    def sum_between(self, start, end):
+        lo, hi = self._left(start), self._left(end)
+        return float(self.cumulative[hi] - self.cumulative[lo]) if hi > lo else 0.0
+
+    def next_after(self, t):
+        position = self._right(t)
+        if position == len(self.values):
+            return None
+        return pd.Timestamp(self.values[position])
+
+
+class CountedTimes(SortedTimes):
+    """Distinct times with how often each occurred, for the same queries.
+
+    Memory is O(distinct times) rather than O(rows); weights map each time
+    to its total weight.
+    """
+
+    def __init__(self, counts, weights=None):
+        times = pd.DatetimeIndex(list(counts)).to_numpy(dtype="datetime64[ns]")
+        order = np.argsort(times, kind="stable")
+        self.values = times[order]
+        occurrences = np.fromiter(counts.values(), dtype=np.int64, count=len(counts))
+        self.counts = np.concatenate([[0], np.cumsum(occurrences[order])])
+        self.cumulative = None
+        if weights is not None:
+            totals = np.array([weights.get(t, 0.0) for t in counts], dtype=float)
+            self.cumulative = np.concatenate([[0.0], np.cumsum(totals[order])])
+
+    @classmethod
+    def from_arrays(cls, values, counts, cumulative=None):
+        times = super().from_arrays(values, cumulative)
+        times.counts = counts
+        return times
+
+    def arrays(self):
+        return {**super().arrays(), "counts": self.counts}
+
+    def __len__(self):
+        return int(self.counts[-1])
+
+    def count_after(self, t):
+        return len(self) - int(self.counts[self._right(t)])
+
+    def count_between(self, start, end):
+        counted = self.counts[self._left(end)] - self.counts[self._left(start)]
+        return max(int(counted), 0)
+
+
+def earlier_times(members):
+    """The earlier of each member's signup and expiry, NaT unless both are set.
+
+    A member is active at t from signup until expiry, so one that is neither
+    active nor signed up yet at t has both times, and so this one, after t.
+    """
+    signup, expiry = members["Date Signed up"], members["Expiry date"]
+    return signup.where(signup < expiry, expiry).where(signup.notna())
+
+
+def later_times(members):
+    """The later of each member's signup and expiry, or just the expiry.
+
+    A member has expired by t once both are at or before t; members without
+    a signup date count as signed up all along.
+    """
+    signup, expiry = members["Date Signed up"], members["Expiry date"]
+    return expiry.where(~(signup > expiry), signup)
+
+
+class Timeline:
+    """Sorted expiry, signup and payment times for one data version.
+
+    Built once at load; every query is a binary search, so the answers cost
+    the same for any as-of date. Membership state is taken from each
+    member's current expiry date, counting only members signed up by then.
+    """
+
+    def __init__(self, members, payments):
+        self.total_members = len(members)
+        self.total_payments = len(payments)
+        self.expiry = SortedTimes(members["Expiry date"])
+        self.signup = SortedTimes(members["Date Signed up"])
+        self.earlier = SortedTimes(earlier_times(members))
+        self.later = SortedTimes(later_times(members))
+        self.paid = SortedTimes(payments["Paid at"], payments["Amount"])
+
+    @classmethod
+    def from_counts(
+        cls,
+        total_members,
+        total_payments,
+        expiry,
+        signup,
+        paid,
+        revenue,
+        earlier,
+        later,
+    ):
+        """Build from {time: count} maps instead of row-level frames.
+
+        Queries are exact at the resolution of the keys, e.g. signup counts
+        keyed by day start answer signed_up_in_month() exactly.
+        """
+        return cls.from_parts(
+            total_members,
+            total_payments,
+            expiry=CountedTimes(expiry),
+            signup=CountedTimes(signup),
+            paid=CountedTimes(paid, revenue),
+            earlier=CountedTimes(earlier),
+            later=CountedTimes(later),
+        )
+
+    @classmethod
+    def from_parts(
+        cls, total_members, total_payments, expiry, signup, paid, earlier, later
+    ):
+        timeline = cls.__new__(cls)
+        timeline.total_members = total_members
+        timeline.total_payments = total_payments
+        timeline.expiry = expiry
+        timeline.signup = signup
+        timeline.paid = paid
+        timeline.earlier = earlier
+        timeline.later = later
+        return timeline
+
+    def parts(self):
+        return {
+            "expiry": self.expiry,
+            "signup": self.signup,
+            "paid": self.paid,
+            "earlier": self.earlier,
+            "later": self.later,
+        }
+
+    def updated(self, members=None, superseded=None, payments=None):
+        """The timeline with members added, superseded member rows taken out
+        and payments appended; this one is left as it was."""
+        added = 0 if members is None else len(members)
+        removed = 0 if superseded is None else len(superseded)
+        def merged(times, column):
+            return times.merged(
+                None if members is None else column(members),
+                None if superseded is None else column(superseded),
+            )
+
+        return Timeline.from_parts(
+            self.total_members + added - removed,
+            self.total_payments + (0 if payments is None else len(payments)),
+            expiry=merged(self.expiry, lambda frame: frame["Expiry date"]),
+            signup=merged(self.signup, lambda frame: frame["Date Signed up"]),
+            paid=self.paid.merged(
+                None if payments is None else payments["Paid at"],
+                added_weights=None if payments is None else payments["Amount"],
+            ),
+            earlier=merged(self.earlier, earlier_times),
+            later=merged(self.later, later_times),
+        )
+
+    def members_as_of(self, t):
+        return self.total_members - self.signup.count_after(t)
+
+    def active_as_of(self, t):
+        return self.expiry.count_after(t) - self.earlier.count_after(t)
+
+    def expired_as_of(self, t):
+        return len(self.later) - self.later.count_after(t)
+
+    def next_expiry_after(self, t):
+        return self.expiry.next_after(t)
+
+    def next_change_after(self, t):
+        # Memberships start at signups as well as lapse at expiries
+        return earliest(self.expiry.next_after(t), self.signup.next_after(t))
+
+    def expiring_within(self, t, days):
+        """Memberships expiring after t and at most `days` days after it."""
+        end = pd.Timestamp(t) + pd.Timedelta(days=days)
+        return self.expiry.count_after(t) - self.expiry.count_after(end)
+
+    def signed_up_between(self, start, end):
+        return self.signup.count_between(start, end)
+
+    def signed_up_in_month(self, t):
+        return self.signed_up_between(month_start(t), next_month_start(t))
+
+    def revenue_between(self, start, end):
+        return self.paid.sum_between(start, end)
+
+
+class TimeAwareCache:
+    """Cache of values that stay correct until a known point in time.
+
+    compute(now) returns (value, valid_until); the value is reused for any
+    later now before valid_until, and forever when valid_until is None.
+    """
+
+    def __init__(self):
+        self._entries = {}
+
+    def get(self, key, compute, now):
+        entry = self._entries.get(key)
+        if (
+            entry is None
+            or now < entry[0]
+            or (entry[2] is not None and now >= entry[2])
+        ):
+            value, valid_until = compute(now)
+            entry = self._entries[key] = (now, value, valid_until)
+        return entry[1], entry[2]
+
+
+class AsOfCache:
+    """The last few values computed for arbitrary times, e.g. as_of requests.
+
+    Like TimeAwareCache, an entry computed for now serves any later time
+    before its valid_until; unlike it, several are kept, least recently
+    used first out, so requests for a handful of as_of dates don't evict
+    each other or the live entries.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._entries = []
+        self._lock = threading.Lock()
+
+    def get(self, compute, now):
+        with self._lock:
+            for position, (start, value, valid_until) in enumerate(self._entries):
+                if start <= now and (valid_until is None or now < valid_until):
+                    self._entries.append(self._entries.pop(position))
+                    return value, valid_until
+        value, valid_until = compute(now)
+        with self._lock:
+            self._entries.append((now, value, valid_until))
+            del self._entries[: -self.size]
+        return value, valid_until
@@ -6,8 +6,8 @@ const MemberActivityChart = ({ data }) => {
         const days = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"];
         const hours = Array.from({ length: 24 }, (_, i) => `${i}:00`);
 
-        const formattedData = data.map((item) => [item.Hour, item.DayOfWeek, item.Count]);
-        const maxCount = Math.max(...data.map((item) => item.Count));
+        const formattedData = data.counts.flatMap((row, day) => row.map((count, hour) => [hour, day, count]));
+        const maxCount = Math.max(...formattedData.map((item) => item[2]));
 
         return {
             tooltip: {
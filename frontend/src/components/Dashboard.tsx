@@ -56,44 +56,24 @@ const Dashboard: React.FC = () => {
     const [renewalStatus, setRenewalStatus] = useState<RenewalStatus | null>(null);
     const [incomeTrend, setIncomeTrend] = useState<IncomeData[] | null>(null);
     const [cityDistribution, setCityDistribution] = useState<CityDistribution[] | null>(null);
-    const [activityHeatmap, setActivityHeatmap] = useState<ActivityData[] | null>(null);
+    const [activityHeatmap, setActivityHeatmap] = useState<ActivityData | null>(null);
     const [newMembers, setNewMembers] = useState<NewMembersData[] | null>(null);
     const [error, setError] = useState<string | null>(null);
 
     useEffect(() => {
         const fetchData = async () => {
             try {
-                const [
-                    keyMetricsData,
-                    regionDistributionData,
-                    membershipStatusData,
-                    membershipTypeData,
-                    renewalStatusData,
-                    incomeTrendData,
-                    activityHeatmapData,
-                    nzCityDistributionData,
-                    newMembersData,
-                ] = await Promise.all([
-                    fetchFromAPI<any>("/api/key_metrics"),
-                    fetchFromAPI<any>("/api/region_distribution"),
-                    fetchFromAPI<MembershipStatus>("/api/membership_status"),
-                    fetchFromAPI<MembershipType>("/api/payment_distribution"),
-                    fetchFromAPI<RenewalStatus>("/api/renewal_funnel"),
-                    fetchFromAPI<IncomeData[]>("/api/income_trend"),
-                    fetchFromAPI<ActivityData[]>("/api/activity_heatmap"),
-                    fetchFromAPI<CityDistribution[]>("/api/nz_city_distribution"),
-                    fetchFromAPI<NewMembersData[]>("/api/new_members"),
-                ]);
+                const dashboardData = await fetchFromAPI<any>("/api/dashboard");
 
-                setKeyMetrics(convertKeyMetrics(keyMetricsData));
-                setRegionData(convertRegionDistribution(regionDistributionData));
-                setMembershipStatus(membershipStatusData);
-                setMembershipType(membershipTypeData);
-                setRenewalStatus(renewalStatusData);
-                setIncomeTrend(incomeTrendData);
-                setActivityHeatmap(activityHeatmapData);
-                setCityDistribution(nzCityDistributionData);
-                setNewMembers(newMembersData);
+                setKeyMetrics(convertKeyMetrics(dashboardData.key_metrics));
+                setRegionData(convertRegionDistribution(dashboardData.region_distribution));
+                setMembershipStatus(dashboardData.membership_status as MembershipStatus);
+                setMembershipType(dashboardData.payment_distribution as MembershipType);
+                setRenewalStatus(dashboardData.renewal_funnel as RenewalStatus);
+                setIncomeTrend(dashboardData.income_trend as IncomeData[]);
+                setActivityHeatmap(dashboardData.activity_heatmap as ActivityData);
+                setCityDistribution(dashboardData.nz_city_distribution as CityDistribution[]);
+                setNewMembers(dashboardData.new_members as NewMembersData[]);
             } catch (error) {
                 console.error("Failed to fetch data:", error);
                 setError("An error occurred while fetching data. Please try again later.");
@@ -10,6 +10,7 @@ export interface NameValuePair<T> {
 export interface CityData {
     name: string;
     value: Count;
+    location: Place | null;
 }
 
 export interface RegionData {
@@ -27,6 +28,10 @@ interface GeoLocation {
     longitude: number;
 }
 
+interface Place extends GeoLocation {
+    name: string;
+}
+
 export interface KeyMetrics {
     totalMembers: Count;
     activeMembers: Count;
@@ -64,10 +69,9 @@ export interface CityDistribution extends NameValuePair<Count>, GeoLocation {
     count: Count;
 }
 
+// Logins by day of week (rows, Monday first) and hour of day (columns)
 export interface ActivityData {
-    dayOfWeek: number;
-    hour: number;
-    count: Count;
+    counts: Count[][];
 }
 
 export interface NewMembersData extends NameValuePair<Count> {
@@ -2,11 +2,17 @@ import pandas as pd
 import streamlit as st
 import plotly.express as px
 import plotly.graph_objects as go
-import seaborn as sns
 import numpy as np
-from pypinyin import lazy_pinyin
-import re
-from datetime import datetime
+import json
+import os
+import sys
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+sys.path.insert(0, BACKEND_DIR)
+# 与 Flask 后端读取同一份数据（可用 CITA_DATA_DIR 覆盖）
+os.environ.setdefault("CITA_DATA_DIR", os.path.join(BACKEND_DIR, "data"))
+from config import DATA_RELOAD_INTERVAL
+from shared_data import open_store
 
 # 设置页面配置
 chinese_font = "SimHei"
@@ -75,82 +81,6 @@ def apply_common_style(fig, title):
     return fig
 
 
-nz_regions_cities = {
-    "Northland": (-35.7317, 174.3242),
-    "Auckland": (-36.8485, 174.7633),
-    "Waikato": (-37.7870, 175.2793),
-    "Bay of Plenty": (-37.6878, 176.1651),
-    "Gisborne": (-38.6623, 178.0176),
-    "Hawke's Bay": (-39.4928, 176.9120),
-    "Taranaki": (-39.0556, 174.0752),
-    "Manawatu-Whanganui": (-40.3523, 175.6082),
-    "Wellington": (-41.2865, 174.7762),
-    "Tasman": (-41.2706, 173.2840),
-    "Nelson": (-41.2706, 173.2840),
-    "Marlborough": (-41.5134, 173.9611),
-    "West Coast": (-42.4504, 171.2108),
-    "Canterbury": (-43.5321, 172.6362),
-    "Otago": (-45.8788, 170.5028),
-    "Southland": (-46.4132, 168.3538),
-    # 主要城市
-    "Hamilton": (-37.7870, 175.2793),
-    "Tauranga": (-37.6878, 176.1651),
-    "Napier-Hastings": (-39.4928, 176.9120),
-    "Palmerston North": (-40.3523, 175.6082),
-    "Christchurch": (-43.5321, 172.6362),
-    "Dunedin": (-45.8788, 170.5028),
-    "Invercargill": (-46.4132, 168.3538),
-    "Queenstown": (-45.0312, 168.6626),
-}
-
-
-def to_pinyin(text):
-    if pd.isna(text):
-        return ""
-    return "".join(lazy_pinyin(str(text)))
-
-
-def normalize_name(name):
-    return re.sub(r"[^a-z0-9]", "", str(name).lower())
-
-
-def deduplicate_regions(df, region_column):
-    # 创建一个新的DataFrame来存储处理后的数据
-    processed_df = df.copy()
-
-    # 确保region_column中的所有值都是字符串
-    processed_df[region_column] = processed_df[region_column].astype(str)
-
-    # 添加拼音列和规范化名称列
-    processed_df["pinyin"] = processed_df[region_column].apply(to_pinyin)
-    processed_df["normalized_name"] = processed_df["pinyin"].apply(normalize_name)
-
-    # 根据规范化名称分组并合并
-    grouped = (
-        processed_df.groupby("normalized_name")
-        .agg(
-            {
-                region_column: "first",  # 保留第一个出现的原始名称
-                "Member ID": "count",  # 计算每个地区的成员数量
-            }
-        )
-        .reset_index()
-    )
-
-    # 按计数降序排序
-    grouped = grouped.sort_values("Member ID", ascending=False)
-
-    # 重命名列
-    grouped = grouped.rename(columns={"Member ID": "Count"})
-
-    # 合并回原始DataFrame
-    result = pd.merge(
-        df, grouped[[region_column, "Count"]], on=region_column, how="left"
-    )
-
-    return result
-
-
 # 加载新西兰的 geojson 文件
 @st.cache_data
 def load_geojson():
@@ -159,50 +89,12 @@ def load_geojson():
     return nz_geojson
 
 
-# 加载和处理数据
-@st.cache_data
-def load_and_preprocess_data():
-    members = pd.read_csv("./backend/data/members.csv")
-    members = members[
-        members["Member ID"].notna()
-        & members["Member ID"].str.startswith("CITANZ-", na=False)
-    ]
-
-    payments = pd.read_csv("./backend/data/payments.csv")
-
-    # 处理日期格式
-    members["Expiry date"] = pd.to_datetime(
-        members["Expiry date"], format="%d/%m/%Y", errors="coerce"
-    )
-    members["Last Payment Date"] = pd.to_datetime(
-        members["Last Payment Date"], format="%d/%m/%Y %H:%M", errors="coerce"
-    )
-    members["Date Signed up"] = pd.to_datetime(
-        members["Date Signed up"], format="%b %d, %Y, %I:%M %p", errors="coerce"
-    )
-    members["Last logged in"] = pd.to_datetime(
-        members["Last logged in"], format="%b %d, %Y, %I:%M %p", errors="coerce"
-    )
-
-    payments["Paid at"] = pd.to_datetime(
-        payments["Paid at"], format="%b %d, %Y, %I:%M %p", errors="coerce"
-    )
-    payments["Amount"] = (
-        payments["Amount"].replace(r"[$,]", "", regex=True).astype(float)
-    )
-
-    return members, payments
-
-
-# 计算关键指标
-def calculate_key_metrics(members):
-    total_members = len(members)  # 会员总数量
-    active_members = members[members["Expiry date"] > datetime.now()]  # 活跃会员数量
-    current_month = datetime.now().strftime("%Y-%m")  # 获取当前月份
-    new_members_this_month = len(
-        members[members["Date Signed up"].dt.to_period("M") == current_month]
-    )  # 当月新增会员数量
-    return total_members, len(active_members), new_members_this_month
+# 数据与聚合结果由后端统一维护：每个数据版本只计算一次，导出文件变化时自动重新加载
+@st.cache_resource
+def load_store():
+    store = open_store()
+    store.start_watcher(DATA_RELOAD_INTERVAL)
+    return store
 
 
 # 卡片样式
@@ -219,17 +111,10 @@ def display_metric_card(label, value):
 
 
 # 会员状态饼图
-def plot_membership_status(members):
-    expiry_status = (
-        members["Expiry date"]
-        .dropna()
-        .apply(lambda x: "Active" if x > datetime.now() else "Expired")
-        .value_counts()
-    )
-
+def plot_membership_status(expiry_status):
     fig = px.pie(
-        values=expiry_status.values,
-        names=expiry_status.index,
+        values=list(expiry_status.values()),
+        names=list(expiry_status),
         title="Membership Status",
         hole=0.4,
         color_discrete_sequence=[COLOR_SCHEME["primary"], COLOR_SCHEME["secondary"]],
@@ -239,9 +124,8 @@ def plot_membership_status(members):
 
 
 # 收入趋势图
-def plot_income_trend(payments):
-    payments["Month"] = payments["Paid at"].dt.to_period("M").astype(str)
-    monthly_income = payments.groupby("Month")["Amount"].sum().reset_index()
+def plot_income_trend(income_trend):
+    monthly_income = pd.DataFrame(income_trend, columns=["Month", "Amount"])
     fig = px.line(
         monthly_income,
         x="Month",
@@ -257,49 +141,18 @@ def plot_income_trend(payments):
     return apply_common_style(fig, "Monthly Charge Trend")
 
 
-def process_and_visualize_regions(df, region_column):
-    # 过滤数据
-    df = df[
-        df["Member ID"].notna() & df["Member ID"].str.startswith("CITANZ-", na=False)
-    ]
-
-    # 创建一个新的DataFrame来存储处理后的数据
-    processed_df = df.copy()
-
-    # 确保region_column中的所有值都是字符串
-    processed_df[region_column] = (
-        processed_df[region_column].fillna("Unknown").astype(str)
+def plot_regions(region_distribution):
+    columns = ["Region", "Number of Members"]
+    main_region_data = pd.DataFrame(region_distribution["main_regions"], columns=columns)
+    other_region_data = pd.DataFrame(
+        region_distribution["other_regions"], columns=columns
     )
 
-    # 添加拼音列和规范化名称列
-    processed_df["pinyin"] = processed_df[region_column].apply(to_pinyin)
-    processed_df["normalized_name"] = processed_df["pinyin"].apply(normalize_name)
-
-    # 根据规范化名称分组并合并
-    grouped = (
-        processed_df.groupby("normalized_name")
-        .agg(
-            {
-                region_column: "first",  # 保留第一个出现的原始名称
-                "Member ID": "count",  # 计算每个地区的成员数量
-            }
-        )
-        .reset_index()
-    )
-
-    # 按计数降序排序
-    grouped = grouped.sort_values("Member ID", ascending=False)
-
-    # 分离主要地区和其他地区
-    main_regions = ["Auckland", "Wellington", "Canterbury"]
-    main_region_data = grouped[grouped[region_column].isin(main_regions)]
-    other_region_data = grouped[~grouped[region_column].isin(main_regions)]
-
     # Create pie chart for main regions
     fig1 = px.pie(
         main_region_data,
-        values="Member ID",
-        names=region_column,
+        values="Number of Members",
+        names="Region",
         title="Main Regions Distribution",
         color_discrete_sequence=[
             COLOR_SCHEME["primary"],
@@ -313,8 +166,8 @@ def process_and_visualize_regions(df, region_column):
     # Create bar chart for other regions
     fig2 = px.bar(
         other_region_data,
-        x=region_column,
-        y="Member ID",
+        x="Region",
+        y="Number of Members",
         title="Other Regions Distribution",
         color_discrete_sequence=[COLOR_SCHEME["primary"]],
     )
@@ -324,35 +177,19 @@ def process_and_visualize_regions(df, region_column):
 
 
 # 使用 Plotly 绘制会员活跃度热力图
-def plot_member_activity_heatmap(members):
-    members["Last logged in date"] = pd.to_datetime(
-        members["Last logged in"], format="%b %d, %Y, %I:%M %p", errors="coerce"
-    )
-    members["DayOfWeek"] = members["Last logged in date"].dt.dayofweek
-    members["Hour"] = members["Last logged in date"].dt.hour
-    members["Date"] = members["Last logged in date"].dt.date
-
-    # Create a complete index for all day and hour combinations
+def plot_member_activity_heatmap(activity_counts):
     all_days = range(7)
     all_hours = list(range(24))
-    index = pd.MultiIndex.from_product(
-        [all_days, all_hours], names=["DayOfWeek", "Hour"]
-    )
-
-    # Count the occurrences and reindex to include all combinations
-    activity_counts = (
-        members.groupby(["DayOfWeek", "Hour"]).size().reindex(index, fill_value=0)
-    )
 
-    # Reshape to create the heatmap data
-    activity_heatmap = activity_counts.unstack(level="Hour")
+    # Already dense: a row per day of the week and a column per hour
+    activity_heatmap = np.array(activity_counts["counts"], dtype=np.int64)
 
     # Create hover text
     hover_text = [
         [
             f"Day: {['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'][day]}<br>"
             f"Hour: {hour:02d}:00<br>"
-            f"Count: {activity_heatmap.iloc[day, hour]}"
+            f"Count: {activity_heatmap[day, hour]}"
             for hour in all_hours
         ]
         for day in all_days
@@ -392,13 +229,11 @@ def plot_member_activity_heatmap(members):
 
 
 # 会员续费情况环形图
-def plot_renewal_funnel(members):
-    renewal_status = members["Last Payment Date"].notna().value_counts()
-
+def plot_renewal_funnel(renewal_status):
     # 创建环形图
     fig = px.pie(
-        values=renewal_status.values,
-        names=["Renewed", "Not Renewed"],
+        values=list(renewal_status.values()),
+        names=list(renewal_status),
         title="Membership Status(Renewed vs Not Renewed)",
         hole=0.4,  # 设置 hole 参数以创建环形图
     )
@@ -411,11 +246,14 @@ def plot_renewal_funnel(members):
 
 
 # 每月新会员注册柱状图
-def plot_new_members(members):
-    members["Sign Up Month"] = members["Date Signed up"].dt.to_period("M").astype(str)
-    new_members = members.groupby("Sign Up Month")["Member ID"].count().reset_index()
+def plot_new_members(month_counts):
+    new_members = pd.DataFrame(month_counts, columns=["Month", "Count"])
     fig = px.bar(
-        new_members, x="Sign Up Month", y="Member ID", title="New Members per Month"
+        new_members,
+        x="Month",
+        y="Count",
+        title="New Members per Month",
+        labels={"Month": "Sign Up Month", "Count": "New Members"},
     )
     fig.update_xaxes(
         dtick="M1", tickformat="%b %Y", tickangle=-45, ticklabelmode="period"
@@ -424,9 +262,8 @@ def plot_new_members(members):
 
 
 # 会员缴费金额分布饼图
-def plot_payment_amount_distribution(payments):
-    amount_dist = payments["Amount"].value_counts().reset_index()
-    amount_dist.columns = ["Amount", "Count"]
+def plot_payment_amount_distribution(amount_counts):
+    amount_dist = pd.DataFrame(amount_counts, columns=["Amount", "Count"])
 
     fig = px.pie(values=amount_dist["Count"], names=amount_dist["Amount"])
     fig.update_traces(textposition="inside", textinfo="percent+label")
@@ -434,30 +271,20 @@ def plot_payment_amount_distribution(payments):
 
 
 # 新西兰城市分布气泡地图
-def plot_nz_city_map(members):
-    members["City"] = members["City"].fillna("Unknown")
-
-    # 创建一个地区和城市名称映射字典
-    location_mapping = {
-        name: [
-            name.lower(),
-            name.replace(" ", "").lower(),
-            name.replace("-", " ").lower(),
-        ]
-        for name in nz_regions_cities.keys()
-    }
-
-    def match_location(location):
-        location_lower = location.lower().replace(" ", "")
-        for name, aliases in location_mapping.items():
-            if any(alias in location_lower for alias in aliases):
-                return name
-        return "Unknown"
-
-    members["Matched_City"] = members["City"].apply(match_location)
-    city_counts = members[members["Matched_City"] != "Unknown"][
-        "Matched_City"
-    ].value_counts()
+def plot_nz_city_map(nz_distribution):
+    # 后端已为每个城市匹配好地点和坐标
+    city_counts = {}
+    locations = {}
+    for region in nz_distribution:
+        for city in region["children"]:
+            location = city["location"]
+            if location is not None:
+                name = location["name"]
+                city_counts[name] = city_counts.get(name, 0) + city["value"]
+                locations[name] = location
+    city_counts = pd.Series(city_counts, dtype=np.int64).sort_values(
+        ascending=False, kind="stable"
+    )
 
     # 定义气泡大小缩放函数
     def scale_bubble_size(count, min_size=10, max_size=100):
@@ -468,8 +295,8 @@ def plot_nz_city_map(members):
     # 添加 City 数据
     fig_map.add_trace(
         go.Scattermapbox(
-            lat=[nz_regions_cities[city][0] for city in city_counts.index],
-            lon=[nz_regions_cities[city][1] for city in city_counts.index],
+            lat=[locations[city]["latitude"] for city in city_counts.index],
+            lon=[locations[city]["longitude"] for city in city_counts.index],
             mode="markers",
             marker=go.scattermapbox.Marker(
                 size=scale_bubble_size(city_counts.values),
@@ -492,30 +319,52 @@ def plot_nz_city_map(members):
     return fig_map
 
 
+FIGURES = {
+    "region_distribution": plot_regions,
+    "membership_status": plot_membership_status,
+    "payment_distribution": plot_payment_amount_distribution,
+    "renewal_funnel": plot_renewal_funnel,
+    "income_trend": plot_income_trend,
+    "nz_city_distribution": plot_nz_city_map,
+    "activity_heatmap": plot_member_activity_heatmap,
+    "new_members": plot_new_members,
+}
+
+
+# 图表按聚合结果的 ETag 缓存：数据版本变化（或会员状态随时间变化）时才重新生成，
+# 其余的页面刷新只需重新渲染
+@st.cache_resource(max_entries=64)
+def build_figure(name, etag, _snapshot):
+    return FIGURES[name](_snapshot.result(name))
+
+
+def figure(snapshot, name):
+    return build_figure(name, snapshot.body(name).etag, snapshot)
+
+
 def dashboard_layout():
     st.markdown(
         "<h1 style='text-align: center; margin-bottom: 2rem;'>Cita Membership Dashboard</h1>",
         unsafe_allow_html=True,
     )
 
-    members, payments = load_and_preprocess_data()
-
-    # 计算关键指标
-    total_members, active_members, new_members_this_month = calculate_key_metrics(
-        members
-    )
+    # 同一次渲染中的所有图表来自同一个数据版本
+    snapshot = load_store().current.snapshot
 
     # 关键指标
+    key_metrics = snapshot.result("key_metrics")
     col1, col2, col3 = st.columns(3)
     with col1:
-        display_metric_card("Total Members", total_members)
+        display_metric_card("Total Members", key_metrics["total_members"])
     with col2:
-        display_metric_card("Active Members", active_members)
+        display_metric_card("Active Members", key_metrics["active_members"])
     with col3:
-        display_metric_card("New Members This Month", new_members_this_month)
+        display_metric_card(
+            "New Members This Month", key_metrics["new_members_this_month"]
+        )
 
     # 会员分布
-    fig1, fig2 = process_and_visualize_regions(members, "Region")
+    fig1, fig2 = figure(snapshot, "region_distribution")
     col1, col2 = st.columns([1, 2])
     with col1:
         st.plotly_chart(fig1, use_container_width=True)
@@ -525,33 +374,30 @@ def dashboard_layout():
     # 会员状态
     col1, col2, col3 = st.columns(3)
     with col1:
-        st.plotly_chart(plot_membership_status(members), use_container_width=True)
+        st.plotly_chart(
+            figure(snapshot, "membership_status"), use_container_width=True
+        )
     with col2:
         st.plotly_chart(
-            plot_payment_amount_distribution(payments), use_container_width=True
+            figure(snapshot, "payment_distribution"), use_container_width=True
         )
     with col3:
-        st.plotly_chart(plot_renewal_funnel(members), use_container_width=True)
+        st.plotly_chart(figure(snapshot, "renewal_funnel"), use_container_width=True)
 
     # 会员充值分析
-    income_trend_fig = plot_income_trend(payments)
-    st.plotly_chart(income_trend_fig, use_container_width=True)
+    st.plotly_chart(figure(snapshot, "income_trend"), use_container_width=True)
 
     # 会员活动和地理分布
     col1, col2 = st.columns([1, 2])
     with col1:
-        nz_map_fig = plot_nz_city_map(members)
-        if nz_map_fig is not None:
-            st.plotly_chart(nz_map_fig, use_container_width=True)
-        else:
-            st.write("No data available for New Zealand map.")
+        st.plotly_chart(
+            figure(snapshot, "nz_city_distribution"), use_container_width=True
+        )
     with col2:
-        activity_heatmap_fig = plot_member_activity_heatmap(members)
-        st.plotly_chart(activity_heatmap_fig, use_container_width=True)
+        st.plotly_chart(figure(snapshot, "activity_heatmap"), use_container_width=True)
 
     # 新会员注册趋势
-    new_members_fig = plot_new_members(members)
-    st.plotly_chart(new_members_fig, use_container_width=True)
+    st.plotly_chart(figure(snapshot, "new_members"), use_container_width=True)
 
 
 # 运行 Dashboard